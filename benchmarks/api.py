@@ -0,0 +1,114 @@
+import functools
+
+import hg
+
+
+def make_tracks(n_tracks: int):
+    return [
+        hg.track("horizontal-line", tilesetUid=f"t{i}", server="s")
+        for i in range(n_tracks)
+    ]
+
+
+def make_views(n_views: int):
+    return [
+        hg.view(
+            hg.track("heatmap", tilesetUid="a", server="s"),
+            (hg.track("horizontal-line", tilesetUid="b", server="s"), "top"),
+        )
+        for _ in range(n_views)
+    ]
+
+
+class TrackCreation:
+    params = [10, 1_000, 10_000]
+    param_names = ["n_tracks"]
+
+    def time_track(self, n_tracks):
+        make_tracks(n_tracks)
+
+    def time_combine(self, n_tracks):
+        axis = hg.track("top-axis")
+        for track in make_tracks(n_tracks):
+            hg.combine(track, axis)
+
+    def time_divide(self, n_tracks):
+        tracks = make_tracks(n_tracks)
+        for t1, t2 in zip(tracks, tracks[1:]):
+            hg.divide(t1, t2)
+
+
+class ChainedEdits:
+    params = [10, 100]
+    param_names = ["depth"]
+
+    def setup(self, depth):
+        self.track = hg.track("horizontal-line", tilesetUid="a", server="s")
+
+    def time_opts(self, depth):
+        track = self.track
+        for i in range(depth):
+            track = track.opts(lineStrokeWidth=i)
+
+    def time_properties(self, depth):
+        track = self.track
+        for i in range(depth):
+            track = track.properties(height=i)
+
+    def time_opts_inplace(self, depth):
+        for i in range(depth):
+            self.track.opts(lineStrokeWidth=i, inplace=True)
+
+
+class Concat:
+    params = [10, 100]
+    param_names = ["n_views"]
+
+    def setup(self, n_views):
+        self.views = make_views(n_views)
+
+    def time_hconcat(self, n_views):
+        functools.reduce(lambda a, b: a | b, self.views)
+
+    def time_vconcat(self, n_views):
+        functools.reduce(lambda a, b: a / b, self.views)
+
+
+class Locks:
+    params = [10, 100]
+    param_names = ["n_views"]
+
+    def setup(self, n_views):
+        self.views = make_views(n_views)
+        conf = self.views[0].viewconf()
+        conf.views.extend(self.views[1:])
+        self.conf = conf
+
+    def time_shared_lock(self, n_views):
+        self.conf.locks(hg.lock(*self.views))
+
+    def time_pairwise_locks(self, n_views):
+        locks = [hg.lock(a, b) for a, b in zip(self.views, self.views[1:])]
+        self.conf.locks(zoom=locks, location=locks)
+
+    def time_value_scale_locks(self, n_views):
+        pairs = [(view, view.tracks.center[0]) for view in self.views]
+        self.conf.locks(hg.lock(*pairs))
+
+
+class Serialize:
+    params = [10, 1_000, 10_000]
+    param_names = ["n_tracks"]
+
+    def setup(self, n_tracks):
+        tracks = make_tracks(n_tracks)
+        self.conf = hg.view(*tracks).viewconf()
+
+    def time_json(self, n_tracks):
+        self.conf.json()
+
+    def time_dict(self, n_tracks):
+        self.conf.dict()
+
+    def peakmem_json(self, n_tracks):
+        self.conf.json()
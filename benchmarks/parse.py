@@ -0,0 +1,33 @@
+import hg
+
+
+def make_viewconf(n_views: int) -> hg.Viewconf:
+    views = []
+    for _ in range(n_views):
+        heatmap = hg.track("heatmap", tilesetUid="a", server="s")
+        line = hg.track("horizontal-line", tilesetUid="b", server="s")
+        combined = hg.combine(line, hg.track("top-axis"))
+        views.append(hg.view(heatmap, line, (combined, "top")).domain(x=(0, 1e6)))
+    conf = views[0].viewconf()
+    conf.views.extend(views[1:])
+    return conf.locks(hg.lock(*views))
+
+
+class ParseViewconf:
+    params = [10, 1_000]
+    param_names = ["n_views"]
+
+    def setup(self, n_views):
+        self.raw = make_viewconf(n_views).json()
+
+    def time_parse_raw(self, n_views):
+        hg.Viewconf.parse_raw(self.raw)
+
+    def time_parse_raw_unvalidated(self, n_views):
+        hg.Viewconf.parse_raw(self.raw, validate=False)
+
+    def time_parse_raw_unvalidated_then_validate(self, n_views):
+        hg.Viewconf.parse_raw(self.raw, validate=False).validated()
+
+    def time_roundtrip_unvalidated(self, n_views):
+        hg.Viewconf.parse_raw(self.raw, validate=False).json()
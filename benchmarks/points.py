@@ -0,0 +1,31 @@
+import numpy as np
+
+from hg._points import PointTiles
+
+
+class PointTileset:
+    params = [10**5, 10**6]
+    param_names = ["n_points"]
+    timeout = 300
+
+    def setup(self, n_points):
+        rng = np.random.default_rng(42)
+        # a dense cluster on a sparse background
+        self.x = np.r_[
+            rng.normal(0, 1, n_points // 2), rng.uniform(-8, 8, n_points // 2)
+        ]
+        self.y = np.r_[
+            rng.normal(0, 1, n_points // 2), rng.uniform(-8, 8, n_points // 2)
+        ]
+        self.tiles = PointTiles(self.x, self.y)
+        self.coarse = ["u.1.0.0", "u.1.0.1", "u.1.1.0", "u.1.1.1"]
+        self.fine = [f"u.5.{x}.{y}" for x in range(14, 18) for y in range(14, 18)]
+
+    def time_build_index(self, n_points):
+        PointTiles(self.x, self.y)
+
+    def time_coarse_tiles(self, n_points):
+        self.tiles.tiles(self.coarse)
+
+    def time_fine_tiles(self, n_points):
+        self.tiles.tiles(self.fine)
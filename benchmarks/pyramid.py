@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+import hg._snapshot as snapshot
+import hg.tilesets
+
+# clodius-readable inputs, e.g. HG_BENCH_BIGWIG=/data/signal.bw
+INPUTS = {
+    "bigwig": os.environ.get("HG_BENCH_BIGWIG"),
+    "cooler": os.environ.get("HG_BENCH_COOLER"),
+    "multivec": os.environ.get("HG_BENCH_MULTIVEC"),
+}
+MAX_ZOOM = 6
+
+
+class ServeTiles:
+    params = list(INPUTS)
+    param_names = ["format"]
+    timeout = 600
+
+    def setup(self, fmt):
+        filepath = INPUTS[fmt]
+        if filepath is None:
+            raise NotImplementedError(f"set HG_BENCH_{fmt.upper()} to benchmark")
+        self.source = getattr(hg.tilesets, fmt)(filepath)
+        self.tmp = tempfile.TemporaryDirectory()
+        hg.tilesets.to_pyramid(self.source, self.tmp.name, max_zoom=MAX_ZOOM)
+        self.pyramid = hg.tilesets.pyramid(self.tmp.name)
+
+        info = self.source.info()
+        self.tids = sorted(snapshot.zoom_tile_ids("x", info, MAX_ZOOM))[:64]
+
+    def teardown(self, fmt):
+        self.tmp.cleanup()
+
+    def time_clodius(self, fmt):
+        self.source.tiles(self.tids)
+
+    def time_pyramid(self, fmt):
+        self.pyramid.tiles(self.tids)
+
+    def time_pyramid_raw(self, fmt):
+        self.pyramid.raw_tiles(self.tids)
@@ -0,0 +1,32 @@
+import json
+
+import numpy as np
+
+from hg._tiles import decode_dense_tile, format_dense_tile, pack_tiles, unpack_tiles
+
+
+class TileEncoding:
+    params = [1, 64]
+    param_names = ["n_tiles"]
+
+    def setup(self, n_tiles):
+        rng = np.random.default_rng(42)
+        self.tiles = [
+            (f"uid.8.{i}.{i}", format_dense_tile(rng.random((256, 256)) * 1e6))
+            for i in range(n_tiles)
+        ]
+        self.json = json.dumps(dict(self.tiles))
+        self.packed = pack_tiles(self.tiles)
+
+    def time_json_encode(self, n_tiles):
+        json.dumps(dict(self.tiles))
+
+    def time_json_decode(self, n_tiles):
+        for tile in json.loads(self.json).values():
+            decode_dense_tile(tile)
+
+    def time_pack_tiles(self, n_tiles):
+        pack_tiles(self.tiles)
+
+    def time_unpack_tiles(self, n_tiles):
+        unpack_tiles(self.packed)
@@ -9,10 +9,15 @@ import hg.tilesets
 from hg.api import *  # overrides classes with same name from higlass_schema
 from hg.fuse import fuse
 from hg.server import server
-from hg.tilesets import remote
+from hg.tilesets import remote, to_pyramid
 
 bigwig = server.register(hg.tilesets.bigwig)
 multivec = server.register(hg.tilesets.multivec)
+bigwig_stack = server.register(hg.tilesets.bigwig_stack)
 cooler = server.register(hg.tilesets.cooler)
 hitile = server.register(hg.tilesets.hitile)
+xarray = server.register(hg.tilesets.xarray)
+points = server.register(hg.tilesets.points)
+pyramid = server.register(hg.tilesets.pyramid)
 bed2ddb = server.register(hg.tilesets.bed2ddb)
+arithmetic = server.register(hg.tilesets.arithmetic)
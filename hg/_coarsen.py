@@ -0,0 +1,427 @@
+"""Serve single-resolution .cool files as a multiresolution tileset.
+
+Coarser zoom levels are computed on demand by summing the pixel table
+over each requested tile, instead of running `cooler zoomify` upfront.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import math
+import os
+import pathlib
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+import hg._memory as memory
+
+from ._normalize import cis_expected, ice, observed_over_expected
+from ._snapshot import default_cache_dir
+from ._tiles import format_dense_tile
+
+TILE_SIZE = 256
+
+# maximum number of pixels read from the file at once
+CHUNK_SIZE = 2**22
+
+TileKey = Tuple[int, int, int, bool]
+
+
+def is_single_resolution(f) -> bool:
+    return "pixels" in f and "resolutions" not in f
+
+
+def check_mcool_transforms(filepath, tile_ids: Sequence[str]):
+    """Raise a ValueError for tiles of a zoomified .mcool file in transforms
+    that clodius can't serve.
+
+    The weights and expected vectors of `CoarsenedCooler` are only computed
+    for single-resolution files. Clodius balances .mcool tiles with the
+    weights stored in the file, and has no observed/expected transform.
+    """
+    requests = []
+    for tile_id in tile_ids:
+        _, *parts = tile_id.split(".")
+        transform = parts[3] if len(parts) > 3 else "default"
+        if transform == "oe":
+            raise ValueError(
+                'The "oe" transform is only available for single-resolution '
+                f".cool files, not zoomified .mcool files ({tile_id})"
+            )
+        if transform == "weight":
+            requests.append((tile_id, int(parts[0])))
+    if not requests:
+        return
+
+    import h5py
+
+    with h5py.File(filepath, "r") as f:
+        resolutions = sorted(map(int, f["resolutions"]), reverse=True)
+        for tile_id, zoom in requests:
+            resolution = resolutions[min(zoom, len(resolutions) - 1)]
+            if "weight" not in f[f"resolutions/{resolution}/bins"]:
+                raise ValueError(
+                    f"No balancing weights stored at resolution {resolution}, "
+                    "balance the .mcool file or use a single-resolution .cool "
+                    f"file for computed weights ({tile_id})"
+                )
+
+
+class CoarsenedCooler:
+    """Tiles for a single-resolution .cool file at zoom levels 2**k coarser.
+
+    Dense tiles are computed with vectorized block sums over the pixel
+    table and kept in an LRU cache of at most `cache_bytes`. Tiles whose
+    four children are cached are built by summing the children instead of
+    reading the file.
+
+    Balancing weights (if the file has none) and expected vectors for
+    observed/expected tiles are computed on first use, per chromosome on
+    `max_workers` threads, and saved in `cache_dir`.
+    """
+
+    def __init__(
+        self,
+        filepath,
+        cache_bytes: int = 2**25,
+        cache_dir: Union[None, str, pathlib.Path] = None,
+        max_workers: Optional[int] = None,
+    ):
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        # held while computing normalizations, which may need the weights
+        self._norm_lock = threading.RLock()
+        self.filepath = filepath
+        self.cache_bytes = cache_bytes
+        self.cache_dir = pathlib.Path(cache_dir or default_cache_dir() / "cooler")
+        self.max_workers = max_workers
+        self._cache: "collections.OrderedDict[TileKey, np.ndarray]"
+        self._cache = collections.OrderedDict()
+        self._cache_nbytes = 0
+        self._open()
+
+    def _open(self):
+        import h5py
+
+        self._file = h5py.File(self.filepath, "r")
+        f = self._file
+
+        self.resolution = int(f.attrs["bin-size"])
+        names = f["chroms/name"][:].astype(str)
+        lengths = f["chroms/length"][:].astype(np.int64)
+        self.chromsizes = [[n, int(l)] for n, l in zip(names, lengths)]
+
+        self.chrom_offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+        bin_chroms = f["bins/chrom"][:]
+        # first bin of each chromosome, and the end of the last one
+        self.chrom_bins = np.searchsorted(bin_chroms, np.arange(len(names) + 1))
+        # genome-wide start of each bin, monotonic
+        self.bin_starts = self.chrom_offsets[bin_chroms] + f["bins/start"][:]
+        self.weights = f["bins/weight"][:] if "weight" in f["bins"] else None
+        self.bin1_offset = f["indexes/bin1_offset"][:]
+
+        self.total_length = int(lengths.sum())
+        self.max_zoom = max(
+            0, math.ceil(math.log2(self.total_length / (TILE_SIZE * self.resolution)))
+        )
+        # computed weights and expected vectors, see `_normalization`
+        self._norm: Dict[str, np.ndarray] = {}
+        self._norm_path = self.cache_dir / f"{self._file_key()}.npz"
+        self._norm_loaded = False
+
+    def _file_key(self) -> str:
+        """Identifies the file and its version, for the normalization cache."""
+        if isinstance(self.filepath, (str, os.PathLike)):
+            path = os.path.abspath(self.filepath)
+            stat = os.stat(path)
+            key = f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+        else:
+            key = getattr(self.filepath, "url", repr(self.filepath))
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def reload(self):
+        """Re-read the file after it changed on disk, dropping cached tiles."""
+        with self._norm_lock, self._lock, self._cache_lock:
+            self._file.close()
+            self._cache.clear()
+            self._cache_nbytes = 0
+            self._open()
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the bin index, normalizations and cached tiles."""
+        arrays = [self.bin_starts, self.bin1_offset, self.weights]
+        index = sum(a.nbytes for a in arrays if a is not None)
+        index += sum(a.nbytes for a in list(self._norm.values()))
+        return index + self._cache_nbytes
+
+    def evict(self, nbytes: int) -> int:
+        """Drop least recently used tiles from the cache."""
+        freed = 0
+        with self._cache_lock:
+            while freed < nbytes and self._cache:
+                _, tile = self._cache.popitem(last=False)
+                freed += tile.nbytes
+            self._cache_nbytes -= freed
+        return freed
+
+    @property
+    def resolutions(self) -> List[int]:
+        return [self.resolution * 2**k for k in range(self.max_zoom + 1)]
+
+    def tileset_info(self) -> Dict[str, Any]:
+        return {
+            "min_pos": [1, 1],
+            "max_pos": [self.total_length, self.total_length],
+            "resolutions": self.resolutions,
+            "bins_per_dimension": TILE_SIZE,
+            "chromsizes": self.chromsizes,
+            # computed on first use if the file has no weights
+            "transforms": [
+                {"name": "ICE", "value": "weight"},
+                {"name": "Observed/Expected", "value": "oe"},
+            ],
+        }
+
+    def _normalization(
+        self, name: str, compute: Callable[[], Dict[str, np.ndarray]]
+    ) -> np.ndarray:
+        """The array `name`, loaded from the cache file or computed (with
+        related arrays) by `compute` and saved."""
+        with self._norm_lock:
+            if not self._norm_loaded:
+                self._norm_loaded = True
+                if self._norm_path.exists():
+                    with np.load(self._norm_path) as saved:
+                        self._norm.update(saved)
+            if name not in self._norm:
+                self._norm.update(compute())
+                self._norm_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self._norm_path.with_suffix(".tmp.npz")
+                # savez takes arrays by keyword next to its `allow_pickle` flag
+                arrays: Dict[str, Any] = self._norm
+                np.savez(tmp, **arrays)
+                os.replace(tmp, self._norm_path)
+            return self._norm[name]
+
+    def _chrom_pixels(self, chrom: int):
+        """Pixels with bin1 on chromosome `chrom`, with its bin range."""
+        lo, hi = int(self.chrom_bins[chrom]), int(self.chrom_bins[chrom + 1])
+        start, end = self.bin1_offset[lo], self.bin1_offset[hi]
+        chunks = [
+            self._read_pixels(i, min(i + CHUNK_SIZE, end))
+            for i in range(start, end, CHUNK_SIZE)
+        ]
+        if not chunks:
+            empty = np.zeros(0, dtype=np.int64)
+            return lo, hi, empty, empty, np.zeros(0)
+        bin1, bin2, values = (np.concatenate(parts) for parts in zip(*chunks))
+        return lo, hi, bin1, bin2, values
+
+    def _map_chroms(self, fn: Callable[[int], Any]) -> List[Any]:
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            return list(executor.map(fn, range(len(self.chromsizes))))
+
+    def balancing_weights(self) -> np.ndarray:
+        """The weights of the file, or cis-only ICE weights computed once."""
+        if self.weights is not None:
+            return self.weights
+
+        def balance(chrom: int) -> np.ndarray:
+            lo, hi, bin1, bin2, values = self._chrom_pixels(chrom)
+            cis = bin2 < hi
+            return ice(bin1[cis] - lo, bin2[cis] - lo, values[cis], hi - lo)
+
+        return self._normalization(
+            "weight", lambda: {"weight": np.concatenate(self._map_chroms(balance))}
+        )
+
+    def expected(self, zoom: int, balanced: bool) -> Tuple[np.ndarray, float]:
+        """Expected values by chromosome (rows) and distance (columns), and
+        between chromosomes, at `zoom`. Computed for all zoom levels at once.
+
+        Like cooltools, the cis expected is computed per chromosome. The
+        trans expected is a single average over all pairs of chromosomes.
+        """
+        prefix = "balanced" if balanced else "raw"
+        resolutions = [
+            self.resolution * 2 ** (self.max_zoom - z) for z in range(self.max_zoom + 1)
+        ]
+
+        def chrom_expected(chrom: int, weights: Optional[np.ndarray]):
+            lo, hi, bin1, bin2, values = self._chrom_pixels(chrom)
+            valid = np.ones(hi - lo, dtype=bool)
+            if weights is not None:
+                values = np.nan_to_num(values * weights[bin1] * weights[bin2])
+                valid = np.isfinite(weights[lo:hi])
+            cis = bin2 < hi
+            stats = cis_expected(
+                bin1[cis] - lo,
+                bin2[cis] - lo,
+                values[cis],
+                self.bin_starts[lo:hi],
+                valid,
+                resolutions,
+            )
+            return stats, values[~cis].sum()
+
+        def compute() -> Dict[str, np.ndarray]:
+            weights = self.balancing_weights() if balanced else None
+            results = self._map_chroms(lambda chrom: chrom_expected(chrom, weights))
+            trans_sum = sum(trans for _, trans in results)
+            arrays = {}
+            for z in range(self.max_zoom + 1):
+                per_chrom = [stats[z] for stats, _ in results]
+                size = max(len(sums) for sums, _, _ in per_chrom)
+                cis = np.full((len(per_chrom), size), np.nan)
+                for row, (sums, counts, _) in enumerate(per_chrom):
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        cis[row, : len(sums)] = np.where(
+                            counts > 0, sums / counts, np.nan
+                        )
+                arrays[f"{prefix}_cis_by_chrom_{z}"] = cis
+                n_valid = np.array([n for _, _, n in per_chrom], dtype=np.float64)
+                trans_pairs = (n_valid.sum() ** 2 - (n_valid**2).sum()) / 2
+                trans = trans_sum / trans_pairs if trans_pairs else np.nan
+                arrays[f"{prefix}_trans_{z}"] = np.array(trans)
+            return arrays
+
+        cis = self._normalization(f"{prefix}_cis_by_chrom_{zoom}", compute)
+        trans = self._normalization(f"{prefix}_trans_{zoom}", compute)
+        return cis, float(trans)
+
+    def _read_pixels(self, start: int, stop: int):
+        f = self._file
+        with self._lock:
+            bin1 = f["pixels/bin1_id"][start:stop]
+            bin2 = f["pixels/bin2_id"][start:stop]
+            values = f["pixels/count"][start:stop].astype(np.float64)
+        return bin1, bin2, values
+
+    def _bin_range(self, start: int, end: int) -> Tuple[int, int]:
+        lo, hi = np.searchsorted(self.bin_starts, [start, end])
+        return int(lo), int(hi)
+
+    def _accumulate(
+        self,
+        out: np.ndarray,
+        rows: Tuple[int, int],
+        cols: Tuple[int, int],
+        origin: Tuple[int, int],
+        resolution: int,
+        weights: Optional[np.ndarray],
+        mirror: bool,
+        symmetric: bool = False,
+    ):
+        """Add pixels with bin1 in `rows` and bin2 in `cols` to `out`.
+
+        The tile is symmetric, so pixels from the upper triangle are placed
+        at (bin2, bin1), or (bin1, bin2) if `mirror`. For tiles on the
+        diagonal (`rows == cols`), `symmetric` places them at both.
+        """
+        lo, hi = self.bin1_offset[rows[0]], self.bin1_offset[rows[1]]
+        for start in range(lo, hi, CHUNK_SIZE):
+            stop = min(start + CHUNK_SIZE, hi)
+            bin1, bin2, values = self._read_pixels(start, stop)
+
+            mask = (bin2 >= cols[0]) & (bin2 < cols[1])
+            if mirror:
+                mask &= bin1 != bin2
+            bin1, bin2, values = bin1[mask], bin2[mask], values[mask]
+
+            if weights is not None:
+                values *= weights[bin1] * weights[bin2]
+                values = np.nan_to_num(values, copy=False)
+
+            x_bins, y_bins = (bin2, bin1) if mirror else (bin1, bin2)
+            i = (self.bin_starts[x_bins] - origin[0]) // resolution
+            j = (self.bin_starts[y_bins] - origin[1]) // resolution
+            out += np.bincount(
+                j * TILE_SIZE + i, weights=values, minlength=TILE_SIZE**2
+            ).reshape(TILE_SIZE, TILE_SIZE)
+            if symmetric:
+                off = bin1 != bin2
+                out += np.bincount(
+                    i[off] * TILE_SIZE + j[off],
+                    weights=values[off],
+                    minlength=TILE_SIZE**2,
+                ).reshape(TILE_SIZE, TILE_SIZE)
+
+    def _from_children(self, zoom: int, x: int, y: int, balanced: bool):
+        keys = [
+            (zoom + 1, 2 * x + dx, 2 * y + dy, balanced)
+            for dy in (0, 1)
+            for dx in (0, 1)
+        ]
+        if zoom == self.max_zoom or not all(key in self._cache for key in keys):
+            return None
+        # children are laid out as rows (y) of columns (x)
+        top_left, top_right, bottom_left, bottom_right = (self._cache[k] for k in keys)
+        full = np.block([[top_left, top_right], [bottom_left, bottom_right]])
+        return full.reshape(TILE_SIZE, 2, TILE_SIZE, 2).sum(axis=(1, 3))
+
+    def dense_tile(self, zoom: int, x: int, y: int, balanced: bool) -> np.ndarray:
+        key = (zoom, x, y, balanced)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            out = self._from_children(zoom, x, y, balanced)
+
+        if out is None:
+            resolution = self.resolution * 2 ** (self.max_zoom - zoom)
+            width = TILE_SIZE * resolution
+            x0, y0 = x * width, y * width
+            rows = self._bin_range(x0, x0 + width)
+            cols = self._bin_range(y0, y0 + width)
+            weights = self.balancing_weights() if balanced else None
+            out = np.zeros((TILE_SIZE, TILE_SIZE))
+            origin = (x0, y0)
+            if x == y:
+                # both triangles come from the same pixels, read them once
+                self._accumulate(
+                    out, rows, cols, origin, resolution, weights, False, True
+                )
+            else:
+                self._accumulate(out, rows, cols, origin, resolution, weights, False)
+                self._accumulate(out, cols, rows, origin, resolution, weights, True)
+
+        with self._cache_lock:
+            previous = self._cache.pop(key, None)
+            if previous is not None:
+                self._cache_nbytes -= previous.nbytes
+            self._cache[key] = out
+            self._cache_nbytes += out.nbytes
+            while self._cache_nbytes > self.cache_bytes and self._cache:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_nbytes -= evicted.nbytes
+        memory.budget.check()
+        return out
+
+    def tiles(self, tile_ids: Sequence[str]) -> List[Tuple[str, Any]]:
+        tiles = []
+        for tile_id in tile_ids:
+            _, *parts = tile_id.split(".")
+            zoom, x, y = map(int, parts[:3])
+            transform = parts[3] if len(parts) > 3 else "default"
+            if transform == "default":
+                balanced = self.weights is not None
+            else:
+                balanced = transform != "none"
+            data = self.dense_tile(zoom, x, y, balanced)
+            if transform == "oe":
+                resolution = self.resolution * 2 ** (self.max_zoom - zoom)
+                width = TILE_SIZE * resolution
+                cis, trans = self.expected(zoom, balanced)
+                data = observed_over_expected(
+                    data,
+                    (x * width, y * width),
+                    resolution,
+                    self.chrom_offsets,
+                    self.total_length,
+                    cis,
+                    trans,
+                )
+            tiles.append((tile_id, format_dense_tile(data)))
+        return tiles
@@ -0,0 +1,87 @@
+"""The tile grid of HiGlass tilesets: zoom levels and the ids of the tiles
+covering a domain, computed from a tileset info."""
+import math
+from typing import Any, Dict, Optional, Sequence, Set, Tuple
+
+TILE_SIZE = 256
+
+
+def _zoom_level(info: Dict[str, Any], domain_width: float, pixel_width: int) -> int:
+    if "resolutions" in info:
+        # coarsest resolution which still has at least one bin per pixel
+        resolutions = sorted(info["resolutions"], reverse=True)
+        bp_per_px = domain_width / pixel_width
+        for zoom, resolution in enumerate(resolutions):
+            if resolution <= bp_per_px:
+                return zoom
+        return len(resolutions) - 1
+
+    # mirrors `calculateZoomLevel` in HiGlass
+    zoom_scale = max(info["max_width"] / max(domain_width, 1), 1)
+    added_zoom = max(0, math.ceil(math.log2(pixel_width / TILE_SIZE)))
+    return min(round(math.log2(zoom_scale)) + added_zoom, info["max_zoom"])
+
+
+def _tile_range(
+    domain: Sequence[float], min_pos: float, tile_width: float, n_tiles: int
+) -> range:
+    start = int((domain[0] - min_pos) // tile_width)
+    stop = int((domain[1] - min_pos) // tile_width)
+    return range(max(start, 0), min(stop, n_tiles - 1) + 1)
+
+
+def max_zoom(info: Dict[str, Any]) -> int:
+    if "resolutions" in info:
+        return len(info["resolutions"]) - 1
+    return info["max_zoom"]
+
+
+def tile_grid(info: Dict[str, Any], zoom: int) -> Tuple[float, int]:
+    """The width of tiles at `zoom` and the number of tiles along an axis."""
+    if "resolutions" in info:
+        resolutions = sorted(info["resolutions"], reverse=True)
+        tile_size = info.get("bins_per_dimension") or TILE_SIZE
+        tile_width = resolutions[zoom] * tile_size
+        n_tiles = math.ceil((info["max_pos"][0] - info["min_pos"][0]) / tile_width)
+    else:
+        tile_width = info["max_width"] / 2**zoom
+        n_tiles = 2**zoom
+    return tile_width, n_tiles
+
+
+def zoom_tile_ids(
+    uid: str,
+    info: Dict[str, Any],
+    zoom: int,
+    x_domain: Optional[Sequence[float]] = None,
+    y_domain: Optional[Sequence[float]] = None,
+) -> Set[str]:
+    """Tile ids covering a (x, y) domain at a single zoom level."""
+    min_pos, max_pos = info["min_pos"], info["max_pos"]
+    x_domain = x_domain or (min_pos[0], max_pos[0])
+    tile_width, n_tiles = tile_grid(info, zoom)
+    xs = _tile_range(x_domain, min_pos[0], tile_width, n_tiles)
+    if len(min_pos) == 1:
+        return {f"{uid}.{zoom}.{x}" for x in xs}
+    ys = _tile_range(y_domain or x_domain, min_pos[1], tile_width, n_tiles)
+    return {f"{uid}.{zoom}.{x}.{y}" for x in xs for y in ys}
+
+
+def tile_ids(
+    uid: str,
+    info: Dict[str, Any],
+    x_domain: Optional[Sequence[float]],
+    y_domain: Optional[Sequence[float]] = None,
+    pixel_width: int = 1024,
+    zoom_padding: int = 1,
+) -> Set[str]:
+    """Tile ids covering a (x, y) domain, including neighboring zoom levels."""
+    x_domain = x_domain or (info["min_pos"][0], info["max_pos"][0])
+    zoom = _zoom_level(info, x_domain[1] - x_domain[0], pixel_width)
+    zooms = range(
+        max(zoom - zoom_padding, 0), min(zoom + zoom_padding, max_zoom(info)) + 1
+    )
+    tids: Set[str] = set()
+    for z in zooms:
+        tids.update(zoom_tile_ids(uid, info, z, x_domain, y_domain))
+    return tids
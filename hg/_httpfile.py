@@ -0,0 +1,294 @@
+"""Read-only file-like access to remote files with HTTP range requests."""
+import collections
+import hashlib
+import http.client
+import io
+import logging
+import pathlib
+import re
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import hg._memory as memory
+
+logger = logging.getLogger("hg.httpfile")
+
+
+def is_url(path: object) -> bool:
+    return isinstance(path, str) and path.startswith(("http://", "https://"))
+
+
+class ConnectionPool:
+    """Keep-alive connections, reused per (scheme, host)."""
+
+    def __init__(self, maxsize: int = 8, timeout: float = 30):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+
+    def _get(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        cls = (
+            http.client.HTTPSConnection
+            if scheme == "https"
+            else http.client.HTTPConnection
+        )
+        return cls(netloc, timeout=self.timeout)
+
+    def _put(self, scheme: str, netloc: str, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        body: Optional[bytes] = None,
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        parsed = urlparse(url)
+        target = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+
+        # a pooled connection may have been closed by the server, retry once
+        for attempt in range(2):
+            conn = self._get(parsed.scheme, parsed.netloc)
+            try:
+                conn.request(method, target, body=body, headers=headers or {})
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                if attempt == 1:
+                    raise
+                continue
+            if response.will_close:
+                conn.close()
+            else:
+                self._put(parsed.scheme, parsed.netloc, conn)
+            return response.status, dict(response.getheaders()), body
+        raise AssertionError("unreachable")
+
+
+pool = ConnectionPool()
+
+
+class BlockCache:
+    """LRU cache of file blocks in memory with an optional disk layer."""
+
+    def __init__(
+        self, capacity: int = 256, cache_dir: Union[None, str, pathlib.Path] = None
+    ):
+        self.capacity = capacity
+        self.cache_dir = None if cache_dir is None else pathlib.Path(cache_dir)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._blocks: "collections.OrderedDict[Tuple[str, int, int], bytes]" = (
+            collections.OrderedDict()
+        )
+        self._nbytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held in memory."""
+        return self._nbytes
+
+    def _disk_path(self, key: Tuple[str, int, int]) -> pathlib.Path:
+        assert self.cache_dir is not None
+        url, block_size, block_num = key
+        digest = hashlib.sha1(url.encode()).hexdigest()
+        return self.cache_dir / digest / f"{block_size}.{block_num}"
+
+    def get(self, key: Tuple[str, int, int]) -> Optional[bytes]:
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return self._blocks[key]
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            if path.exists():
+                data = path.read_bytes()
+                self.disk_hits += 1
+                self._put_memory(key, data)
+                return data
+        self.misses += 1
+        return None
+
+    def _put_memory(self, key: Tuple[str, int, int], data: bytes):
+        with self._lock:
+            previous = self._blocks.pop(key, None)
+            if previous is not None:
+                self._nbytes -= len(previous)
+            self._blocks[key] = data
+            self._nbytes += len(data)
+            while len(self._blocks) > self.capacity:
+                _, evicted = self._blocks.popitem(last=False)
+                self._nbytes -= len(evicted)
+        memory.budget.check()
+
+    def evict(self, nbytes: int) -> int:
+        """Drop least recently used blocks from memory (not from disk)."""
+        freed = 0
+        with self._lock:
+            while freed < nbytes and self._blocks:
+                _, evicted = self._blocks.popitem(last=False)
+                freed += len(evicted)
+            self._nbytes -= freed
+        return freed
+
+    def put(self, key: Tuple[str, int, int], data: bytes):
+        self._put_memory(key, data)
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            tmp.replace(path)
+
+
+class HttpFile(io.RawIOBase):
+    """A seekable, read-only file backed by HTTP range requests.
+
+    Reads are split into fixed-size blocks which are cached in `cache`.
+    Missing adjacent blocks are coalesced into a single range request.
+
+    The file position is kept per thread, so threads serving concurrent
+    tile requests can share one file, each with its own seek and reads.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        block_size: int = 2**18,
+        cache: Optional[BlockCache] = None,
+        connection_pool: Optional[ConnectionPool] = None,
+    ):
+        super().__init__()
+        self.url = url
+        self.block_size = block_size
+        self.cache = cache or BlockCache()
+        memory.budget.register(f"http blocks {url}", self.cache)
+        self.pool = connection_pool or pool
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._size: Optional[int] = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.url!r})"
+
+    @property
+    def _pos(self) -> int:
+        return getattr(self._local, "pos", 0)
+
+    @_pos.setter
+    def _pos(self, pos: int):
+        self._local.pos = pos
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._size = self._fetch_size()
+        return self._size
+
+    def _fetch_size(self) -> int:
+        status, headers, _ = self.pool.request("HEAD", self.url)
+        headers = {k.lower(): v for k, v in headers.items()}
+        if status == 200 and "content-length" in headers:
+            return int(headers["content-length"])
+        # some servers don't support HEAD, ask for the first byte instead
+        status, headers, _ = self.pool.request(
+            "GET", self.url, headers={"Range": "bytes=0-0"}
+        )
+        headers = {k.lower(): v for k, v in headers.items()}
+        match = re.search(r"/(\d+)$", headers.get("content-range", ""))
+        if status != 206 or not match:
+            raise FileNotFoundError(f"Cannot determine size of {self.url} ({status})")
+        return int(match.group(1))
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        return self._pos
+
+    def _fetch_blocks(self, first: int, last: int) -> Dict[int, bytes]:
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, self.size) - 1
+        status, _, body = self.pool.request(
+            "GET", self.url, headers={"Range": f"bytes={start}-{end}"}
+        )
+        with self._lock:
+            self.requests += 1
+        if status == 200:
+            body = body[start : end + 1]
+        elif status != 206:
+            raise OSError(f"Range request for {self.url} failed ({status})")
+        blocks = {}
+        for i, block_num in enumerate(range(first, last + 1)):
+            block = body[i * self.block_size : (i + 1) * self.block_size]
+            self.cache.put((self.url, self.block_size, block_num), block)
+            blocks[block_num] = block
+        return blocks
+
+    def pread(self, size: int, offset: int) -> bytes:
+        """Read `size` bytes at `offset` without moving the file position."""
+        end = min(offset + size, self.size)
+        if offset >= end:
+            return b""
+
+        first, last = offset // self.block_size, (end - 1) // self.block_size
+        blocks: Dict[int, bytes] = {}
+        missing: List[int] = []
+        for block_num in range(first, last + 1):
+            block = self.cache.get((self.url, self.block_size, block_num))
+            if block is None:
+                missing.append(block_num)
+            else:
+                blocks[block_num] = block
+
+        # coalesce runs of adjacent missing blocks into one request each
+        runs: List[List[int]] = []
+        for block_num in missing:
+            if runs and runs[-1][-1] == block_num - 1:
+                runs[-1].append(block_num)
+            else:
+                runs.append([block_num])
+        for run in runs:
+            blocks.update(self._fetch_blocks(run[0], run[-1]))
+
+        data = b"".join(blocks[i] for i in range(first, last + 1))
+        skip = offset - first * self.block_size
+        return data[skip : skip + end - offset]
+
+    def readinto(self, b) -> int:
+        data = self.pread(len(b), self._pos)
+        n = len(data)
+        memoryview(b).cast("B")[:n] = data
+        self._pos += n
+        return n
@@ -0,0 +1,89 @@
+"""A shared memory budget for the caches of the server and its tilesets.
+
+In-memory tilesets (e.g. `hg.xarray` of a NumPy array, `hg.points`) are
+counted too, but can't evict their data, so the caches make room for them.
+"""
+import threading
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+from typing_extensions import Protocol
+
+
+class Evictable(Protocol):
+    @property
+    def nbytes(self) -> int:
+        ...
+
+    def evict(self, nbytes: int) -> int:
+        """Free at least `nbytes` (least recently used first), returns bytes freed."""
+        ...
+
+
+class MemoryBudget:
+    """Tracks the bytes held by registered caches and evicts from the largest
+    ones when their total exceeds `max_bytes`.
+
+    Caches call `check()` after growing. Eviction stops at `low_water` times
+    the budget, so that a full budget doesn't evict on every insert.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, low_water: float = 0.9):
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.evicted_bytes = 0
+        self._lock = threading.Lock()
+        # held by the thread evicting, see `check`
+        self._evict_lock = threading.Lock()
+        self._consumers: "weakref.WeakKeyDictionary[Evictable, str]"
+        self._consumers = weakref.WeakKeyDictionary()
+
+    def register(self, name: str, consumer: Evictable):
+        with self._lock:
+            self._consumers[consumer] = name
+
+    def _sizes(self) -> List[Tuple[str, Evictable, int]]:
+        with self._lock:
+            consumers = list(self._consumers.items())
+        return [(name, consumer, consumer.nbytes) for consumer, name in consumers]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(size for *_, size in self._sizes())
+
+    def check(self):
+        if self.max_bytes is None:
+            return
+        # one thread evicts at a time, others skip rather than evicting the
+        # same overage again from their own snapshot of the sizes
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            self._evict(self.max_bytes)
+        finally:
+            self._evict_lock.release()
+
+    def _evict(self, max_bytes: int):
+        sizes = self._sizes()
+        total = sum(size for *_, size in sizes)
+        if total <= max_bytes:
+            return
+
+        target = int(max_bytes * self.low_water)
+        candidates = sorted(sizes, key=lambda entry: entry[2], reverse=True)
+        for _, consumer, size in candidates:
+            if total <= target:
+                break
+            freed = consumer.evict(min(total - target, size))
+            self.evicted_bytes += freed
+            total -= freed
+
+    def report(self) -> Dict[str, int]:
+        """Bytes held per consumer name, largest first."""
+        usage: Dict[str, int] = {}
+        for name, _, size in self._sizes():
+            usage[name] = usage.get(name, 0) + size
+        return dict(sorted(usage.items(), key=lambda item: item[1], reverse=True))
+
+
+budget = MemoryBudget()
@@ -0,0 +1,137 @@
+"""Balancing weights and expected (distance decay) vectors of Hi-C matrices.
+
+The functions work on the cis pixels of one chromosome, (bin1, bin2, value)
+with bin1 <= bin2 and bins local to the chromosome, so chromosomes can be
+processed in parallel.
+"""
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+def ice(
+    bin1: np.ndarray,
+    bin2: np.ndarray,
+    values: np.ndarray,
+    n_bins: int,
+    ignore_diags: int = 2,
+    min_nnz: int = 10,
+    tol: float = 1e-5,
+    max_iter: int = 200,
+) -> np.ndarray:
+    """Iterative correction weights, like `cooler balance --cis-only`.
+
+    Bins with fewer than `min_nnz` nonzero pixels (off the first
+    `ignore_diags` diagonals) are masked with NaN. Weights are scaled so
+    that rows of the balanced matrix sum to 1 on average.
+    """
+    keep = bin2 - bin1 >= ignore_diags
+    bin1, bin2, values = bin1[keep], bin2[keep], values[keep].astype(np.float64)
+    nnz = np.bincount(bin1, minlength=n_bins) + np.bincount(bin2, minlength=n_bins)
+    bad = nnz < min_nnz
+    keep = ~(bad[bin1] | bad[bin2])
+    bin1, bin2, values = bin1[keep], bin2[keep], values[keep]
+
+    def marginals(bias: np.ndarray) -> np.ndarray:
+        balanced = values * bias[bin1] * bias[bin2]
+        return np.bincount(bin1, balanced, n_bins) + np.bincount(bin2, balanced, n_bins)
+
+    bias = np.where(bad, 0.0, 1.0)
+    for _ in range(max_iter):
+        marg = marginals(bias)
+        nonzero = marg[marg > 0]
+        if not nonzero.size:
+            break
+        marg /= nonzero.mean()
+        marg[marg == 0] = 1
+        bias /= marg
+        if nonzero.var() / nonzero.mean() ** 2 < tol:
+            break
+
+    marg = marginals(bias)
+    nonzero = marg[marg > 0]
+    if nonzero.size:
+        bias /= np.sqrt(nonzero.mean())
+    bias[bias == 0] = np.nan
+    return bias
+
+
+def autocorrelation(valid: np.ndarray) -> np.ndarray:
+    """Number of pairs (i, i + d) of valid bins for each distance d."""
+    n = len(valid)
+    if n == 0:
+        return np.zeros(0)
+    spectrum = np.fft.rfft(valid.astype(np.float64), 2 * n)
+    counts = np.fft.irfft(spectrum * spectrum.conj(), 2 * n)[:n]
+    return np.round(counts)
+
+
+def cis_expected(
+    bin1: np.ndarray,
+    bin2: np.ndarray,
+    values: np.ndarray,
+    starts: np.ndarray,
+    valid: np.ndarray,
+    resolutions: Sequence[int],
+) -> List[Tuple[np.ndarray, np.ndarray, int]]:
+    """(sums, pair counts) by distance and the number of valid bins, per
+    resolution, for one chromosome.
+
+    `starts` are the (genome-wide) starts of the chromosome's bins and
+    `valid` masks bins with a weight. Coarse bins are `start // resolution`,
+    like the bins of dense tiles. Values are for the full symmetric matrix:
+    off-diagonal pixels which fall on the diagonal of a coarse bin count
+    twice.
+    """
+    result = []
+    diagonal = bin1 == bin2
+    for resolution in resolutions:
+        coarse = starts // resolution
+        coarse -= coarse[0] if len(coarse) else 0
+        distance = coarse[bin2] - coarse[bin1]
+        weights = np.where((distance == 0) & ~diagonal, 2 * values, values)
+        n_coarse = int(coarse[-1]) + 1 if len(coarse) else 0
+        sums = np.bincount(distance, weights, minlength=n_coarse)
+        coarse_valid = np.zeros(n_coarse, dtype=bool)
+        coarse_valid[coarse[valid]] = True
+        result.append((sums, autocorrelation(coarse_valid), int(coarse_valid.sum())))
+    return result
+
+
+def observed_over_expected(
+    tile: np.ndarray,
+    origin: Tuple[int, int],
+    resolution: int,
+    chrom_offsets: np.ndarray,
+    total_length: int,
+    cis: np.ndarray,
+    trans: float,
+) -> np.ndarray:
+    """Divide a dense tile, with rows along y, by the expected values.
+
+    `cis` are expected values by chromosome (rows) and distance (columns,
+    in bins of `resolution`), and `trans` the expected value between
+    chromosomes. Bins past `total_length` are NaN.
+    """
+    size = tile.shape[0]
+    i = origin[0] // resolution + np.arange(size)
+    j = origin[1] // resolution + np.arange(size)
+    chrom_i = np.searchsorted(chrom_offsets, i * resolution, side="right") - 1
+    chrom_j = np.searchsorted(chrom_offsets, j * resolution, side="right") - 1
+
+    distance = np.abs(j[:, None] - i[None, :])
+    n_distances = cis.shape[1]
+    padded = np.c_[cis, np.full(len(cis), np.nan)]
+    expected = np.where(
+        chrom_j[:, None] == chrom_i[None, :],
+        padded[chrom_j[:, None], np.minimum(distance, n_distances)],
+        trans,
+    )
+    outside = (j * resolution >= total_length)[:, None] | (
+        i * resolution >= total_length
+    )[None, :]
+    expected[outside] = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = tile / expected
+    out[~np.isfinite(out)] = np.nan
+    return out
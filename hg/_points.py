@@ -0,0 +1,184 @@
+"""Tiles of large 2D point clouds, indexed along a Z-order (Morton) curve.
+
+Points are binned on a 2**DEPTH square grid and sorted by the Morton code of
+their cell, so the points of any quadtree tile are a contiguous slice found
+with `np.searchsorted`. Each point gets a random priority and is shown from
+the first zoom level at which it is among the `max_points` highest priority
+points of its tile. Coarse tiles thus hold a density-aware sample of their
+points, and points shown at one zoom level stay visible when zooming in.
+"""
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+# bits per axis of the Morton codes
+DEPTH = 24
+
+
+def _spread_bits(v: np.ndarray) -> np.ndarray:
+    """Interleave zeros between the low 32 bits of `v`."""
+    v = v.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in (
+        (16, 0x0000FFFF0000FFFF),
+        (8, 0x00FF00FF00FF00FF),
+        (4, 0x0F0F0F0F0F0F0F0F),
+        (2, 0x3333333333333333),
+        (1, 0x5555555555555555),
+    ):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Z-order codes of integer cell coordinates, x in the even bits."""
+    return _spread_bits(x) | (_spread_bits(y) << np.uint64(1))
+
+
+class PointTiles:
+    """Quadtree tiles of the points (`x`, `y`) with per-point `columns`."""
+
+    def __init__(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        columns: Optional[Mapping[str, np.ndarray]] = None,
+        max_points: int = 1000,
+        max_zoom: Optional[int] = None,
+        seed: int = 0,
+    ):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if x.shape != y.shape or x.ndim != 1:
+            raise ValueError("x and y must be 1D arrays of the same length")
+        keep = np.isfinite(x) & np.isfinite(y)
+        columns = {k: np.asarray(v)[keep] for k, v in (columns or {}).items()}
+        self.x, self.y = x[keep], y[keep]
+        self.columns = columns
+        self.max_points = max_points
+
+        n = len(self.x)
+        self.min_pos = [
+            float(self.x.min()) if n else 0.0,
+            float(self.y.min()) if n else 0.0,
+        ]
+        extent = max(np.ptp(self.x) if n else 0.0, np.ptp(self.y) if n else 0.0)
+        self.max_width = float(extent) or 1.0
+
+        cells = 2**DEPTH
+        scale = cells / self.max_width
+        cx = np.clip(
+            ((self.x - self.min_pos[0]) * scale).astype(np.int64), 0, cells - 1
+        )
+        cy = np.clip(
+            ((self.y - self.min_pos[1]) * scale).astype(np.int64), 0, cells - 1
+        )
+        codes = morton(cx, cy)
+        self.order = np.argsort(codes, kind="stable")
+        self.codes = codes[self.order]
+        rng = np.random.default_rng(seed)
+        self.priority = rng.permutation(n)[self.order]
+
+        if max_zoom is None:
+            max_zoom = self._auto_max_zoom()
+        self.max_zoom = min(max_zoom, DEPTH)
+        self.levels = self._build_levels()
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the coordinates, columns and Morton index."""
+        arrays = [self.x, self.y, self.codes, self.order, self.priority]
+        arrays.extend(self.columns.values())
+        for level in self.levels:
+            arrays.extend(level)
+        # the finest level shares the arrays of all points
+        unique = {id(a): a for a in arrays}
+        return sum(a.nbytes for a in unique.values())
+
+    def evict(self, nbytes: int) -> int:
+        # the points are the tileset's data, they can't be dropped
+        return 0
+
+    def _prefixes(self, zoom: int) -> np.ndarray:
+        return self.codes >> np.uint64(2 * (DEPTH - zoom))
+
+    def _auto_max_zoom(self) -> int:
+        """The first zoom level at which no tile has more than `max_points`."""
+        for zoom in range(DEPTH + 1):
+            prefixes = self._prefixes(zoom)
+            starts = np.flatnonzero(np.r_[True, prefixes[1:] != prefixes[:-1]])
+            counts = np.diff(np.r_[starts, len(prefixes)])
+            if not len(counts) or counts.max() <= self.max_points:
+                return zoom
+        return DEPTH
+
+    def _build_levels(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """(sorted codes, point indices) of the points shown at each zoom."""
+        n = len(self.codes)
+        # first zoom level at which each point (in code order) is shown
+        appears = np.full(n, self.max_zoom, dtype=np.int8)
+        by_priority = np.argsort(self.priority, kind="stable")
+        for zoom in range(self.max_zoom - 1, -1, -1):
+            # rank of each point among the points of its tile, by priority
+            prefixes = self._prefixes(zoom)[by_priority]
+            grouped = np.argsort(prefixes, kind="stable")
+            sorted_prefixes = prefixes[grouped]
+            starts = np.r_[True, sorted_prefixes[1:] != sorted_prefixes[:-1]]
+            group_start = np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+            rank = np.empty(n, dtype=np.int64)
+            rank[by_priority[grouped]] = np.arange(n) - group_start
+            appears[rank < self.max_points] = zoom
+
+        levels = []
+        for zoom in range(self.max_zoom + 1):
+            shown = np.flatnonzero(appears <= zoom)
+            if len(shown) == n:
+                levels.append((self.codes, self.order))
+            else:
+                levels.append((self.codes[shown], self.order[shown]))
+        return levels
+
+    def tileset_info(self) -> Dict[str, Any]:
+        return {
+            "min_pos": self.min_pos,
+            "max_pos": [p + self.max_width for p in self.min_pos],
+            "max_width": self.max_width,
+            "max_zoom": self.max_zoom,
+            "max_points": self.max_points,
+            "columns": list(self.columns),
+        }
+
+    def points(self, zoom: int, tx: int, ty: int) -> np.ndarray:
+        """Indices of the points shown in tile (`tx`, `ty`) at `zoom`."""
+        zoom = min(zoom, self.max_zoom)
+        codes, indices = self.levels[zoom]
+        shift = np.uint64(2 * (DEPTH - zoom))
+        prefix = morton(np.array([tx]), np.array([ty]))[0]
+        lo, hi = np.searchsorted(codes, [prefix << shift, (prefix + 1) << shift])
+        return indices[lo:hi]
+
+    def _tile(self, tile_id: str) -> List[Dict[str, Any]]:
+        _, *parts = tile_id.split(".")
+        zoom, tx, ty = map(int, parts[:3])
+        if not (0 <= tx < 2**zoom and 0 <= ty < 2**zoom):
+            return []
+        if zoom > self.max_zoom:
+            # tiles past max_zoom show the points of their ancestor in range
+            shift = zoom - self.max_zoom
+            indices = self.points(self.max_zoom, tx >> shift, ty >> shift)
+            width = self.max_width / 2**zoom
+            x0 = self.min_pos[0] + tx * width
+            y0 = self.min_pos[1] + ty * width
+            x, y = self.x[indices], self.y[indices]
+            inside = (x >= x0) & (x < x0 + width) & (y >= y0) & (y < y0 + width)
+            indices = indices[inside]
+        else:
+            indices = self.points(zoom, tx, ty)
+
+        fields = {"x": self.x[indices], "y": self.y[indices], "uid": indices}
+        fields.update((k, v[indices]) for k, v in self.columns.items())
+        names = list(fields)
+        values = zip(*(np.asarray(v).tolist() for v in fields.values()))
+        return [dict(zip(names, row)) for row in values]
+
+    def tiles(self, tile_ids: Sequence[str]) -> List[Tuple[str, Any]]:
+        return [(tid, self._tile(tid)) for tid in tile_ids]
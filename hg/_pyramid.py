@@ -0,0 +1,291 @@
+"""A memory-mapped multiresolution tile format.
+
+A pyramid is a directory with an `info.json` and, for each zoom level `z`:
+
+- `z.npy`: the tiles, an array of shape (n_tiles, *tile_shape)
+- `z.keys.npy`: sorted tile keys (x, or x * n + y for matrices)
+- `z.range.npy`: the finite (min, max) of each tile
+
+Arrays are memory-mapped, so a tile is a view into the mapped file. Empty
+tiles (all NaN, or all 0 for matrices) are not stored. Symmetric matrices
+only store tiles with x <= y.
+"""
+import collections
+import concurrent.futures
+import json
+import math
+import pathlib
+import struct
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from . import _grid as grid
+from ._tiles import decode_dense_tile, format_dense_tile
+from .tilesets import run_sync
+
+if TYPE_CHECKING:
+    from .tilesets import LocalTileset
+
+FORMAT_VERSION = 1
+
+PathLike = Union[str, pathlib.Path]
+
+
+def _n_tiles(info: Dict[str, Any], zoom: int) -> int:
+    # number of tiles along one axis covering the data at `zoom`
+    tile_width, n_tiles = grid.tile_grid(info, zoom)
+    extent = info["max_pos"][0] - info["min_pos"][0]
+    return min(math.ceil(extent / tile_width), n_tiles)
+
+
+class Pyramid:
+    """Tiles of a pyramid directory written by `write_pyramid`."""
+
+    def __init__(self, path: PathLike):
+        self.path = pathlib.Path(path)
+        self.reload()
+
+    def reload(self):
+        """Map the files again, e.g. after the pyramid was rewritten."""
+        meta = json.loads((self.path / "info.json").read_text())
+        if meta["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported pyramid version {meta['format_version']}")
+        self.datatype: str = meta["datatype"]
+        self.info: Dict[str, Any] = meta["tileset_info"]
+        self.tile_shape: Tuple[int, ...] = tuple(meta["tile_shape"])
+        self.symmetric: bool = meta["symmetric"]
+        self.n_tiles: List[int] = meta["n_tiles"]
+        self.levels = [
+            (
+                np.load(self.path / f"{z}.keys.npy"),
+                np.load(self.path / f"{z}.npy", mmap_mode="r"),
+                np.load(self.path / f"{z}.range.npy"),
+            )
+            for z in range(len(self.n_tiles))
+        ]
+        fill_value = meta["fill_value"]
+        self._empty = np.full(
+            self.tile_shape,
+            np.nan if fill_value is None else fill_value,
+            dtype=meta["dtype"],
+        )
+        # like `format_dense_tile`, the range of an all NaN tile is (0, 0)
+        self._empty_range = (0.0, 0.0) if fill_value is None else (fill_value,) * 2
+
+    def tileset_info(self) -> Dict[str, Any]:
+        return self.info
+
+    def array(self, zoom: int, position: Sequence[int]) -> Tuple[np.ndarray, Any]:
+        """The tile at `position` as a view into the mapped file, and its range."""
+        transpose = False
+        if self.datatype == "matrix":
+            x, y = position
+            if self.symmetric and x > y:
+                x, y, transpose = y, x, True
+            key = x * self.n_tiles[zoom] + y
+        else:
+            key = position[0]
+
+        keys, tiles, ranges = self.levels[zoom]
+        i = int(np.searchsorted(keys, key))
+        if i == len(keys) or keys[i] != key:
+            return self._empty, self._empty_range
+        tile = tiles[i]
+        return (tile.T if transpose else tile), ranges[i]
+
+    def _raw_tile(self, tile_id: str) -> Dict[str, Any]:
+        _, zoom, *position = tile_id.split(".")
+        n_axes = 2 if self.datatype == "matrix" else 1
+        data, (min_value, max_value) = self.array(
+            int(zoom), [int(p) for p in position[:n_axes]]
+        )
+        tile = {
+            "dense": data,
+            "dtype": data.dtype.name,
+            "min_value": float(min_value),
+            "max_value": float(max_value),
+        }
+        if self.datatype == "multivec":
+            tile["shape"] = list(data.shape)
+        return tile
+
+    def raw_tiles(self, tile_ids: Sequence[str]) -> List[Tuple[str, Any]]:
+        """Tiles with "dense" arrays viewing the mapped file."""
+        return [(tid, self._raw_tile(tid)) for tid in tile_ids]
+
+    def tiles(self, tile_ids: Sequence[str]) -> List[Tuple[str, Any]]:
+        tiles = []
+        for tid, raw in self.raw_tiles(tile_ids):
+            tile = format_dense_tile(np.ascontiguousarray(raw["dense"]), raw["dtype"])
+            tile.update(min_value=raw["min_value"], max_value=raw["max_value"])
+            if "shape" in raw:
+                tile["shape"] = raw["shape"]
+            tiles.append((tid, tile))
+        return tiles
+
+
+def _npy_header(dtype, shape: Tuple[int, ...], size: Optional[int] = None) -> bytes:
+    """An .npy (version 1.0) header, padded to `size` bytes so it can be
+    rewritten in place with a shape of the same or fewer digits."""
+    header = {"descr": np.dtype(dtype).str, "fortran_order": False, "shape": shape}
+    text = repr(header)
+    prefix = np.lib.format.magic(1, 0)
+    used = len(prefix) + 2 + len(text) + 1
+    if size is None:
+        # arrays start 64-byte aligned, like `np.save`
+        size = -(-used // 64) * 64
+    if used > size:
+        raise ValueError(f"The .npy header of shape {shape} exceeds {size} bytes")
+    text += " " * (size - used) + "\n"
+    return prefix + struct.pack("<H", len(text)) + text.encode("latin1")
+
+
+def _tile_positions(
+    info: Dict[str, Any], zoom: int, datatype: str, symmetric: bool
+) -> List[Tuple[int, ...]]:
+    n = _n_tiles(info, zoom)
+    if datatype != "matrix":
+        return [(x,) for x in range(n)]
+    return [(x, y) for x in range(n) for y in range(x if symmetric else 0, n)]
+
+
+def write_pyramid(
+    tileset: "LocalTileset",
+    path: PathLike,
+    max_zoom: Optional[int] = None,
+    dtype: str = "float32",
+    symmetric: bool = True,
+    batch_size: int = 64,
+    max_workers: int = 8,
+) -> pathlib.Path:
+    """Convert a dense tileset (e.g. from `hg.tilesets.bigwig`, `cooler` or
+    `multivec`) into a pyramid directory at `path`.
+
+    Batches of tiles (contiguous genomic spans) of all zoom levels up to
+    `max_zoom` are computed in parallel on `max_workers` threads.
+    """
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    info = run_sync(tileset.info)
+    datatype = tileset.datatype
+    if datatype not in ("vector", "multivec", "matrix"):
+        raise ValueError(f"Cannot convert tilesets of datatype {datatype!r}")
+    max_zoom = grid.max_zoom(info) if max_zoom is None else max_zoom
+    symmetric = symmetric and datatype == "matrix"
+    # tiles which are entirely missing (NaN) or `fill_value` are not stored
+    fill_value = 0.0 if datatype == "matrix" else np.nan
+
+    def compute(zoom: int, positions: Sequence[Tuple[int, ...]]):
+        tids = [".".join(map(str, ("x", zoom, *pos))) for pos in positions]
+        result = []
+        for pos, (_, tile) in zip(positions, run_sync(tileset.tiles, tids)):
+            if "dense" not in tile:
+                continue
+            data = decode_dense_tile(tile).astype(dtype)
+            if "shape" in tile:
+                data = data.reshape(tile["shape"])
+            elif datatype == "matrix":
+                side = int(np.sqrt(data.size))
+                data = data.reshape(side, side)
+            if np.all(data == fill_value) or np.all(np.isnan(data)):
+                continue
+            result.append((pos, data))
+        return zoom, result
+
+    np_dtype = np.dtype(dtype).newbyteorder("<")
+    tile_shape: Optional[Tuple[int, ...]] = None
+    n_tiles = [_n_tiles(info, zoom) for zoom in range(max_zoom + 1)]
+
+    jobs = (
+        (zoom, positions[i : i + batch_size])
+        for zoom in range(max_zoom + 1)
+        for positions in [_tile_positions(info, zoom, datatype, symmetric)]
+        for i in range(0, max(len(positions), 1), batch_size)
+    )
+    levels: Dict[int, Dict[str, Any]] = {}
+    written: List[pathlib.Path] = []
+
+    def write(zoom: int, result: List[Tuple[Tuple[int, ...], np.ndarray]]):
+        nonlocal tile_shape
+        level = levels.setdefault(zoom, {"keys": [], "ranges": []})
+        for pos, data in result:
+            tile_shape = tile_shape or data.shape
+            if "file" not in level:
+                # tiles are written after a header for at most all tiles of
+                # the level, whose count is updated in place once known
+                n_max = n_tiles[zoom] ** (2 if datatype == "matrix" else 1)
+                header = _npy_header(np_dtype, (n_max, *tile_shape))
+                written.append(path / f"{zoom}.npy")
+                level["file"] = written[-1].open("wb")
+                level["file"].write(header)
+                level["header_size"] = len(header)
+            x, *y = pos
+            level["keys"].append(x * n_tiles[zoom] + y[0] if y else x)
+            finite = data[np.isfinite(data)]
+            level["ranges"].append(
+                (finite.min(), finite.max()) if finite.size else (0, 0)
+            )
+            level["file"].write(data.astype(np_dtype).tobytes())
+
+    try:
+        # batches are written in submission order, which keeps keys sorted,
+        # with a bounded number in flight
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            pending: "collections.deque[concurrent.futures.Future]"
+            pending = collections.deque()
+            for zoom, positions in jobs:
+                pending.append(executor.submit(compute, zoom, positions))
+                if len(pending) >= 2 * max_workers:
+                    write(*pending.popleft().result())
+            while pending:
+                write(*pending.popleft().result())
+
+        if tile_shape is None:
+            raise ValueError("Tileset has no dense tiles")
+
+        for zoom in range(max_zoom + 1):
+            level = levels.get(zoom, {"keys": [], "ranges": []})
+            keys = np.asarray(level["keys"], dtype=np.int64)
+            shape = (len(keys), *tile_shape)
+            if "file" in level:
+                level["file"].seek(0)
+                level["file"].write(_npy_header(np_dtype, shape, level["header_size"]))
+                level["file"].close()
+            else:
+                written.append(path / f"{zoom}.npy")
+                np.save(written[-1], np.zeros(shape, dtype=np_dtype))
+            written.append(path / f"{zoom}.keys.npy")
+            np.save(written[-1], keys)
+            written.append(path / f"{zoom}.range.npy")
+            np.save(written[-1], np.asarray(level["ranges"]).reshape(-1, 2))
+    except BaseException:
+        # don't leave a partial pyramid behind
+        for level in levels.values():
+            if "file" in level:
+                level["file"].close()
+        for written_path in written:
+            try:
+                written_path.unlink()
+            except FileNotFoundError:
+                pass
+        raise
+
+    if "resolutions" in info:
+        kept = sorted(info["resolutions"], reverse=True)[: max_zoom + 1]
+        info = dict(info, resolutions=[r for r in info["resolutions"] if r in kept])
+    else:
+        info = dict(info, max_zoom=max_zoom)
+
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "datatype": datatype,
+        "dtype": np_dtype.name,
+        "tile_shape": list(tile_shape),
+        "symmetric": symmetric,
+        "fill_value": None if np.isnan(fill_value) else fill_value,
+        "n_tiles": n_tiles,
+        "tileset_info": info,
+    }
+    (path / "info.json").write_text(json.dumps(meta))
+    return path
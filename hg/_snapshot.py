@@ -0,0 +1,158 @@
+"""Helpers to embed tiles and the HiGlass bundle in a self-contained HTML page."""
+import base64
+import gzip
+import hashlib
+import json
+import math
+import os
+import pathlib
+import urllib.request
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from ._grid import tile_ids
+
+if TYPE_CHECKING:
+    from hg.tilesets import LocalTileset
+
+_VERTICAL_POSITIONS = {"left", "right"}
+
+
+def default_cache_dir() -> pathlib.Path:
+    root = os.environ.get("XDG_CACHE_HOME", pathlib.Path.home() / ".cache")
+    return pathlib.Path(root) / "hg"
+
+
+def bundle_urls(
+    higlass_version: str, react_version: str, pixijs_version: str
+) -> Tuple[str, List[str]]:
+    """UMD builds which can be inlined as classic scripts (css, scripts)."""
+    css = f"https://unpkg.com/higlass@{higlass_version}/dist/hglib.css"
+    scripts = [
+        f"https://unpkg.com/react@{react_version}/umd/react.production.min.js",
+        f"https://unpkg.com/react-dom@{react_version}/umd/react-dom.production.min.js",
+        f"https://unpkg.com/pixi.js@{pixijs_version}/dist/browser/pixi.min.js",
+        f"https://unpkg.com/higlass@{higlass_version}/dist/hglib.min.js",
+    ]
+    return css, scripts
+
+
+def fetch_cached(url: str, cache_dir: Optional[pathlib.Path] = None) -> str:
+    """Fetch a text resource, caching it on disk for subsequent (offline) use."""
+    cache_dir = cache_dir or default_cache_dir()
+    key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    path = cache_dir / "bundles" / f"{key}-{pathlib.PurePosixPath(url).name}"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with urllib.request.urlopen(url) as response:
+            content = response.read()
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(content)
+        tmp.replace(path)
+    return path.read_text(encoding="utf-8")
+
+
+def _iter_tracks(
+    spec: Dict[str, Any]
+) -> Iterator[Tuple[Dict[str, Any], str, Dict[str, Any]]]:
+    for view in spec.get("views") or []:
+        for position, tracks in (view.get("tracks") or {}).items():
+            stack = list(tracks or [])
+            while stack:
+                track = stack.pop()
+                stack.extend(track.get("contents") or [])
+                yield view, position, track
+
+
+def collect_tiles(
+    spec: Dict[str, Any],
+    tilesets: Mapping[str, "LocalTileset"],
+    pixel_width: int = 1024,
+    zoom_padding: int = 1,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Gather tileset infos and the tiles visible in each view's initial domains."""
+    from hg.tilesets import run_sync
+
+    infos: Dict[str, Any] = {}
+    requested: Dict[str, Set[str]] = {}
+
+    for view, position, track in _iter_tracks(spec):
+        uid = track.get("tilesetUid")
+        # e.g. axes, or tracks of tilesets on other servers
+        if not isinstance(uid, str) or uid not in tilesets:
+            continue
+        if uid not in infos:
+            infos[uid] = run_sync(tilesets[uid].info)
+        info = infos[uid]
+        if "min_pos" not in info:
+            continue
+
+        x_domain = view.get("initialXDomain")
+        y_domain = view.get("initialYDomain")
+        if position in _VERTICAL_POSITIONS:
+            x_domain, y_domain = y_domain or x_domain, None
+
+        requested.setdefault(uid, set()).update(
+            tile_ids(uid, info, x_domain, y_domain, pixel_width, zoom_padding)
+        )
+
+    tiles: Dict[str, Any] = {}
+    for uid, tids in requested.items():
+        tiles.update(run_sync(tilesets[uid].tiles, sorted(tids)))
+
+    return infos, tiles
+
+
+def _finite(value: Any) -> Any:
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: _finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(v) for v in value]
+    return value
+
+
+def _dumps(value: Any) -> str:
+    """Compact JSON which the browser can parse, with NaN/Infinity as null."""
+    try:
+        return json.dumps(value, separators=(",", ":"), allow_nan=False)
+    except ValueError:
+        return json.dumps(_finite(value), separators=(",", ":"), allow_nan=False)
+
+
+def pack(infos: Dict[str, Any], tiles: Dict[str, Any]) -> str:
+    """Deduplicate tiles and gzip everything into a base64 string."""
+    values: List[str] = []
+    index: Dict[str, int] = {}
+    tile_index: Dict[str, int] = {}
+    for tid, tile in tiles.items():
+        encoded = _dumps(tile)
+        if encoded not in index:
+            index[encoded] = len(values)
+            values.append(encoded)
+        tile_index[tid] = index[encoded]
+
+    payload = (
+        '{"info":%s,"tiles":%s,"values":[%s]}'
+        % (
+            _dumps(infos),
+            _dumps(tile_index),
+            ",".join(values),
+        )
+    ).encode()
+    return base64.b64encode(gzip.compress(payload, mtime=0)).decode()
+
+
+def escape_script(source: str) -> str:
+    """Make a source safe to inline in a <script> or <style> element."""
+    return source.replace("</script", "<\\/script").replace("</style", "<\\/style")
@@ -0,0 +1,169 @@
+"""Encoding and decoding of dense tiles in the format used by clodius."""
+import base64
+import json
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+Tile = Dict[str, Any]
+
+# quantized tiles map [min_value, max_value] onto [0, QUANTIZE_MAX], NaN is 255
+QUANTIZE_MAX = 254
+
+
+def format_dense_tile(data: np.ndarray, dtype: Optional[str] = None) -> Tile:
+    """Encode a dense tile like `clodius.tiles.format.format_dense_tile`.
+
+    By default float16 is used if the values fit, otherwise float32.
+    """
+    finite = data[np.isfinite(data)]
+    min_value = float(finite.min()) if finite.size else 0.0
+    max_value = float(finite.max()) if finite.size else 0.0
+    f16 = np.finfo("float16")
+    if dtype is None:
+        fits = float(f16.min) < min_value and max_value < float(f16.max)
+        dtype = "float16" if fits else "float32"
+    elif dtype == "float16":
+        data = np.clip(data, f16.min, f16.max)
+    return {
+        "min_value": min_value,
+        "max_value": max_value,
+        "dense": base64.b64encode(data.astype(dtype).tobytes()).decode("utf-8"),
+        "dtype": dtype,
+    }
+
+
+def quantize_dense_tile(data: np.ndarray) -> Tile:
+    """Encode a dense tile as uint8, scaled between the tile's min and max.
+
+    The HiGlass client does not decode quantized tiles, these are meant for
+    clients using `decode_dense_tile`.
+    """
+    tile = format_dense_tile(data, dtype="float32")
+    lo, hi = tile["min_value"], tile["max_value"]
+    scale = QUANTIZE_MAX / (hi - lo) if hi > lo else 0.0
+    with np.errstate(invalid="ignore"):
+        scaled = np.round((np.clip(data, lo, hi) - lo) * scale)
+    quantized = np.where(np.isnan(data), 255, scaled).astype(np.uint8)
+    tile.update(
+        dense=base64.b64encode(quantized.tobytes()).decode("utf-8"),
+        dtype="uint8",
+        quantized=True,
+    )
+    return tile
+
+
+def _raw_dense(tile: Tile) -> np.ndarray:
+    dense = tile["dense"]
+    if isinstance(dense, np.ndarray):
+        return dense.ravel()
+    return np.frombuffer(base64.b64decode(dense), dtype=tile.get("dtype", "float32"))
+
+
+def encode_dense(tile: Tile) -> Tile:
+    """A JSON serializable tile, with the "dense" array of a raw tile (see
+    `LocalTileset.raw_tiles`) encoded as base64."""
+    dense = tile.get("dense") if isinstance(tile, dict) else None
+    if not isinstance(dense, np.ndarray):
+        return tile
+    dtype = tile.get("dtype", dense.dtype.name)
+    data = dense.astype(dtype, copy=False).tobytes()
+    return dict(tile, dense=base64.b64encode(data).decode("utf-8"), dtype=dtype)
+
+
+def decode_dense_tile(tile: Tile) -> np.ndarray:
+    """Decode the (flat) array of a dense tile."""
+    data = _raw_dense(tile)
+    if not tile.get("quantized"):
+        return data
+    lo, hi = tile["min_value"], tile["max_value"]
+    values = lo + data.astype(np.float32) * ((hi - lo) / QUANTIZE_MAX)
+    values[data == 255] = np.nan
+    return values
+
+
+def select_rows(
+    tile: Tile,
+    rows: Optional[Sequence[int]] = None,
+    dtype: Optional[str] = None,
+    quantize: bool = False,
+) -> Tile:
+    """Re-encode a multivec tile with a subset of (reordered) rows."""
+    if "dense" not in tile:
+        return tile
+    data = decode_dense_tile(tile).reshape(tile["shape"])
+    if rows is not None:
+        data = data[list(rows)]
+    encoded = quantize_dense_tile(data) if quantize else format_dense_tile(data, dtype)
+    encoded["shape"] = list(data.shape)
+    return encoded
+
+
+# Binary tile framing used by `/api/v1/tiles_bin/`:
+#
+#   b"HGTB" | uint32 version | uint32 header length | JSON header | arrays
+#
+# The header maps tile ids to the tile metadata. For dense tiles, "dense" is
+# replaced by the "offset" and "nbytes" of the little-endian array relative
+# to the start of the arrays. Arrays start at 8-byte aligned offsets.
+BINARY_MAGIC = b"HGTB"
+BINARY_VERSION = 1
+_PREAMBLE = struct.Struct("<4sII")
+
+
+def _align(n: int, to: int = 8) -> int:
+    return -(-n // to) * to
+
+
+def pack_tiles(tiles: Iterable[Tuple[str, Tile]]) -> bytes:
+    """Frame tiles, copying each dense array once into the output bytes."""
+    header: Dict[str, Tile] = {}
+    arrays = []
+    size = 0
+    for tid, tile in tiles:
+        if not isinstance(tile, dict) or "dense" not in tile:
+            header[tid] = tile
+            continue
+        data = _raw_dense(tile)
+        data = data.astype(data.dtype.newbyteorder("<"), copy=False)
+        meta = {k: v for k, v in tile.items() if k != "dense"}
+        meta.update(dtype=data.dtype.name, offset=size, nbytes=data.nbytes)
+        header[tid] = meta
+        arrays.append(data)
+        size += _align(data.nbytes)
+
+    head = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    preamble = _PREAMBLE.pack(BINARY_MAGIC, BINARY_VERSION, len(head))
+    parts: List[Union[bytes, memoryview]] = [preamble, head]
+    end = len(preamble) + len(head)
+    for data in arrays:
+        parts.append(bytes(_align(end) - end))
+        parts.append(data.view(np.uint8).data)
+        end = _align(end) + data.nbytes
+    parts.append(bytes(_align(end) - end))
+    return b"".join(parts)
+
+
+def unpack_tiles(buf: Union[bytes, bytearray, memoryview]) -> Dict[str, Tile]:
+    """Read framed tiles. Dense arrays are views into `buf`, not copies."""
+    magic, version, head_len = _PREAMBLE.unpack_from(buf, 0)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError(f"Not a binary tile response (version {version})")
+    head_end = _PREAMBLE.size + head_len
+    header = json.loads(bytes(buf[_PREAMBLE.size : head_end]))
+    start = _align(head_end)
+
+    tiles = {}
+    for tid, tile in header.items():
+        if isinstance(tile, dict) and "offset" in tile:
+            dtype = np.dtype(tile["dtype"]).newbyteorder("<")
+            dense = np.frombuffer(
+                buf,
+                dtype=dtype,
+                count=tile["nbytes"] // dtype.itemsize,
+                offset=start + tile["offset"],
+            )
+            tile = dict(tile, dense=dense)
+        tiles[tid] = tile
+    return tiles
@@ -0,0 +1,113 @@
+"""Client for remote HiGlass tile servers, used to proxy `RemoteTileset`s."""
+import concurrent.futures
+import json
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from ._httpfile import ConnectionPool, pool
+
+_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def shared_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Thread pool fetching the batches of all `UpstreamClient`s."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                8, thread_name_prefix="hg-upstream"
+            )
+        return _executor
+
+
+class UpstreamClient:
+    """Fetch tiles from a HiGlass server in batches.
+
+    Concurrent requests for the same tile share one upstream request and
+    large requests are split into batches of `batch_size` fetched in parallel
+    over pooled keep-alive connections, on `executor` (by default a thread
+    pool shared by all clients).
+    """
+
+    def __init__(
+        self,
+        server: str,
+        batch_size: int = 32,
+        connection_pool: ConnectionPool = pool,
+        executor: Optional[concurrent.futures.Executor] = None,
+    ):
+        self.server = server.rstrip("/")
+        self.batch_size = batch_size
+        self.pool = connection_pool
+        self.requests = 0
+        self._executor = shared_executor() if executor is None else executor
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        self._info: Dict[str, Any] = {}
+
+    def _get(self, endpoint: str, ids: Sequence[str]) -> Dict[str, Any]:
+        query = urlencode([("d", i) for i in ids])
+        status, _, body = self.pool.request("GET", f"{self.server}/{endpoint}/?{query}")
+        with self._lock:
+            self.requests += 1
+        if status != 200:
+            raise OSError(f"{self.server}/{endpoint}/ returned {status}")
+        return json.loads(body)
+
+    def info(self, uid: str) -> Dict[str, Any]:
+        if uid not in self._info:
+            self._info[uid] = self._get("tileset_info", [uid])[uid]
+        return self._info[uid]
+
+    def binary_tiles(self, tids: Sequence[str]) -> Dict[str, Any]:
+        """Fetch tiles from an `hg` server's `/tiles_bin/` endpoint.
+
+        Dense tiles are returned as arrays in "dense" rather than base64.
+        """
+        from ._tiles import unpack_tiles
+
+        status, _, body = self.pool.request(
+            "POST",
+            f"{self.server}/tiles_bin/",
+            headers={"Content-Type": "application/json"},
+            body=json.dumps(list(dict.fromkeys(tids))).encode(),
+        )
+        with self._lock:
+            self.requests += 1
+        if status != 200:
+            raise OSError(f"{self.server}/tiles_bin/ returned {status}")
+        return unpack_tiles(body)
+
+    def _fetch(self, tids: List[str], futures: List[concurrent.futures.Future]):
+        try:
+            tiles = self._get("tiles", tids)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for tid, future in zip(tids, futures):
+                future.set_result(tiles.get(tid, {"error": "No tile returned"}))
+        finally:
+            with self._lock:
+                for tid in tids:
+                    self._inflight.pop(tid, None)
+
+    def tiles(self, tids: Sequence[str]) -> List[Tuple[str, Any]]:
+        pending: Dict[str, concurrent.futures.Future] = {}
+        missing: List[str] = []
+        with self._lock:
+            for tid in dict.fromkeys(tids):
+                future = self._inflight.get(tid)
+                if future is None:
+                    future = concurrent.futures.Future()
+                    self._inflight[tid] = future
+                    missing.append(tid)
+                pending[tid] = future
+
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i : i + self.batch_size]
+            self._executor.submit(self._fetch, batch, [pending[tid] for tid in batch])
+
+        return [(tid, future.result()) for tid, future in pending.items()]
@@ -0,0 +1,164 @@
+"""Serve (lazy) xarray, Dask or NumPy arrays as multiresolution tilesets.
+
+Tiles are slices of the array at the base resolution, coarsened by 2**k
+along the genomic axes. With Dask, only the chunks a tile touches are
+computed and all tiles of a request share one `dask.compute` call. Lazily
+loaded xarray DataArrays (e.g. of a netCDF file) are only read a tile at a time.
+"""
+import math
+import warnings
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from typing_extensions import Literal
+
+from ._tiles import format_dense_tile
+
+Aggregation = Literal["mean", "sum"]
+
+# bins per tile along each genomic axis
+TILE_SIZES = {"vector": 1024, "multivec": 256, "matrix": 256}
+
+
+def _is_dask(arr) -> bool:
+    return type(arr).__module__.startswith("dask.")
+
+
+def _coarsen(arr, axes: Sequence[int], factor: int, agg: Aggregation):
+    """Reduce blocks of `factor` elements along `axes` with nan-aware `agg`.
+
+    Dims along `axes` must be multiples of `factor`.
+    """
+    if factor == 1:
+        return arr
+    reduce = np.nanmean if agg == "mean" else np.nansum
+    if _is_dask(arr):
+        import dask.array as da
+
+        # blocks must not straddle chunks, round chunks to multiples of factor
+        chunks = {
+            axis: max(factor, arr.chunksize[axis] // factor * factor) for axis in axes
+        }
+        arr = arr.rechunk(chunks)
+        return da.coarsen(reduce, arr, {axis: factor for axis in axes})
+
+    shape: List[int] = []
+    for axis, size in enumerate(arr.shape):
+        shape.extend((size // factor, factor) if axis in axes else (size,))
+    reduce_axes = tuple(axis + i + 1 for i, axis in enumerate(sorted(axes)))
+    return reduce(arr.reshape(shape), axis=reduce_axes)
+
+
+class ArrayTiles:
+    """Tiles of a 1D (vector), 2D (rows, positions) multivec or square matrix array."""
+
+    def __init__(
+        self,
+        data,
+        datatype: str,
+        resolution: int = 1,
+        agg: Aggregation = "mean",
+        scheduler: Optional[str] = None,
+        chromsizes: Optional[Sequence[Tuple[str, int]]] = None,
+        row_infos: Optional[Sequence[Any]] = None,
+    ):
+        self.data = data
+        self.datatype = datatype
+        self.resolution = resolution
+        self.agg = agg
+        self.scheduler = scheduler
+        self.chromsizes = chromsizes
+        self.row_infos = row_infos
+        self.tile_size = TILE_SIZES[datatype]
+        # genomic axes of the array
+        self.axes = {"vector": (0,), "multivec": (1,), "matrix": (0, 1)}[datatype]
+
+        length = data.shape[self.axes[0]]
+        self.max_zoom = max(0, math.ceil(math.log2(length / self.tile_size)))
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of NumPy arrays, lazy arrays are not held in memory."""
+        return self.data.nbytes if isinstance(self.data, np.ndarray) else 0
+
+    def evict(self, nbytes: int) -> int:
+        # the array is the tileset's data, it can't be dropped
+        return 0
+
+    @property
+    def resolutions(self) -> List[int]:
+        return [self.resolution * 2**k for k in range(self.max_zoom + 1)]
+
+    def tileset_info(self) -> Dict[str, Any]:
+        length = self.data.shape[self.axes[0]] * self.resolution
+        info: Dict[str, Any] = {
+            "resolutions": self.resolutions,
+            "min_pos": [0] * len(self.axes),
+            "max_pos": [length] * len(self.axes),
+        }
+        if self.datatype == "matrix":
+            info["bins_per_dimension"] = self.tile_size
+        else:
+            info["tile_size"] = self.tile_size
+        if self.datatype == "multivec":
+            info["shape"] = [self.tile_size, self.data.shape[0]]
+            if self.row_infos is not None:
+                info["row_infos"] = list(self.row_infos)
+        if self.chromsizes is not None:
+            info["chromsizes"] = [[c, int(s)] for c, s in self.chromsizes]
+        return info
+
+    def _tile(self, zoom: int, position: Sequence[int]):
+        """A lazy (for Dask) tile, padded with NaN past the end of the array."""
+        factor = 2 ** (self.max_zoom - zoom)
+        width = self.tile_size * factor
+        index: List[Any] = [slice(None)] * self.data.ndim
+        pad = [(0, 0)] * self.data.ndim
+        for axis, pos in zip(self.axes, position):
+            start = pos * width
+            stop = min(start + width, self.data.shape[axis])
+            index[axis] = slice(start, stop)
+            pad[axis] = (0, width - max(stop - start, 0))
+
+        tile = self.data[tuple(index)]
+        if not _is_dask(tile):
+            # e.g. a DataArray of a file, of which only this slice is read
+            tile = np.asarray(tile)
+        tile = tile.astype(np.float64)
+        if any(after for _, after in pad):
+            if _is_dask(tile):
+                import dask.array as da
+
+                tile = da.pad(tile, pad, constant_values=np.nan)
+            else:
+                tile = np.pad(tile, pad, constant_values=np.nan)
+        return _coarsen(tile, self.axes, factor, self.agg)
+
+    def tiles(self, tile_ids: Sequence[str]) -> List[Tuple[str, Any]]:
+        # blocks past the end of the array are all NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            lazy = []
+            for tile_id in tile_ids:
+                _, zoom, *parts = tile_id.split(".")
+                position = [int(p) for p in parts[: len(self.axes)]]
+                lazy.append(self._tile(int(zoom), position))
+
+            if any(_is_dask(tile) for tile in lazy):
+                import dask
+
+                computed = dask.compute(*lazy, scheduler=self.scheduler)
+            else:
+                computed = lazy
+
+        tiles = []
+        for tile_id, data in zip(tile_ids, computed):
+            data = np.asarray(data)
+            if self.datatype == "matrix":
+                # rows of a dense matrix tile are along the y axis
+                data = data.T
+            tile = format_dense_tile(data)
+            if self.datatype == "multivec":
+                tile["shape"] = list(data.shape)
+            tiles.append((tile_id, tile))
+        return tiles
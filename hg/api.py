@@ -1,6 +1,18 @@
 import functools
+import json
 from collections import defaultdict
-from typing import ClassVar, Generic, List, Optional, Tuple, TypeVar, Union, overload
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    Generic,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+    overload,
+)
 
 import higlass_schema as hgs
 from pydantic import BaseModel
@@ -177,14 +189,36 @@ class Viewconf(hgs.Viewconf[View[TrackT]], _PropertiesMixin, Generic[TrackT]):
         return HiGlassWidget(self.dict())  # type: ignore
 
     @classmethod
-    def from_url(cls, url: str):
+    def parse_obj(cls, obj: Dict[str, Any], validate: bool = True):
+        """Create a Viewconf from a dict.
+
+        With `validate=False` the model tree is built from trusted data
+        without validation. Subtrees are not validated when accessed either:
+        invalid data is only detected by `Viewconf.validated()`.
+        """
+        if validate:
+            return super().parse_obj(obj)
+        return utils.construct(cls, obj)
+
+    @classmethod
+    def parse_raw(cls, b: Union[str, bytes], *, validate: bool = True, **kwargs):
+        if validate:
+            return super().parse_raw(b, **kwargs)
+        return cls.parse_obj(json.loads(b), validate=False)
+
+    @classmethod
+    def from_url(cls, url: str, validate: bool = True):
         import urllib.request as urllib
 
         request = urllib.Request(url)
         with urllib.urlopen(request) as response:
             raw = response.read()
 
-        return cls.parse_raw(raw)
+        return cls.parse_raw(raw, validate=validate)
+
+    def validated(self):
+        """Validate the full Viewconf in place (e.g. after `validate=False`)."""
+        return utils.validate(self)
 
     def locks(
         self,
@@ -330,6 +364,7 @@ def view(
     tracks: Optional[hgs.Tracks[TrackT]] = None,
     layout: Optional[hgs.Layout] = None,
     uid: Optional[str] = None,
+    validate: bool = True,
     **kwargs,
 ) -> View[TrackT]:
 
@@ -361,6 +396,15 @@ def view(
     if uid is None:
         uid = utils.uid()
 
+    if not validate:
+        # trust the tracks and skip re-validating the nested tree
+        return View[TrackT].construct(
+            layout=layout,
+            tracks=utils.construct(hgs.Tracks[TrackT], data),  # type: ignore
+            uid=uid,
+            **kwargs,
+        )
+
     return View[TrackT](
         layout=layout,
         tracks=hgs.Tracks[TrackT](**data),
@@ -392,6 +436,11 @@ T = TypeVar("T", bound=Union[EnumTrack, HeatmapTrack])
 
 
 def divide(t1: T, t2: T, **kwargs) -> T:
+    """Divide two tracks in the browser.
+
+    Both tilesets are fetched by the client. For local tilesets, prefer
+    `hg.arithmetic(ts1, ts2)`, which divides tiles on the server.
+    """
     assert t1.type == t2.type, "divided tracks must be same type"
     assert isinstance(t1.tilesetUid, str)
     assert isinstance(t1.server, str)
@@ -1,10 +1,31 @@
+import concurrent.futures
+import functools
 import json
+import os
+import pathlib
+import time
 import uuid
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import jinja2
 
+import hg._snapshot as snapshot
+
+if TYPE_CHECKING:
+    from hg.api import Viewconf
+    from hg.tilesets import LocalTileset
+
 HTML_TEMPLATE = jinja2.Template(
     """
 <!DOCTYPE html>
@@ -54,6 +75,200 @@ def spec_to_html(
     )
 
 
+SNAPSHOT_TEMPLATE = jinja2.Template(
+    """
+<!DOCTYPE html>
+<html>
+  <head>
+    <style>{{ css }}</style>
+    {% for script in scripts %}
+    <script>{{ script }}</script>
+    {% endfor %}
+  </head>
+  <body>
+    <div id="{{ output_div }}"></div>
+  </body>
+  <script>
+    (async () => {
+      // inflate embedded tiles and answer tile server requests in-page
+      const bytes = Uint8Array.from(atob("{{ data }}"), (c) => c.charCodeAt(0));
+      const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+      const data = JSON.parse(await new Response(stream).text());
+      const nativeFetch = window.fetch.bind(window);
+      const respond = (ids, lookup) => new Response(
+        JSON.stringify(Object.fromEntries(ids.map((id) => [id, lookup(id)]))),
+        { headers: { "Content-Type": "application/json" } },
+      );
+      window.fetch = (input, init) => {
+        const url = new URL(typeof input === "string" ? input : input.url, window.location.href);
+        const ids = url.searchParams.getAll("d");
+        if (url.pathname.endsWith("/tileset_info/") && ids.every((id) => id in data.info)) {
+          return Promise.resolve(respond(ids, (id) => data.info[id]));
+        }
+        if (url.pathname.endsWith("/tiles/") && ids.every((id) => id in data.tiles)) {
+          return Promise.resolve(respond(ids, (id) => data.values[data.tiles[id]]));
+        }
+        return nativeFetch(input, init);
+      };
+      hglib.viewer(
+        document.getElementById('{{ output_div }}'),
+        JSON.parse({{ spec }}),
+      );
+    })();
+  </script>
+</html>
+"""
+)
+
+
+def spec_to_snapshot_html(
+    spec: Dict[str, Any],
+    tilesets: Mapping[str, "LocalTileset"],
+    higlass_version: str = "1.11",
+    react_version: str = "17",
+    pixijs_version: str = "6",
+    output_div: str = "vis",
+    json_kwds: Optional[Dict[str, Any]] = None,
+    plugin_urls: Optional[List[str]] = None,
+    pixel_width: int = 1024,
+    zoom_padding: int = 1,
+    cache_dir: Optional[os.PathLike] = None,
+):
+    """Render a self-contained HTML page which works without network access.
+
+    Tiles of `tilesets` needed for the initial domains of each view are
+    embedded (deduplicated and gzipped), along with the HiGlass bundle
+    and plugins, which are downloaded once and cached in `cache_dir`.
+    """
+    json_kwds = json_kwds or {}
+    plugin_urls = plugin_urls or []
+    cache = None if cache_dir is None else pathlib.Path(cache_dir)
+
+    infos, tiles = snapshot.collect_tiles(
+        spec, tilesets, pixel_width=pixel_width, zoom_padding=zoom_padding
+    )
+    css_url, script_urls = snapshot.bundle_urls(
+        higlass_version, react_version, pixijs_version
+    )
+    scripts = [
+        snapshot.escape_script(snapshot.fetch_cached(url, cache))
+        for url in script_urls + plugin_urls
+    ]
+
+    return SNAPSHOT_TEMPLATE.render(
+        spec=json.dumps(json.dumps(spec, **json_kwds)),
+        css=snapshot.escape_script(snapshot.fetch_cached(css_url, cache)),
+        scripts=scripts,
+        data=snapshot.pack(infos, tiles),
+        output_div=output_div,
+    )
+
+
+_SPEC_PLACEHOLDER = "__HG_SPEC_PLACEHOLDER__"
+
+
+@functools.lru_cache(maxsize=None)
+def _html_parts(
+    plugin_urls: Tuple[str, ...], template_kwargs: Tuple[Tuple[str, str], ...]
+) -> Tuple[str, str]:
+    """Render the template once per plugin set, split around the spec."""
+    html = HTML_TEMPLATE.render(
+        spec=_SPEC_PLACEHOLDER, plugin_urls=plugin_urls, **dict(template_kwargs)
+    )
+    head, tail = html.split(_SPEC_PLACEHOLDER)
+    return head, tail
+
+
+def _write_html(
+    path: str,
+    spec: str,
+    plugin_urls: Tuple[str, ...],
+    template_kwargs: Tuple[Tuple[str, str], ...],
+) -> int:
+    head, tail = _html_parts(plugin_urls, template_kwargs)
+    html = head + json.dumps(spec) + tail
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return len(html)
+
+
+@dataclass
+class ExportReport:
+    files: int = 0
+    chars: int = 0
+    seconds: float = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds if self.seconds else 0.0
+
+    @property
+    def chars_per_second(self) -> float:
+        return self.chars / self.seconds if self.seconds else 0.0
+
+
+def export_html(
+    items: Iterable[Tuple["Viewconf", Union[str, os.PathLike]]],
+    processes: Optional[int] = None,
+    max_pending: Optional[int] = None,
+    higlass_version: str = "1.11",
+    react_version: str = "17",
+    pixijs_version: str = "6",
+    output_div: str = "vis",
+) -> ExportReport:
+    """Write many viewconfs to standalone HTML files using a process pool.
+
+    Specs are serialized as they are consumed from `items` and at most
+    `max_pending` files are in flight at once, so memory stays bounded
+    for large (lazy) iterables. Each worker renders the template once
+    per distinct set of plugin urls.
+    """
+    from hg.api import gather_plugin_urls
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * processes
+
+    template_kwargs = (
+        ("higlass_version", higlass_version),
+        ("react_version", react_version),
+        ("pixijs_version", pixijs_version),
+        ("output_div", output_div),
+    )
+
+    report = ExportReport()
+    start = time.perf_counter()
+
+    def collect(done):
+        for future in done:
+            report.chars += future.result()
+            report.files += 1
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        pending = set()
+        for conf, path in items:
+            plugin_urls = () if conf.views is None else gather_plugin_urls(conf.views)
+            future = executor.submit(
+                _write_html,
+                os.fspath(path),
+                conf.json(),
+                tuple(plugin_urls),
+                template_kwargs,
+            )
+            pending.add(future)
+            if len(pending) >= max_pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                collect(done)
+        done, _ = concurrent.futures.wait(pending)
+        collect(done)
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+
 class BaseRenderer:
     def __init__(self, output_div: str = "jupyter-hg-{}", **kwargs):
         self._output_div = output_div
@@ -75,6 +290,40 @@ class HTMLRenderer(BaseRenderer):
         return {"text/html": html}
 
 
+class SnapshotRenderer(BaseRenderer):
+    """Renders offline HTML with tiles from local tilesets inlined.
+
+    Uses the tilesets registered with `hg.server.server` unless
+    `tilesets` are provided explicitly.
+    """
+
+    def __init__(
+        self,
+        output_div: str = "jupyter-hg-{}",
+        tilesets: Optional[Mapping[str, "LocalTileset"]] = None,
+        **kwargs,
+    ):
+        super().__init__(output_div, **kwargs)
+        self.tilesets = tilesets
+
+    def __call__(self, spec, **metadata):
+        tilesets = self.tilesets
+        if tilesets is None:
+            from hg.server import server
+
+            tilesets = server.tilesets
+
+        kwargs = self.kwargs.copy()
+        kwargs.update(metadata)
+        html = spec_to_snapshot_html(
+            spec=json.loads(spec) if isinstance(spec, str) else spec,
+            tilesets=tilesets,
+            output_div=self.output_div,
+            **kwargs,
+        )
+        return {"text/html": html}
+
+
 @dataclass
 class RendererRegistry:
     renderers: Dict[str, BaseRenderer] = field(default_factory=dict)
@@ -100,4 +349,5 @@ renderers.register("html", html_renderer)
 renderers.register("colab", html_renderer)
 renderers.register("kaggle", html_renderer)
 renderers.register("zeppelin", html_renderer)
+renderers.register("snapshot", SnapshotRenderer())
 renderers.enable("default")
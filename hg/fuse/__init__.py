@@ -2,7 +2,7 @@ import logging
 import multiprocessing as mp
 import pathlib
 import time
-from typing import Optional, Union
+from typing import Dict, Optional, Union
 from urllib.parse import urlparse
 
 logger = logging.getLogger("hg.fuse")
@@ -15,18 +15,65 @@ class FuseProcess:
     def __init__(self):
         self._fuse_process: Optional[mp.Process] = None
         self._tmp_dir: Optional[pathlib.Path] = None
-
-    def start(self, tmp_dir: Union[str, pathlib.Path]):
+        self._options: Optional[Dict[str, Union[int, float, bool]]] = None
+        self._stats = None
+
+    def start(
+        self,
+        tmp_dir: Union[str, pathlib.Path],
+        disk_cache_size: int = 2**25,
+        lru_capacity: int = 400,
+        block_size: int = 2**20,
+        readahead: int = 4,
+        readahead_workers: int = 4,
+        attr_cache_size: int = 10_000,
+        attr_cache_ttl: float = 300,
+        persist_attr_cache: bool = True,
+    ):
+        """Mount http(s) at `tmp_dir`.
+
+        Parameters
+        ----------
+        disk_cache_size : int
+            Size limit (bytes) of the on-disk block cache.
+        lru_capacity : int
+            Number of blocks kept in memory.
+        block_size : int
+            Size (bytes) of the blocks fetched with range requests.
+        readahead : int
+            Number of blocks fetched in parallel ahead of sequential readers.
+            Set to 0 to disable readahead.
+        readahead_workers : int
+            Number of threads used for readahead.
+        attr_cache_size : int
+            Number of file attributes (including missing files) kept in memory.
+        attr_cache_ttl : float
+            Seconds before cached attributes are looked up again.
+        persist_attr_cache : bool
+            Whether to keep cached attributes in the disk cache directory.
+        """
         try:
-            from ._httpfs import run
+            from ._httpfs import STATS_FIELDS, run
         except ImportError as e:
             raise ImportError(
                 'Install "fusepy" and "simple-httpfs" to enable FUSE.'
             ) from e
 
+        options = dict(
+            disk_cache_size=disk_cache_size,
+            lru_capacity=lru_capacity,
+            block_size=block_size,
+            readahead=readahead,
+            readahead_workers=readahead_workers,
+            attr_cache_size=attr_cache_size,
+            attr_cache_ttl=attr_cache_ttl,
+            persist_attr_cache=persist_attr_cache,
+        )
+
         # no need to restart
         tmp_dir = pathlib.Path(tmp_dir).absolute()
-        if self._fuse_process and tmp_dir == self._tmp_dir:
+        running = self._fuse_process and tmp_dir == self._tmp_dir
+        if running and options == self._options:
             logger.debug("Skipping start. FUSE running in same directory %s", tmp_dir)
             return
 
@@ -46,7 +93,13 @@ class FuseProcess:
         logger.info("Starting FUSE mount at %s", mount_point)
 
         args = (str(mount_point) + "/", str(disk_cache_dir) + "/")
-        self._fuse_process = mp.Process(target=run, args=args, daemon=True)
+        self._stats = mp.Array("q", len(STATS_FIELDS), lock=False)
+        self._fuse_process = mp.Process(
+            target=run,
+            args=args,
+            kwargs=dict(stats=self._stats, **options),
+            daemon=True,
+        )
         self._fuse_process.start()
 
         max_iters = 10
@@ -63,6 +116,7 @@ class FuseProcess:
             time.sleep(0.5)
 
         self._tmp_dir = tmp_dir
+        self._options = options
 
     def stop(self):
         if self._fuse_process is None:
@@ -73,6 +127,7 @@ class FuseProcess:
         self._fuse_process.terminate()
         self._fuse_process = None
         self._tmp_dir = None
+        self._options = None
 
         # TODO: remove cache and mount dirs?
         # make sure stuff is no longer mounted
@@ -85,5 +140,13 @@ class FuseProcess:
             self._tmp_dir / self._mnt_name / f"{url.scheme}/{url.netloc}{url.path}.."
         )
 
+    def stats(self) -> Dict[str, int]:
+        """Cache and readahead counters reported by the FUSE process."""
+        if self._stats is None:
+            raise RuntimeError("FUSE processes not started")
+        from ._httpfs import STATS_FIELDS
+
+        return dict(zip(STATS_FIELDS, self._stats))
+
 
 fuse = FuseProcess()
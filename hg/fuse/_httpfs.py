@@ -1,7 +1,14 @@
+import collections
+import concurrent.futures
+import json
 import logging
-from errno import ENOENT
-from typing import List
+import pathlib
+import threading
+import time
+from errno import EIO, ENOENT
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
+import requests
 from fuse import FUSE, FuseOSError, LoggingMixIn, Operations
 from simple_httpfs import HttpFs
 from typing_extensions import Literal
@@ -10,12 +17,145 @@ FsName = Literal["http", "https", "ftp"]
 
 logger = logging.getLogger("hg.fuse")
 
+# counters shared with the parent process (see `FuseProcess.stats`)
+STATS_FIELDS = (
+    "reads",
+    "bytes_read",
+    "lru_hits",
+    "lru_misses",
+    "disk_hits",
+    "disk_misses",
+    "readahead_blocks",
+    "readahead_bytes",
+    "attr_hits",
+    "attr_misses",
+    "heads_saved",
+)
+
+Attrs = Dict[str, Any]
+
+
+class AttrCache:
+    """TTL and size bounded cache of file attributes, including misses (ENOENT).
+
+    Entries can be persisted to `path` so that remounts start warm.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 10_000,
+        ttl: float = 300,
+        path: Union[None, str, pathlib.Path] = None,
+        save_interval: float = 5,
+    ):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = None if path is None else pathlib.Path(path)
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self.heads_saved = 0
+        self._lock = threading.Lock()
+        # path -> (expires, attrs), attrs is None for missing files
+        self._entries: "collections.OrderedDict[str, Tuple[float, Optional[Attrs]]]"
+        self._entries = collections.OrderedDict()
+        self._last_save = time.time()
+        self._dirty = False
+        self.load()
+
+    def get(self, path: str) -> Tuple[bool, Optional[Attrs]]:
+        """Returns (found, attrs)."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] < time.time():
+                self._entries.pop(path, None)
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            if path.endswith(".."):
+                self.heads_saved += 1
+            return True, entry[1]
+
+    def put(self, path: str, attrs: Optional[Attrs]):
+        with self._lock:
+            self._entries[path] = (time.time() + self.ttl, attrs)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            self._dirty = True
+        if time.time() - self._last_save > self.save_interval:
+            self.save()
+
+    def load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            entries = json.loads(self.path.read_text())
+        except ValueError:
+            logger.warning("Ignoring corrupt attribute cache %s", self.path)
+            return
+        now = time.time()
+        with self._lock:
+            for path, (expires, attrs) in entries.items():
+                if expires > now:
+                    self._entries[path] = (expires, attrs)
+
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+        with self._lock:
+            data = json.dumps(self._entries)
+            self._dirty = False
+            self._last_save = time.time()
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(data)
+        tmp.replace(self.path)
+
+
+def _is_missing(error: Exception, url: str) -> bool:
+    """Whether `HttpFs.getattr` failed with `error` because `url` doesn't exist."""
+    if isinstance(error, FuseOSError) and error.errno == ENOENT:
+        return True
+    # HttpFs doesn't keep the status of its (HEAD or range) requests
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=10)
+    except requests.RequestException:
+        return False
+    return response.status_code in (404, 410)
+
 
 class MultiHttpFs(LoggingMixIn, Operations):
-    def __init__(self, schemas: List[FsName], **kwargs):
+    def __init__(
+        self,
+        schemas: List[FsName],
+        readahead: int = 4,
+        readahead_workers: int = 4,
+        attr_cache: Optional[AttrCache] = None,
+        stats: Optional[Sequence[int]] = None,
+        **kwargs,
+    ):
         logger.info("Starting FUSE at /")
         assert len(schemas) > 0, "must provide at least one schema"
         self.fs = {schema: HttpFs(schema, **kwargs) for schema in schemas}
+        self.readahead = readahead
+        self.attr_cache = attr_cache or AttrCache()
+        self.stats = stats
+
+        self._lock = threading.Lock()
+        # path -> (next expected offset, last prefetched block)
+        self._cursors: Dict[str, Tuple[int, int]] = {}
+        # (url, block) -> pending readahead of the block
+        self._inflight: Dict[Tuple[str, int], concurrent.futures.Future] = {}
+        self._reads = 0
+        self._bytes_read = 0
+        self._readahead_blocks = 0
+        self._readahead_bytes = 0
+        self._executor = (
+            concurrent.futures.ThreadPoolExecutor(readahead_workers)
+            if readahead > 0
+            else None
+        )
 
     def _deref(self, path: str):
         root, *rest = path.lstrip("/").split("/")
@@ -28,18 +168,125 @@ class MultiHttpFs(LoggingMixIn, Operations):
             raise FuseOSError(ENOENT)
         return fs, "/" + "/".join(rest)
 
+    def _sync_stats(self):
+        if self.stats is None:
+            return
+        values = (
+            self._reads,
+            self._bytes_read,
+            sum(fs.lru_hits for fs in self.fs.values()),
+            sum(fs.lru_misses for fs in self.fs.values()),
+            sum(fs.disk_hits for fs in self.fs.values()),
+            sum(fs.disk_misses for fs in self.fs.values()),
+            self._readahead_blocks,
+            self._readahead_bytes,
+            self.attr_cache.hits,
+            self.attr_cache.misses,
+            self.attr_cache.heads_saved,
+        )
+        for i, value in enumerate(values):
+            self.stats[i] = value  # type: ignore
+
+    def _prefetch(self, fs: HttpFs, url: str, block_num: int):
+        # `fs.getting` belongs to `HttpFs.read`, which adds and removes ids
+        # without locking, so readahead only looks at it to skip blocks a
+        # foreground read is fetching. Foreground reads wait for pending
+        # readahead of their blocks instead, see `_wait_readahead`.
+        block_id = (url, block_num)
+        try:
+            if block_id not in fs.getting:
+                data = fs.get_block(url, block_num)
+                with self._lock:
+                    self._readahead_blocks += 1
+                    self._readahead_bytes += len(data)
+        except Exception:
+            logger.debug("readahead failed %s", block_id, exc_info=True)
+        finally:
+            with self._lock:
+                self._inflight.pop(block_id, None)
+            self._sync_stats()
+
+    def _wait_readahead(self, fs: HttpFs, path: str, size: int, offset: int):
+        url = "{}:/{}".format(fs.schema, path[:-2])
+        first = offset // fs.block_size
+        last = (offset + size - 1) // fs.block_size
+        with self._lock:
+            pending = [
+                self._inflight[(url, block_num)]
+                for block_num in range(first, last + 1)
+                if (url, block_num) in self._inflight
+            ]
+        concurrent.futures.wait(pending)
+
+    def _schedule_readahead(self, fs: HttpFs, path: str, size: int, offset: int):
+        assert self._executor is not None
+        end = offset + size
+        last_block = (end - 1) // fs.block_size
+        n_blocks = -(-fs.getattr(path)["st_size"] // fs.block_size)
+
+        with self._lock:
+            expected, prefetched = self._cursors.get(path, (-1, -1))
+            start = max(prefetched, last_block) + 1
+            stop = min(last_block + self.readahead, n_blocks - 1)
+            if offset != expected:
+                # random access, just remember where this read ended
+                stop = max(prefetched, last_block)
+            self._cursors[path] = (end, max(prefetched, stop))
+
+        if offset != expected or start > stop:
+            return
+
+        url = "{}:/{}".format(fs.schema, path[:-2])
+        for block_num in range(start, stop + 1):
+            with self._lock:
+                if (url, block_num) in self._inflight:
+                    continue
+                self._inflight[(url, block_num)] = self._executor.submit(
+                    self._prefetch, fs, url, block_num
+                )
+
     def getattr(self, path, fh=None):
         logger.debug("getattr %s", path)
         if path == "/":
             first = next(iter(self.fs.values()))
             return first.getattr("/", fh)
-        fs, path = self._deref(path)
-        return fs.getattr(path, fh)
+
+        found, attrs = self.attr_cache.get(path)
+        if found:
+            if attrs is None:
+                raise FuseOSError(ENOENT)
+            return attrs
+
+        fs, fs_path = self._deref(path)
+        # HttpFs keeps attributes forever, expire them together with ours
+        fs.lru_attrs.cache.pop(fs_path, None)
+        try:
+            attrs = fs.getattr(fs_path, fh)
+        except Exception as e:
+            url = "{}:/{}".format(fs.schema, fs_path[:-2])
+            if not _is_missing(e, url):
+                # timeouts, server errors, ... are retried on the next lookup
+                logger.warning("getattr %s failed: %r", path, e)
+                raise FuseOSError(EIO)
+            self.attr_cache.put(path, None)
+            self._sync_stats()
+            raise FuseOSError(ENOENT)
+        self.attr_cache.put(path, attrs)
+        self._sync_stats()
+        return attrs
 
     def read(self, path, size, offset, fh):
         logger.debug("read %s", (path, size, offset))
         fs, path = self._deref(path)
-        return fs.read(path, size, offset, fh)
+        if self._executor is not None:
+            self._wait_readahead(fs, path, size, offset)
+            self._schedule_readahead(fs, path, size, offset)
+        data = fs.read(path, size, offset, fh)
+        with self._lock:
+            self._reads += 1
+            self._bytes_read += len(data)
+        self._sync_stats()
+        return data
 
     def readdir(self, path, fh):
         logger.debug("readdir %s", path)
@@ -49,15 +296,42 @@ class MultiHttpFs(LoggingMixIn, Operations):
         return [".", ".."] + files
 
     def destroy(self, path):
+        self.attr_cache.save()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
         for fs in self.fs.values():
             fs.destroy(path)
 
 
-def run(mount_point: str, disk_cache_dir: str):
+def run(
+    mount_point: str,
+    disk_cache_dir: str,
+    disk_cache_size: int = 2**25,
+    lru_capacity: int = 400,
+    block_size: int = 2**20,
+    readahead: int = 4,
+    readahead_workers: int = 4,
+    attr_cache_size: int = 10_000,
+    attr_cache_ttl: float = 300,
+    persist_attr_cache: bool = True,
+    stats: Optional[Sequence[int]] = None,
+):
+    attr_cache = AttrCache(
+        capacity=attr_cache_size,
+        ttl=attr_cache_ttl,
+        path=pathlib.Path(disk_cache_dir) / "attrs.json"
+        if persist_attr_cache
+        else None,
+    )
     fs = MultiHttpFs(
         ["http", "https"],
-        disk_cache_size=2**25,
+        disk_cache_size=disk_cache_size,
         disk_cache_dir=disk_cache_dir,
-        lru_capacity=400,
+        lru_capacity=lru_capacity,
+        block_size=block_size,
+        readahead=readahead,
+        readahead_workers=readahead_workers,
+        attr_cache=attr_cache,
+        stats=stats,
     )
     FUSE(fs, mount_point, foreground=True)
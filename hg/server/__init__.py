@@ -1,12 +1,18 @@
+import concurrent.futures
 import functools
-from typing import Callable, Dict, Optional
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Union
 
 from typing_extensions import ParamSpec
 
+import hg._memory as memory
 from hg.tilesets import LocalTileset
 
+from ._profile import Profiler
 from ._provider import TilesetProvider, TilesetResource
 
+if TYPE_CHECKING:
+    from ._daemon import DaemonClient
+
 __all__ = [
     "HgServer",
     "server",
@@ -21,6 +27,7 @@ class HgServer:
         # We need to keep references to served resources,
         # because the background server uses weakrefs.
         self._tilesets: Dict[str, TilesetResource] = {}
+        self._daemon: Optional["DaemonClient"] = None
 
     @property
     def port(self):
@@ -31,7 +38,36 @@ class HgServer:
     def reset(self) -> None:
         if self._provider is not None:
             self._provider.stop()
-        self._resources = {}
+            if self._provider.cache is not None:
+                self._provider.cache.clear()
+        if self._daemon is not None:
+            for uid, resource in self._tilesets.items():
+                if resource.provider is self._daemon:
+                    self._daemon.release(uid)
+        self._tilesets = {}
+
+    def use_daemon(self, directory: Optional[str] = None, idle_timeout: float = 600.0):
+        """Serve tilesets from a tile server shared by all kernels of the
+        current user on this host.
+
+        Connects to the per-user daemon in `directory` (`$HG_DAEMON_DIR`,
+        `$XDG_RUNTIME_DIR/hg-daemon` or a temporary directory by default),
+        starting it if it isn't running. File backed tilesets added afterwards
+        (`hg.cooler`, `hg.bigwig`, etc.) are opened and cached once by the
+        daemon for all kernels, others are still served by this kernel. The
+        daemon exits `idle_timeout` seconds after the last kernel
+        disconnected.
+
+        Kernels of different users (e.g. on a shared JupyterHub host) don't
+        share a daemon, each user's kernels start their own.
+        """
+        from ._daemon import DaemonClient
+
+        if self._daemon is None:
+            self._daemon = DaemonClient(directory, idle_timeout=idle_timeout)
+        if self._provider is not None:
+            self._daemon.proxy = self._provider.proxy
+        return self._daemon
 
     def enable_proxy(self):
         try:
@@ -43,25 +79,83 @@ class HgServer:
         if not self._provider:
             self._provider = TilesetProvider().start()
         self._provider.proxy = True
+        if self._daemon is not None:
+            self._daemon.proxy = True
 
     def disable_proxy(self):
         if not self._provider:
             raise RuntimeError("Server not started.")
         self._provider.proxy = False
+        if self._daemon is not None:
+            self._daemon.proxy = False
+
+    @property
+    def profiler(self) -> Profiler:
+        if not self._provider:
+            raise RuntimeError("Server not started.")
+        return self._provider.profiler
+
+    def profile(
+        self,
+        sample_rate: float = 0.0,
+        slow_threshold: float = 0.1,
+        capacity: int = 32,
+    ) -> Profiler:
+        """Start timing tile requests.
+
+        Requests slower than `slow_threshold` seconds are kept, up to the last
+        `capacity`, and a `sample_rate` fraction of `tiles()`/`info()` calls is
+        run under cProfile. Use `Profiler.dump_pstats` or
+        `Profiler.dump_chrome_trace` on the returned profiler to inspect them.
+        """
+        if not self._provider:
+            self._provider = TilesetProvider().start()
+        self._provider.profiler.configure(
+            enabled=True,
+            sample_rate=sample_rate,
+            slow_threshold=slow_threshold,
+            capacity=capacity,
+        )
+        return self._provider.profiler
+
+    def stop_profiling(self):
+        if self._provider:
+            self._provider.profiler.enabled = False
+
+    @property
+    def tilesets(self) -> Dict[str, LocalTileset]:
+        """The tilesets added to this server, by the uid their tracks use.
+
+        Includes the tilesets served by the shared daemon (see `use_daemon`).
+        """
+        return {r.tileset.uid: r.tileset for r in self._tilesets.values()}
+
+    def memory_budget(self, max_bytes: Optional[int]):
+        """Limit the total memory of the server's tile cache and the caches of
+        its tilesets. When exceeded, least recently used entries are evicted
+        from the largest caches first. `None` removes the limit.
+        """
+        memory.budget.max_bytes = max_bytes
+        memory.budget.check()
+
+    def memory_report(self) -> Dict[str, int]:
+        """Bytes held in memory by each cache, largest first."""
+        return memory.budget.report()
 
     def register(
-        self, tileset_fn: Callable[P, LocalTileset]
+        self, tileset_fn: Callable[P, LocalTileset], warm: int = 0
     ) -> Callable[P, TilesetResource]:
         """Register a tileset function for this server.
 
         This is just a convenience method to avoid the repetition of creating
-        a tileset and manually adding the tileset to the server.
+        a tileset and manually adding the tileset to the server. Tilesets are
+        warmed up to `warm` zoom levels (see `HgServer.warm`).
         """
 
         @functools.wraps(tileset_fn)
         def wrapper(*args, **kwargs):
             ts = tileset_fn(*args, **kwargs)
-            return self.add(ts)
+            return self.add(ts, warm=warm)
 
         return wrapper
 
@@ -69,24 +163,51 @@ class HgServer:
         self,
         tileset: LocalTileset,
         port: Optional[int] = None,
+        warm: int = 0,
     ) -> TilesetResource:
         """Add a tileset to the server.
 
         Note: Only tilesets with new uids are added to the server. If the tileset
               uid matches one already on the server, the existing tileset resource
               is returned. Existing tilesets can only be cleared with `HgServer.reset()`.
+
+        With `use_daemon`, tilesets with a recipe are served by the shared
+        daemon unless a `port` is given.
         """
-        if self._provider is None:
-            self._provider = TilesetProvider().start(port=port)
+        shared = self._daemon is not None and tileset.recipe is not None
+        if not shared or port is not None:
+            if self._provider is None:
+                self._provider = TilesetProvider().start(port=port)
 
-        if port is not None and port != self._provider.port:
-            self._provider.stop().start(port=port)
+            if port is not None and port != self._provider.port:
+                self._provider.stop().start(port=port)
 
         if tileset.uid not in self._tilesets:
-            self._tilesets[tileset.uid] = self._provider.create(tileset)
+            if shared and port is None:
+                assert self._daemon is not None
+                self._tilesets[tileset.uid] = self._daemon.create(tileset)
+            else:
+                assert self._provider is not None
+                self._tilesets[tileset.uid] = self._provider.create(tileset)
+            if warm > 0:
+                self.warm(tileset, zooms=warm)
 
         return self._tilesets[tileset.uid]
 
+    def warm(
+        self, tileset: Union[LocalTileset, TilesetResource], zooms: int = 2
+    ) -> concurrent.futures.Future:
+        """Precompute the tileset info and the `zooms` coarsest zoom levels
+        into the server's tile cache, in the background.
+
+        Returns a future which resolves to the number of tiles computed
+        once warm-up has finished.
+        """
+        if isinstance(tileset, TilesetResource):
+            tileset = tileset.tileset
+        resource = self.add(tileset)
+        return resource.provider.warm(resource.tileset, zooms=zooms)
+
     def __rich_repr__(self):
         yield "tilesets", self._tilesets
         try:
@@ -0,0 +1,172 @@
+import collections
+import hashlib
+import os
+import pathlib
+import threading
+from typing import Dict, Optional, Union
+
+import hg._memory as memory
+
+
+class TileCache:
+    """LRU cache of serialized tiles, bounded by bytes, with an optional disk layer.
+
+    Values are the JSON encoded tiles, so cached tiles are served without
+    re-serialization. Keys start with the tileset uid (`uid.` prefix), which
+    groups them for `invalidate`. A tileset's group is also keyed by its
+    `set_version` (e.g. a fingerprint of its files), so tiles kept on disk
+    for an earlier version of the data are not served after a restart.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 2**27,
+        cache_dir: Union[None, str, pathlib.Path] = None,
+        max_disk_bytes: int = 2**30,
+    ):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.cache_dir = None if cache_dir is None else pathlib.Path(cache_dir)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "collections.OrderedDict[str, bytes]" = collections.OrderedDict()
+        self._nbytes = 0
+        self._disk_entries: "collections.OrderedDict[pathlib.Path, int]" = (
+            collections.OrderedDict()
+        )
+        self._disk_nbytes = 0
+        self._versions: Dict[str, Optional[str]] = {}
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            files = sorted(
+                (p for p in self.cache_dir.glob("*/*") if p.is_file()),
+                key=lambda p: p.stat().st_mtime,
+            )
+            for path in files:
+                size = path.stat().st_size
+                self._disk_entries[path] = size
+                self._disk_nbytes += size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held in memory."""
+        return self._nbytes
+
+    def _group(self, uid: str) -> pathlib.Path:
+        assert self.cache_dir is not None
+        version = self._versions.get(uid)
+        name = uid if version is None else f"{uid}\0{version}"
+        return self.cache_dir / hashlib.sha1(name.encode()).hexdigest()
+
+    def _disk_path(self, key: str) -> pathlib.Path:
+        group = self._group(key.split(".", 1)[0])
+        return group / hashlib.sha1(key.encode()).hexdigest()
+
+    def set_version(self, uid: str, version: Optional[str]):
+        """Key the entries of tileset `uid` by `version` from now on.
+
+        If the version changed, entries of the previous version are dropped.
+        """
+        with self._lock:
+            if uid in self._versions and self._versions[uid] == version:
+                return
+        self.invalidate(uid)
+        with self._lock:
+            self._versions[uid] = version
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            try:
+                value = path.read_bytes()
+            except FileNotFoundError:
+                pass
+            else:
+                self.disk_hits += 1
+                self._set_memory(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def _set_memory(self, key: str, value: bytes):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._nbytes -= len(previous)
+            self._entries[key] = value
+            self._nbytes += len(value)
+            while self._nbytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= len(evicted)
+        memory.budget.check()
+
+    def evict(self, nbytes: int) -> int:
+        """Drop least recently used entries from memory (not from disk)."""
+        freed = 0
+        with self._lock:
+            while freed < nbytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                freed += len(evicted)
+            self._nbytes -= freed
+        return freed
+
+    def set(self, key: str, value: bytes):
+        self._set_memory(key, value)
+        if self.cache_dir is None:
+            return
+
+        path = self._disk_path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(value)
+        tmp.replace(path)
+        with self._lock:
+            self._disk_nbytes += len(value) - self._disk_entries.pop(path, 0)
+            self._disk_entries[path] = len(value)
+            while self._disk_nbytes > self.max_disk_bytes and self._disk_entries:
+                evicted, size = self._disk_entries.popitem(last=False)
+                self._disk_nbytes -= size
+                try:
+                    evicted.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def invalidate(self, uid: str):
+        """Drop all entries of the tileset `uid`, in memory and on disk."""
+        prefix = f"{uid}."
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                self._nbytes -= len(self._entries.pop(key))
+
+        if self.cache_dir is None:
+            return
+        group = self._group(uid)
+        with self._lock:
+            for path in [p for p in self._disk_entries if p.parent == group]:
+                self._disk_nbytes -= self._disk_entries.pop(path)
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
@@ -0,0 +1,124 @@
+import asyncio
+import itertools
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, MutableMapping, Set, Tuple
+
+import starlette.websockets
+
+from hg.tilesets import LocalTileset
+
+logger = logging.getLogger("hg.server")
+
+
+def parse_message(text: str) -> Tuple[List[str], List[str]]:
+    """The tile ids to cancel and to subscribe to in a client message.
+
+    >>> parse_message('{"subscribe": ["a.0.0"]}')
+    ([], ['a.0.0'])
+    >>> parse_message('{"cancel": "a.0.0"}')
+    Traceback (most recent call last):
+    ...
+    ValueError: "cancel" must be a list of tile ids
+    """
+    try:
+        message = json.loads(text)
+    except ValueError:
+        raise ValueError("not JSON") from None
+    if not isinstance(message, dict):
+        raise ValueError("expected a JSON object")
+    lists = []
+    for key in ("cancel", "subscribe"):
+        tids = message.get(key, [])
+        if not isinstance(tids, list) or not all(isinstance(t, str) for t in tids):
+            raise ValueError(f'"{key}" must be a list of tile ids')
+        lists.append(tids)
+    return lists[0], lists[1]
+
+
+class TileChannel:
+    """Streams tiles to a client over a WebSocket.
+
+    The client sends `{"subscribe": [tile ids]}` and `{"cancel": [tile ids]}`
+    messages. The server replies with a `{"id": tile id, "tile": tile}`
+    message per subscribed tile as soon as it is ready, in no particular
+    order. Cancelled tiles which haven't been computed yet are skipped.
+    Invalid messages are answered with an `{"error": message}` message.
+    """
+
+    def __init__(
+        self,
+        websocket: starlette.websockets.WebSocket,
+        tilesets: MutableMapping[str, LocalTileset],
+        get_tiles: Callable[[LocalTileset, List[str]], Awaitable[Dict[str, bytes]]],
+        batch_size: int = 8,
+        max_concurrency: int = 4,
+    ):
+        self.websocket = websocket
+        self.tilesets = tilesets
+        self.get_tiles = get_tiles
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.wanted: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def run(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._send_lock = asyncio.Lock()
+        await self.websocket.accept()
+        try:
+            while True:
+                text = await self.websocket.receive_text()
+                try:
+                    cancel, subscribe = parse_message(text)
+                except ValueError as e:
+                    await self.send({"error": f"Invalid message: {e}"})
+                    continue
+                self.wanted.difference_update(cancel)
+                self.subscribe(subscribe)
+        except starlette.websockets.WebSocketDisconnect:
+            pass
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+    def subscribe(self, tids: List[str]):
+        new = [tid for tid in dict.fromkeys(tids) if tid not in self.wanted]
+        self.wanted.update(new)
+        for uid, group in itertools.groupby(sorted(new), lambda t: t.split(".")[0]):
+            uid_tids = list(group)
+            for i in range(0, len(uid_tids), self.batch_size):
+                batch = uid_tids[i : i + self.batch_size]
+                task = asyncio.ensure_future(self.fetch(uid, batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def fetch(self, uid: str, tids: List[str]):
+        async with self._semaphore:
+            # skip tiles cancelled while waiting
+            tids = [tid for tid in tids if tid in self.wanted]
+            if not tids:
+                return
+            tileset = self.tilesets.get(uid)
+            if tileset is None:
+                error = {"error": f"No tileset found for requested uid: {uid}"}
+                encoded = {tid: json.dumps(error).encode() for tid in tids}
+            else:
+                try:
+                    encoded = await self.get_tiles(tileset, tids)
+                except Exception as e:
+                    logger.exception("Failed to compute tiles %s", tids)
+                    error = {"error": f"Failed to compute tile: {e}"}
+                    encoded = {tid: json.dumps(error).encode() for tid in tids}
+
+        for tid, value in encoded.items():
+            if tid not in self.wanted:
+                continue
+            self.wanted.discard(tid)
+            message = b'{"id":%b,"tile":%b}' % (json.dumps(tid).encode(), value)
+            async with self._send_lock:
+                await self.websocket.send_text(message.decode("utf-8"))
+
+    async def send(self, message: Any):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(message))
@@ -0,0 +1,391 @@
+"""A tile server shared by all notebook kernels of a user on one host.
+
+The daemon is per user: its directory and socket are only accessible to the
+user who started it, so on hosts shared by several users (e.g. JupyterHub)
+each user runs their own daemon and tiles are not shared between users.
+
+Kernels connect to the daemon over a Unix socket and register tilesets by
+their `LocalTileset.recipe`, which the daemon uses to open the tileset
+itself. Tilesets opened from the same file (with the same options and file
+fingerprint) share one handle, and all kernels share the daemon's tile
+cache. Registrations are reference counted per connection, so tilesets are
+dropped when the last kernel using them releases them or exits, and the
+daemon exits once no kernel has been connected for `idle_timeout` seconds.
+
+Only POSIX systems are supported.
+"""
+import argparse
+import collections
+import concurrent.futures
+import dataclasses
+import fcntl
+import json
+import logging
+import multiprocessing.connection
+import os
+import pathlib
+import secrets
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+
+from hg.tilesets import LocalTileset, from_recipe
+
+from ._cache import TileCache
+from ._provider import TilesetProvider, TilesetResource, server_url
+from ._watch import Fingerprint, fingerprint
+
+logger = logging.getLogger("hg.server")
+
+PathLike = Union[str, pathlib.Path]
+# (factory, filepath, options, fingerprint of the file)
+HandleKey = Tuple[str, str, str, Optional[Fingerprint]]
+
+
+def default_directory() -> pathlib.Path:
+    """Per-user directory holding the daemon's socket, state and cache."""
+    directory = os.environ.get("HG_DAEMON_DIR")
+    if directory is not None:
+        return pathlib.Path(directory)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir is not None and os.path.isdir(runtime_dir):
+        return pathlib.Path(runtime_dir) / "hg-daemon"
+    return pathlib.Path(tempfile.gettempdir()) / f"hg-daemon-{os.getuid()}"
+
+
+def ensure_private_directory(directory: pathlib.Path):
+    """Create `directory`, or check that an existing one is private.
+
+    The daemon and its clients exchange pickles over the socket in the
+    directory, so it must not be a directory another user could have
+    created or could write to.
+    """
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(f"{directory} is not a directory")
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"{directory} is owned by another user")
+    if st.st_mode & 0o077:
+        raise PermissionError(
+            f"{directory} is accessible to other users "
+            f"(mode {oct(st.st_mode & 0o777)}), expected 0o700"
+        )
+
+
+def handle_key(recipe: Dict[str, Any]) -> HandleKey:
+    options = json.dumps(recipe["kwargs"], sort_keys=True, default=repr)
+    return (
+        recipe["factory"],
+        recipe["filepath"],
+        options,
+        fingerprint(recipe["filepath"]),
+    )
+
+
+class Daemon:
+    """Serves tilesets registered by connected clients, see the module docs."""
+
+    def __init__(self, directory: PathLike, idle_timeout: float = 600.0):
+        self.directory = pathlib.Path(directory)
+        self.idle_timeout = idle_timeout
+        self.provider = TilesetProvider(
+            cache=TileCache(cache_dir=self.directory / "tiles")
+        )
+        self._lock = threading.Lock()
+        self._handles: Dict[HandleKey, LocalTileset] = {}
+        # uid -> (handle key, tileset served under uid)
+        self._tilesets: Dict[str, Tuple[HandleKey, LocalTileset]] = {}
+        self._refs: "collections.Counter[str]" = collections.Counter()
+        self._clients = 0
+        self._idle_since = time.monotonic()
+        self._closing = False
+
+    def register(self, recipe: Dict[str, Any]) -> str:
+        """Serve the tileset of `recipe` under its uid, which is returned."""
+        key = handle_key(recipe)
+        uid = recipe["uid"]
+        with self._lock:
+            entry = self._tilesets.get(uid)
+            if entry is None or entry[0] != key:
+                handle = self._handles.get(key)
+                if handle is None:
+                    handle = self._handles[key] = from_recipe(recipe)
+                tileset = (
+                    handle
+                    if handle.uid == uid
+                    else dataclasses.replace(handle, uid=uid)
+                )
+                self._tilesets[uid] = (key, tileset)
+                if entry is not None:
+                    # the file changed since it was registered
+                    self._drop_handle(entry[0])
+                    self.provider.invalidate(uid)
+                # the tile cache on disk outlives the daemon, key its tiles by
+                # the file's fingerprint and options
+                self.provider.create(tileset, version=repr(key))
+            self._refs[uid] += 1
+        return uid
+
+    def release(self, uid: str):
+        with self._lock:
+            if self._refs[uid] > 1:
+                self._refs[uid] -= 1
+                return
+            del self._refs[uid]
+            key, _ = self._tilesets.pop(uid)
+            self.provider.remove(uid)
+            self._drop_handle(key)
+
+    def _drop_handle(self, key: HandleKey):
+        if all(k != key for k, _ in self._tilesets.values()):
+            self._handles.pop(key, None)
+
+    def warm(self, uid: str, zooms: int) -> int:
+        with self._lock:
+            _, tileset = self._tilesets[uid]
+        return self.provider.warm(tileset, zooms).result()
+
+    def handle(self, request: Tuple[Any, ...]) -> Any:
+        command, *args = request
+        if command == "hello":
+            return {"port": self.provider.port, "pid": os.getpid()}
+        if command == "register":
+            return self.register(*args)
+        if command == "warm":
+            return self.warm(*args)
+        if command == "stats":
+            with self._lock:
+                return {
+                    "clients": self._clients,
+                    "tilesets": dict(self._refs),
+                    "handles": len(self._handles),
+                }
+        raise ValueError(f"Unknown command: {command}")
+
+    def serve(self, conn: multiprocessing.connection.Connection):
+        """Answer the requests of one client, releasing its tilesets on exit."""
+        held: "collections.Counter[str]" = collections.Counter()
+        try:
+            while True:
+                request = conn.recv()
+                try:
+                    if request[0] == "release":
+                        if held[request[1]] > 0:
+                            held[request[1]] -= 1
+                            self.release(request[1])
+                        result: Any = None
+                    else:
+                        result = self.handle(request)
+                        if request[0] == "register":
+                            held[result] += 1
+                except Exception as e:
+                    logger.exception("Failed to handle %s", request[0])
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+                else:
+                    conn.send(("ok", result))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            for uid, count in held.items():
+                for _ in range(count):
+                    self.release(uid)
+            with self._lock:
+                self._clients -= 1
+                if self._clients == 0:
+                    self._idle_since = time.monotonic()
+
+    def _accept(self, listener: multiprocessing.connection.Listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except multiprocessing.AuthenticationError:
+                continue
+            except OSError:
+                return
+            with self._lock:
+                if self._closing:
+                    conn.close()
+                    continue
+                self._clients += 1
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def run(self):
+        ensure_private_directory(self.directory)
+        socket_path = self.directory / "daemon.sock"
+        if socket_path.exists():
+            socket_path.unlink()
+        authkey = secrets.token_bytes(32)
+        listener = multiprocessing.connection.Listener(
+            str(socket_path), family="AF_UNIX", authkey=authkey
+        )
+        self.provider.start()
+        _write_state(
+            self.directory,
+            {"pid": os.getpid(), "port": self.provider.port, "authkey": authkey.hex()},
+        )
+        threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+        logger.info("hg daemon serving on port %s", self.provider.port)
+
+        try:
+            while True:
+                time.sleep(1)
+                with self._lock:
+                    idle = time.monotonic() - self._idle_since
+                    if self._clients == 0 and idle > self.idle_timeout:
+                        self._closing = True
+                        break
+        finally:
+            _remove_state(self.directory)
+            listener.close()
+            self.provider.stop()
+
+
+def _remove_state(directory: pathlib.Path):
+    # `unlink(missing_ok=True)` needs Python 3.8
+    try:
+        (directory / "daemon.json").unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _write_state(directory: pathlib.Path, state: Dict[str, Any]):
+    tmp = directory / "daemon.json.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, directory / "daemon.json")
+
+
+def _connect(directory: pathlib.Path) -> multiprocessing.connection.Connection:
+    state = json.loads((directory / "daemon.json").read_text())
+    return multiprocessing.connection.Client(
+        str(directory / "daemon.sock"),
+        family="AF_UNIX",
+        authkey=bytes.fromhex(state["authkey"]),
+    )
+
+
+class DaemonClient:
+    """A kernel's connection to the shared daemon, started if not running.
+
+    Tilesets are registered by recipe with `create`, and released when the
+    connection is closed (or the kernel exits).
+    """
+
+    proxy: bool = False
+
+    def __init__(
+        self,
+        directory: Optional[PathLike] = None,
+        idle_timeout: float = 600.0,
+        timeout: float = 30.0,
+    ):
+        self.directory = (
+            default_directory() if directory is None else pathlib.Path(directory)
+        )
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._warm_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._conn = self._connect(timeout)
+        hello = self._call("hello")
+        self.port: int = hello["port"]
+        self.pid: int = hello["pid"]
+
+    def _connect(self, timeout: float) -> multiprocessing.connection.Connection:
+        ensure_private_directory(self.directory)
+        # only one kernel starts the daemon
+        with (self.directory / "daemon.lock").open("w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return _connect(self.directory)
+            except (OSError, ValueError, KeyError, EOFError):
+                pass
+            self._spawn()
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    return _connect(self.directory)
+                except (OSError, ValueError, KeyError, EOFError):
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(
+                            "The hg daemon didn't start, see "
+                            f"{self.directory / 'daemon.log'}"
+                        ) from None
+                    time.sleep(0.05)
+
+    def _spawn(self):
+        _remove_state(self.directory)
+        with (self.directory / "daemon.log").open("ab") as log:
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "hg.server._daemon",
+                    str(self.directory),
+                    "--idle-timeout",
+                    str(self.idle_timeout),
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+                start_new_session=True,
+            )
+
+    def _call(self, *request: Any) -> Any:
+        with self._lock:
+            self._conn.send(request)
+            status, result = self._conn.recv()
+        if status == "error":
+            raise RuntimeError(f"hg daemon: {result}")
+        return result
+
+    @property
+    def url(self) -> str:
+        return server_url(self.port, self.proxy)
+
+    def create(self, tileset: LocalTileset) -> TilesetResource:
+        if tileset.recipe is None:
+            raise ValueError(
+                f"Tileset {tileset.uid} cannot be shared, it has no recipe"
+            )
+        uid = self._call("register", tileset.recipe)
+        if uid != tileset.uid:
+            # point tracks at the uid the daemon serves the tileset under
+            tileset = dataclasses.replace(tileset, uid=uid)
+        return TilesetResource(tileset, provider=self)  # type: ignore
+
+    def release(self, uid: str):
+        self._call("release", uid)
+
+    def warm(self, tileset: LocalTileset, zooms: int = 2) -> concurrent.futures.Future:
+        if self._warm_executor is None:
+            self._warm_executor = concurrent.futures.ThreadPoolExecutor(
+                1, thread_name_prefix="hg-warm"
+            )
+        return self._warm_executor.submit(self._call, "warm", tileset.uid, zooms)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._call("stats")
+
+    def close(self):
+        self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared hg tile server")
+    parser.add_argument("directory", nargs="?", default=None)
+    parser.add_argument("--idle-timeout", type=float, default=600.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    directory = default_directory() if args.directory is None else args.directory
+    Daemon(directory, idle_timeout=args.idle_timeout).run()
+
+
+if __name__ == "__main__":
+    main()
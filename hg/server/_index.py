@@ -0,0 +1,177 @@
+import asyncio
+import concurrent.futures
+import inspect
+import json
+import logging
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from hg.tilesets import LocalTileset
+
+logger = logging.getLogger("hg.server")
+
+
+@dataclass(frozen=True)
+class IndexEntry:
+    # JSON encoded tileset info, or an error
+    info: bytes
+    datatype: Optional[str]
+    name: Optional[str]
+    # chromsizes as TSV, if the info has any
+    chromsizes: Optional[str]
+
+    def describe(self, uid: str) -> bytes:
+        """A JSON object for the tileset listing."""
+        meta = {"uuid": uid, "name": self.name, "datatype": self.datatype}
+        return json.dumps(meta)[:-1].encode() + b',"tileset_info":' + self.info + b"}"
+
+
+class TilesetIndex:
+    """Tileset infos and chromsizes, computed once per tileset.
+
+    Entries are computed as soon as tilesets are added, so many tilesets
+    are described in parallel, and are then served from memory until
+    `discard`ed. Infos of sync tilesets are computed on `executor`, those
+    of async tilesets on the server's event loop, like their tiles. The loop
+    is known from the first `get`, until which async tilesets are pending.
+    """
+
+    def __init__(
+        self,
+        encode_info: Callable[[LocalTileset], bytes],
+        executor: concurrent.futures.Executor,
+        encode_info_async: Optional[Callable[[LocalTileset], Awaitable[bytes]]] = None,
+    ):
+        self.encode_info = encode_info
+        self.encode_info_async = encode_info_async
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # uid -> (tileset, future of its entry, loop computing it, if async)
+        self._entries: Dict[
+            str,
+            Tuple[
+                "weakref.ref[LocalTileset]",
+                concurrent.futures.Future,
+                Optional[asyncio.AbstractEventLoop],
+            ],
+        ] = {}
+        self._pending: Dict[str, LocalTileset] = {}
+
+    def _is_async(self, tileset: LocalTileset) -> bool:
+        return self.encode_info_async is not None and inspect.iscoroutinefunction(
+            tileset.info
+        )
+
+    def _describe(self, tileset: LocalTileset, encoded: bytes) -> IndexEntry:
+        chromsizes = None
+        info = json.loads(encoded)
+        if isinstance(info, dict) and "chromsizes" in info:
+            chromsizes = "\n".join(
+                f"{chrom}\t{size}" for chrom, size in info["chromsizes"]
+            )
+        return IndexEntry(encoded, tileset.datatype, tileset.name, chromsizes)
+
+    def _failed(
+        self, tileset: LocalTileset, future: concurrent.futures.Future, error: str
+    ):
+        logger.exception("Failed to compute the info of tileset %s", tileset.uid)
+        encoded = json.dumps({"error": f"Failed to get tileset info: {error}"})
+        # retry on the next request, unless the tileset was added again since
+        with self._lock:
+            entry = self._entries.get(tileset.uid)
+            if entry is not None and entry[1] is future:
+                del self._entries[tileset.uid]
+        future.set_result(
+            IndexEntry(encoded.encode(), tileset.datatype, tileset.name, None)
+        )
+
+    def _compute(self, tileset: LocalTileset, future: concurrent.futures.Future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            entry = self._describe(tileset, self.encode_info(tileset))
+        except Exception as e:
+            self._failed(tileset, future, str(e))
+        else:
+            future.set_result(entry)
+
+    async def _compute_async(
+        self, tileset: LocalTileset, future: concurrent.futures.Future
+    ):
+        if not future.set_running_or_notify_cancel():
+            return
+        assert self.encode_info_async is not None
+        try:
+            entry = self._describe(tileset, await self.encode_info_async(tileset))
+        except Exception as e:
+            self._failed(tileset, future, str(e))
+        else:
+            future.set_result(entry)
+
+    def _start(
+        self,
+        tileset: LocalTileset,
+        loop: Optional[asyncio.AbstractEventLoop],
+    ) -> concurrent.futures.Future:
+        """Compute the entry of `tileset`, with `self._lock` held."""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._pending.pop(tileset.uid, None)
+        self._entries[tileset.uid] = (weakref.ref(tileset), future, loop)
+        if loop is None:
+            self.executor.submit(self._compute, tileset, future)
+        else:
+            asyncio.run_coroutine_threadsafe(self._compute_async(tileset, future), loop)
+        return future
+
+    def add(self, tileset: LocalTileset) -> Optional[concurrent.futures.Future]:
+        """Start computing the entry of `tileset`, returns its future or None
+        for async tilesets added before the event loop is known."""
+        with self._lock:
+            entry = self._entries.get(tileset.uid)
+            if entry is not None and entry[0]() is tileset:
+                return entry[1]
+            if not self._is_async(tileset):
+                return self._start(tileset, None)
+            loop = self._loop
+            if loop is None or loop.is_closed():
+                self._entries.pop(tileset.uid, None)
+                self._pending[tileset.uid] = tileset
+                return None
+            return self._start(tileset, loop)
+
+    async def get(self, tileset: LocalTileset) -> IndexEntry:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._loop is not loop:
+                self._loop = loop
+                pending, self._pending = self._pending, {}
+                for pending_tileset in pending.values():
+                    self._start(pending_tileset, loop)
+            entry = self._entries.get(tileset.uid)
+            if (
+                entry is None
+                or entry[0]() is not tileset
+                # computed on an earlier loop of a restarted server
+                or (entry[2] not in (None, loop) and not entry[1].done())
+            ):
+                future = self._start(tileset, loop if self._is_async(tileset) else None)
+            else:
+                future = entry[1]
+        return await asyncio.wrap_future(future)
+
+    def discard(self, uid: str):
+        with self._lock:
+            self._entries.pop(uid, None)
+            self._pending.pop(uid, None)
+
+    def prune(self, uids: Iterable[str]):
+        """Drop entries of tilesets other than `uids`."""
+        uids = set(uids)
+        with self._lock:
+            for uid in set(self._entries) - uids:
+                del self._entries[uid]
+            for uid in set(self._pending) - uids:
+                del self._pending[uid]
@@ -0,0 +1,152 @@
+import collections
+import contextlib
+import cProfile
+import io
+import json
+import pathlib
+import pstats
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+
+class Trace:
+    """Timings of the phases (lookup, compute, serialize, send) of one request."""
+
+    def __init__(self, name: str, args: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.args = args or {}
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.spans: List[Tuple[str, float, float]] = []
+        self.profile: Optional[cProfile.Profile] = None
+
+    def __repr__(self):
+        spans = ", ".join(f"{name}={dur * 1e3:.1f}ms" for name, _, dur in self.spans)
+        return f"Trace({self.name!r}, {self.duration * 1e3:.1f}ms, {spans})"
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, start, time.perf_counter() - start))
+
+
+class _NullTrace:
+    def span(self, name: str):
+        return contextlib.nullcontext()
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Profiler:
+    """Opt-in timing of tile requests.
+
+    Every request is timed by phase. Requests slower than `slow_threshold`
+    seconds are kept in a ring buffer of the last `capacity` traces. A
+    fraction `sample_rate` of `tiles()` and `info()` calls additionally run
+    under cProfile.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        sample_rate: float = 0.0,
+        slow_threshold: float = 0.1,
+        capacity: int = 32,
+    ):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.traces: "collections.deque[Trace]" = collections.deque(maxlen=capacity)
+        # only one cProfile profiler can be active at a time
+        self._profiling = threading.Lock()
+
+    def configure(self, **options):
+        capacity = options.pop("capacity", None)
+        for key, value in options.items():
+            if not hasattr(self, key):
+                raise TypeError(f"Unknown profiler option: {key}")
+            setattr(self, key, value)
+        if capacity is not None:
+            self.traces = collections.deque(self.traces, maxlen=capacity)
+
+    def trace(self, name: str, **args) -> Union[Trace, _NullTrace]:
+        return Trace(name, args) if self.enabled else NULL_TRACE
+
+    def finish(self, trace: Union[Trace, _NullTrace]):
+        if not isinstance(trace, Trace):
+            return
+        trace.duration = time.perf_counter() - trace.start
+        if trace.duration >= self.slow_threshold:
+            self.traces.append(trace)
+
+    @contextlib.contextmanager
+    def compute(self, trace: Union[Trace, _NullTrace]) -> Iterator[None]:
+        """Time the "compute" phase, sampling it with cProfile."""
+        if not isinstance(trace, Trace):
+            yield
+            return
+
+        sampled = random.random() < self.sample_rate and self._profiling.acquire(
+            blocking=False
+        )
+        with trace.span("compute"):
+            if not sampled:
+                yield
+                return
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                self._profiling.release()
+                trace.profile = profile
+
+    def clear(self):
+        self.traces.clear()
+
+    def stats(self) -> Optional[pstats.Stats]:
+        """Combined cProfile stats of the kept traces, if any were sampled."""
+        profiles = [t.profile for t in self.traces if t.profile is not None]
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0], stream=io.StringIO())
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def dump_pstats(self, path: Union[str, pathlib.Path]):
+        stats = self.stats()
+        if stats is None:
+            raise ValueError("No sampled profiles, increase `sample_rate`")
+        stats.dump_stats(str(path))
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """The kept traces in the Chrome trace event format (chrome://tracing)."""
+        events = []
+        for trace in self.traces:
+            common = {"ph": "X", "pid": 1, "tid": trace.thread}
+            events.append(
+                dict(
+                    common,
+                    name=trace.name,
+                    ts=trace.start * 1e6,
+                    dur=trace.duration * 1e6,
+                    args=trace.args,
+                )
+            )
+            for name, start, duration in trace.spans:
+                events.append(
+                    dict(common, name=name, ts=start * 1e6, dur=duration * 1e6)
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump_chrome_trace(self, path: Union[str, pathlib.Path]):
+        pathlib.Path(path).write_text(json.dumps(self.chrome_trace()))
@@ -1,26 +1,54 @@
+import asyncio
+import concurrent.futures
+import inspect
 import itertools
+import json
 import os
 import weakref
 from dataclasses import dataclass
-from typing import List, MutableMapping, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    MutableMapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import starlette.applications
 import starlette.middleware.cors
 import starlette.requests
 import starlette.responses
 import starlette.routing
+import starlette.websockets
 
+import hg._memory as memory
+from hg._grid import max_zoom, zoom_tile_ids
 from hg.api import track
-from hg.tilesets import LocalTileset
+from hg.tilesets import LocalTileset, run_sync
 from hg.utils import TrackType, _datatype_default_track
 
 from ._background_server import BackgroundServer
+from ._cache import TileCache
+from ._channel import TileChannel
+from ._index import TilesetIndex
+from ._profile import NULL_TRACE, Profiler, Trace, _NullTrace
+from ._watch import FileWatcher, etag
+
+if TYPE_CHECKING:
+    from ._daemon import DaemonClient
+
+AnyTrace = Union[Trace, _NullTrace]
 
 
 @dataclass(frozen=True)
 class TilesetResource:
     tileset: LocalTileset
-    provider: "TilesetProvider"
+    provider: Union["TilesetProvider", "DaemonClient"]
 
     @property
     def server(self) -> str:
@@ -55,26 +83,281 @@ def get_list(query: str, field: str) -> List[str]:
     return [v for k, v in kv_tuples if k == field]
 
 
+def encode_tile(tile: Any) -> bytes:
+    # same encoding as `starlette.responses.JSONResponse`
+    return json.dumps(
+        tile, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def is_error(tile: Any) -> bool:
+    return isinstance(tile, dict) and "error" in tile
+
+
+def info_key(uid: str) -> str:
+    # shares the `uid.` prefix of tile ids, see `TileCache.invalidate`
+    return f"{uid}.tileset_info"
+
+
+def _lookup(
+    tids: Iterable[str], cache: Optional[TileCache], trace: AnyTrace
+) -> Tuple[Dict[str, bytes], List[str]]:
+    """Encoded tiles found in `cache`, and the ids of those missing."""
+    encoded: Dict[str, bytes] = {}
+    missing = []
+    with trace.span("lookup"):
+        for tid in tids:
+            value = None if cache is None else cache.get(tid)
+            if value is None:
+                missing.append(tid)
+            else:
+                encoded[tid] = value
+    return encoded, missing
+
+
+def _store(
+    computed: Iterable[Tuple[str, Any]],
+    encoded: Dict[str, bytes],
+    cache: Optional[TileCache],
+    trace: AnyTrace,
+):
+    with trace.span("serialize"):
+        for tid, tval in computed:
+            encoded[tid] = encode_tile(tval)
+            if cache is not None and not is_error(tval):
+                cache.set(tid, encoded[tid])
+
+
+def cached_info(
+    tileset: LocalTileset,
+    cache: Optional[TileCache],
+    profiler: Optional[Profiler] = None,
+    trace: AnyTrace = NULL_TRACE,
+) -> bytes:
+    key = info_key(tileset.uid)
+    encoded, missing = _lookup([key], cache, trace)
+    if missing:
+        with _compute(profiler, trace):
+            info = run_sync(tileset.info)
+        _store([(key, info)], encoded, cache, trace)
+    return encoded[key]
+
+
+def cached_tiles(
+    tileset: LocalTileset,
+    tids: Iterable[str],
+    cache: Optional[TileCache],
+    profiler: Optional[Profiler] = None,
+    trace: AnyTrace = NULL_TRACE,
+) -> Dict[str, bytes]:
+    """Encoded tiles, computing only those missing from `cache`."""
+    encoded, missing = _lookup(tids, cache, trace)
+    if missing:
+        with _compute(profiler, trace):
+            computed = run_sync(tileset.tiles, missing)
+        _store(computed, encoded, cache, trace)
+    return encoded
+
+
+async def call_tileset(
+    fn: Callable[..., Any],
+    *args: Any,
+    executor: Optional[concurrent.futures.Executor] = None,
+    profiler: Optional[Profiler] = None,
+    trace: AnyTrace = NULL_TRACE,
+) -> Any:
+    """Await an async tileset function, or run a sync one on `executor`.
+
+    Only sync functions are sampled with cProfile, which would otherwise
+    also profile other requests on the event loop.
+    """
+    if inspect.iscoroutinefunction(fn):
+        with trace.span("compute"):
+            return await fn(*args)
+
+    def compute():
+        with _compute(profiler, trace):
+            return fn(*args)
+
+    result = await asyncio.get_running_loop().run_in_executor(executor, compute)
+    if inspect.isawaitable(result):
+        # e.g. callable objects with an async `__call__`
+        with trace.span("compute"):
+            result = await result
+    return result
+
+
+async def cached_info_async(
+    tileset: LocalTileset,
+    cache: Optional[TileCache],
+    executor: Optional[concurrent.futures.Executor] = None,
+    profiler: Optional[Profiler] = None,
+    trace: AnyTrace = NULL_TRACE,
+) -> bytes:
+    """Like `cached_info`, awaiting async tilesets on the running loop."""
+    key = info_key(tileset.uid)
+    encoded, missing = _lookup([key], cache, trace)
+    if missing:
+        info = await call_tileset(
+            tileset.info, executor=executor, profiler=profiler, trace=trace
+        )
+        _store([(key, info)], encoded, cache, trace)
+    return encoded[key]
+
+
+async def cached_tiles_async(
+    tileset: LocalTileset,
+    tids: Iterable[str],
+    cache: Optional[TileCache],
+    executor: Optional[concurrent.futures.Executor] = None,
+    profiler: Optional[Profiler] = None,
+    trace: AnyTrace = NULL_TRACE,
+) -> Dict[str, bytes]:
+    """Like `cached_tiles`, awaiting async tilesets on the running loop."""
+    encoded, missing = _lookup(tids, cache, trace)
+    if missing:
+        computed = await call_tileset(
+            tileset.tiles, missing, executor=executor, profiler=profiler, trace=trace
+        )
+        _store(computed, encoded, cache, trace)
+    return encoded
+
+
+def warm_tileset(tileset: LocalTileset, cache: TileCache, zooms: int) -> int:
+    """Cache the tileset info and tiles of the `zooms` coarsest zoom levels.
+
+    Returns the number of tiles computed.
+    """
+    info = json.loads(cached_info(tileset, cache))
+    if "min_pos" not in info:
+        return 0
+    n_tiles = 0
+    for zoom in range(min(zooms, max_zoom(info) + 1)):
+        tids = [
+            tid
+            for tid in sorted(zoom_tile_ids(tileset.uid, info, zoom))
+            if tid not in cache
+        ]
+        n_tiles += len(cached_tiles(tileset, tids, cache))
+    return n_tiles
+
+
+def join_tiles(encoded: Dict[str, bytes]) -> bytes:
+    """Join pre-encoded tiles into a JSON object."""
+    return b"{%b}" % b",".join(
+        encode_tile(tid) + b":" + value for tid, value in encoded.items()
+    )
+
+
+def _compute(profiler: Optional[Profiler], trace: AnyTrace):
+    return trace.span("compute") if profiler is None else profiler.compute(trace)
+
+
+class TracedResponse(starlette.responses.Response):
+    """A JSON response which times sending itself and then finishes `trace`."""
+
+    media_type = "application/json"
+
+    def __init__(
+        self,
+        content: bytes,
+        profiler: Profiler,
+        trace: AnyTrace,
+        etag: Optional[str] = None,
+    ):
+        super().__init__(content, headers=None if etag is None else {"ETag": etag})
+        self.profiler = profiler
+        self.trace = trace
+
+    async def __call__(self, scope, receive, send):
+        with self.trace.span("send"):
+            await super().__call__(scope, receive, send)
+        self.profiler.finish(self.trace)
+
+
+class BinaryResponse(starlette.responses.Response):
+    media_type = "application/octet-stream"
+
+    def render(self, content: Any) -> bytes:
+        # `pack_tiles` already returns bytes, don't copy them again
+        return content
+
+
 # adapted from https://github.com/higlass/higlass-python/blob/b3be6e49cbcab6be72eb0ad65c68a286161b8682/higlass/server.py#L169-L199
-def create_tileset_route(tileset_resources: MutableMapping[str, LocalTileset]):
-    def tileset_info(request: starlette.requests.Request):
+def create_tileset_route(
+    tileset_resources: MutableMapping[str, LocalTileset],
+    cache: Optional[TileCache] = None,
+    profiler: Optional[Profiler] = None,
+    watcher: Optional[FileWatcher] = None,
+    executor: Optional[concurrent.futures.Executor] = None,
+    index: Optional[TilesetIndex] = None,
+    page_size: int = 100,
+):
+    """Routes of the tileset API.
+
+    Sync tileset functions run on `executor` (the event loop's default
+    executor if None), async ones are awaited on the event loop. Tileset
+    infos and chromsizes are served from `index`.
+    """
+    if profiler is None:
+        profiler = Profiler()
+    if index is None:
+        index = TilesetIndex(
+            lambda tileset: cached_info(tileset, cache),
+            executor or concurrent.futures.ThreadPoolExecutor(),
+            lambda tileset: cached_info_async(tileset, cache, executor),
+        )
+
+    def request_etag(ids: Iterable[str], uids: Iterable[str]) -> Optional[str]:
+        # only tilesets backed by (watched) files have a version
+        if watcher is None:
+            return None
+        fingerprints = [watcher.fingerprint(uid) for uid in sorted(set(uids))]
+        if not fingerprints or None in fingerprints:
+            return None
+        return etag(sorted(ids), fingerprints)
+
+    def not_modified(request: starlette.requests.Request, tag: Optional[str]):
+        if tag is None or request.headers.get("if-none-match") != tag:
+            return None
+        return starlette.responses.Response(status_code=304, headers={"ETag": tag})
+
+    async def tileset_info(request: starlette.requests.Request):
         uids = get_list(request.url.query, "d")
-        info = {
-            uid: tileset_resources[uid].info()
-            if uid in tileset_resources
-            else {"error": f"No such tileset with uid: {uid}"}
-            for uid in uids
-        }
-        return starlette.responses.JSONResponse(info)
-
-    def tiles(request: starlette.requests.Request):
+        tag = request_etag(["tileset_info"], uids)
+        cached_response = not_modified(request, tag)
+        if cached_response is not None:
+            return cached_response
+
+        trace = profiler.trace("tileset_info", uids=uids)
+
+        async def get_info(uid: str) -> bytes:
+            tileset = tileset_resources.get(uid)
+            if tileset is None:
+                return encode_tile({"error": f"No such tileset with uid: {uid}"})
+            return (await index.get(tileset)).info
+
+        with trace.span("lookup"):
+            values = await asyncio.gather(*map(get_info, uids))
+        info = dict(zip(uids, values))
+        with trace.span("serialize"):
+            content = join_tiles(info)
+        return TracedResponse(content, profiler, trace, tag)
+
+    async def tiles(request: starlette.requests.Request):
         requested_tids = set(get_list(request.url.query, "d"))
         if not requested_tids:
             return starlette.responses.JSONResponse(
                 {"error": "No tiles requested"}, 400
             )
 
-        tiles: list = []
+        tag = request_etag(requested_tids, (t.split(".")[0] for t in requested_tids))
+        cached_response = not_modified(request, tag)
+        if cached_response is not None:
+            return cached_response
+
+        trace = profiler.trace("tiles", tids=sorted(requested_tids))
+        fetches = []
         for uid, tids in itertools.groupby(
             iterable=sorted(requested_tids), key=lambda tid: tid.split(".")[0]
         ):
@@ -83,41 +366,220 @@ def create_tileset_route(tileset_resources: MutableMapping[str, LocalTileset]):
                 return starlette.responses.JSONResponse(
                     {"error": f"No tileset found for requested uid: {uid}"}, 400
                 )
-            tiles.extend(tileset_resource.tiles(list(tids)))
-        data = {tid: tval for tid, tval in tiles}
-        return starlette.responses.JSONResponse(data)
+            fetches.append(
+                cached_tiles_async(
+                    tileset_resource, list(tids), cache, executor, profiler, trace
+                )
+            )
+
+        # tilesets are fetched concurrently
+        encoded: Dict[str, bytes] = {}
+        for result in await asyncio.gather(*fetches):
+            encoded.update(result)
+
+        with trace.span("serialize"):
+            content = join_tiles(encoded)
+        return TracedResponse(content, profiler, trace, tag)
+
+    async def tiles_bin(request: starlette.requests.Request):
+        """Tiles requested as a JSON list of ids, framed with `pack_tiles`.
+
+        Tiles found in `cache` are stored JSON encoded (dense data as
+        base64), so they are decoded before being framed. Computed tiles
+        are framed from the arrays of `LocalTileset.raw_tiles` if the
+        tileset has them.
+        """
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, list) or not all(isinstance(t, str) for t in body):
+            return starlette.responses.JSONResponse(
+                {"error": "Expected a JSON list of tile ids"}, 400
+            )
+        requested_tids = set(body)
+        if not requested_tids:
+            return starlette.responses.JSONResponse(
+                {"error": "No tiles requested"}, 400
+            )
+        for tid in requested_tids:
+            if tid.split(".")[0] not in tileset_resources:
+                return starlette.responses.JSONResponse(
+                    {"error": f"No tileset found for requested tile: {tid}"}, 400
+                )
+        from hg._tiles import encode_dense, pack_tiles
+
+        trace = profiler.trace("tiles_bin", tids=sorted(requested_tids))
+        tiles: Dict[str, Any] = {}
+        fetches = []
+        for uid, tids in itertools.groupby(
+            iterable=sorted(requested_tids), key=lambda tid: tid.split(".")[0]
+        ):
+            # cached tiles are JSON encoded, see `cached_tiles`
+            encoded, missing = _lookup(tids, cache, trace)
+            tiles.update((tid, json.loads(value)) for tid, value in encoded.items())
+            if missing:
+                tileset = tileset_resources[uid]
+                fetches.append(
+                    call_tileset(
+                        tileset.raw_tiles or tileset.tiles,
+                        missing,
+                        executor=executor,
+                        profiler=profiler,
+                        trace=trace,
+                    )
+                )
+        computed: List[Tuple[str, Any]] = []
+        for result in await asyncio.gather(*fetches):
+            computed.extend(result)
+        tiles.update(computed)
 
-    def chromsizes(request: starlette.requests.Request):
+        loop = asyncio.get_running_loop()
+        with trace.span("serialize"):
+            content = await loop.run_in_executor(
+                executor, pack_tiles, list(tiles.items())
+            )
+        if computed and cache is not None:
+            # cache new tiles like `/tiles/` does, so both endpoints share them
+            json_tiles = ((tid, encode_dense(tile)) for tid, tile in computed)
+            await loop.run_in_executor(executor, _store, json_tiles, {}, cache, trace)
+        profiler.finish(trace)
+        return BinaryResponse(content)
+
+    async def tiles_ws(websocket: starlette.websockets.WebSocket):
+        """Stream tiles over a WebSocket, see `TileChannel`.
+
+        Serving WebSockets requires `websockets` (or `wsproto`) for uvicorn,
+        installed with the `hg[websockets]` extra.
+        """
+        channel = TileChannel(
+            websocket,
+            tileset_resources,
+            lambda tileset, tids: cached_tiles_async(tileset, tids, cache, executor),
+        )
+        await channel.run()
+
+    async def chromsizes(request: starlette.requests.Request):
         """Return chromsizes for given tileset id as TSV"""
         uid = request.query_params.get("id")
-        tileset_resource = tileset_resources[uid]
-        info = tileset_resource.info()
-        assert "chromsizes" in info, "No chromsizes in tileset info"
-        return starlette.responses.PlainTextResponse(
-            "\n".join(f"{chrom}\t{size}" for chrom, size in info["chromsizes"])
+        tileset_resource = None if uid is None else tileset_resources.get(uid)
+        if tileset_resource is None:
+            return starlette.responses.JSONResponse(
+                {"error": f"No such tileset with uid: {uid}"}, 400
+            )
+        entry = await index.get(tileset_resource)
+        if entry.chromsizes is None:
+            return starlette.responses.JSONResponse(
+                {"error": "No chromsizes in tileset info"}, 400
+            )
+        return starlette.responses.PlainTextResponse(entry.chromsizes)
+
+    async def tilesets(request: starlette.requests.Request):
+        """List tilesets with their infos, paginated like higlass-server.
+
+        Query params: `limit` and `offset`, and `dt` to only list tilesets
+        of the given datatype(s).
+        """
+        try:
+            limit = int(request.query_params.get("limit", page_size))
+            limit = max(1, min(limit, page_size))
+            offset = max(int(request.query_params.get("offset", 0)), 0)
+        except ValueError:
+            return starlette.responses.JSONResponse(
+                {"error": "limit and offset must be integers"}, 400
+            )
+        datatypes = set(get_list(request.url.query, "dt"))
+        listed = [
+            tileset
+            for tileset in list(tileset_resources.values())
+            if not datatypes or tileset.datatype in datatypes
+        ]
+        index.prune(tileset_resources.keys())
+
+        page = listed[offset : offset + limit]
+        entries = await asyncio.gather(*map(index.get, page))
+        previous_url = next_url = None
+        if offset > 0:
+            previous_offset = max(offset - limit, 0)
+            previous_url = str(request.url.include_query_params(offset=previous_offset))
+        if offset + limit < len(listed):
+            next_url = str(request.url.include_query_params(offset=offset + limit))
+        meta = json.dumps(
+            {"count": len(listed), "next": next_url, "previous": previous_url}
+        ).encode()
+        results = b",".join(
+            entry.describe(tileset.uid) for tileset, entry in zip(page, entries)
         )
+        content = meta[:-1] + b',"results":[' + results + b"]}"
+        return starlette.responses.Response(content, media_type="application/json")
 
     return starlette.routing.Mount(
         path="/api/v1",
         routes=[
             starlette.routing.Route("/tileset_info/", endpoint=tileset_info),
             starlette.routing.Route("/tiles/", endpoint=tiles),
+            starlette.routing.Route(
+                "/tiles_bin/", endpoint=tiles_bin, methods=["POST"]
+            ),
             starlette.routing.Route("/chrom-sizes/", endpoint=chromsizes),
+            starlette.routing.Route("/tilesets/", endpoint=tilesets),
+            starlette.routing.WebSocketRoute("/tiles_ws/", endpoint=tiles_ws),
         ],
     )
 
 
+def server_url(port: int, proxy: bool = False) -> str:
+    if proxy:
+        return f"/proxy/{port}"
+
+    # https://github.com/yuvipanda/altair_data_server/blob/4d6ffcb19f864218c8d825ff2c95a1c8180585d0/altair_data_server/_altair_server.py#L73-L93
+    if "JUPYTERHUB_SERVICE_PREFIX" in os.environ:
+        urlprefix = os.environ["JUPYTERHUB_SERVICE_PREFIX"]
+        return f"{urlprefix}/proxy/{port}"
+
+    return f"http://localhost:{port}"
+
+
 class TilesetProvider(BackgroundServer):
     _tilesets: MutableMapping[str, LocalTileset]
+    cache: Optional[TileCache]
+    profiler: Profiler
     proxy: bool = False
 
-    def __init__(self, allowed_origins: Optional[List[str]] = None):
+    def __init__(
+        self,
+        allowed_origins: Optional[List[str]] = None,
+        cache: Optional[TileCache] = None,
+        max_workers: Optional[int] = None,
+    ):
         if allowed_origins is None:
             allowed_origins = ["*"]
         self._tilesets = weakref.WeakValueDictionary()
+        self.cache = TileCache() if cache is None else cache
+        if self.cache is not None:
+            memory.budget.register("tile cache", self.cache)
+        self.profiler = Profiler()
+        self.watcher = FileWatcher()
+        self._warm_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        # runs the sync tilesets, async ones run on the server's event loop
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="hg-tiles"
+        )
+        self.index = TilesetIndex(
+            lambda tileset: cached_info(tileset, self.cache),
+            self.executor,
+            lambda tileset: cached_info_async(tileset, self.cache, self.executor),
+        )
         app = starlette.applications.Starlette(
             routes=[
-                create_tileset_route(self._tilesets),
+                create_tileset_route(
+                    self._tilesets,
+                    self.cache,
+                    self.profiler,
+                    self.watcher,
+                    self.executor,
+                    self.index,
+                ),
             ]
         )
 
@@ -135,19 +597,71 @@ class TilesetProvider(BackgroundServer):
 
     @property
     def url(self) -> str:
+        return server_url(self.port, self.proxy)
+
+    def warm(self, tileset: LocalTileset, zooms: int = 2) -> concurrent.futures.Future:
+        """Compute the info and coarsest `zooms` zoom levels of `tileset` in
+        the background, ahead of the first request from the browser.
+
+        Returns a future with the number of tiles computed.
+        """
+        if self.cache is None:
+            raise ValueError("Cannot warm tilesets of a provider without a cache")
+        if self._warm_executor is None:
+            self._warm_executor = concurrent.futures.ThreadPoolExecutor(
+                1, thread_name_prefix="hg-warm"
+            )
+        return self._warm_executor.submit(warm_tileset, tileset, self.cache, zooms)
+
+    def _file_version(self, tileset: LocalTileset) -> Optional[str]:
+        # tiles of file backed tilesets are cached per version of the files
+        if tileset.source is None:
+            return None
+        return repr(self.watcher.fingerprint(tileset.uid))
 
-        if self.proxy:
-            return f"/proxy/{self.port}"
+    def invalidate(self, uid: str):
+        """Drop cached tiles and derived state of a tileset, e.g. after its
+        backing file changed."""
+        tileset = self._tilesets.get(uid)
+        if tileset is None:
+            self.watcher.unwatch(uid)
+            return
+        if tileset.invalidate is not None:
+            tileset.invalidate()
+        if self.cache is not None:
+            self.cache.invalidate(uid)
+            self.cache.set_version(uid, self._file_version(tileset))
+        self.index.discard(uid)
+        self.index.add(tileset)
 
-        # https://github.com/yuvipanda/altair_data_server/blob/4d6ffcb19f864218c8d825ff2c95a1c8180585d0/altair_data_server/_altair_server.py#L73-L93
-        if "JUPYTERHUB_SERVICE_PREFIX" in os.environ:
-            urlprefix = os.environ["JUPYTERHUB_SERVICE_PREFIX"]
-            return f"{urlprefix}/proxy/{self.port}"
+    def remove(self, uid: str):
+        """Stop serving a tileset."""
+        self._tilesets.pop(uid, None)
+        self.watcher.unwatch(uid)
+        self.index.discard(uid)
 
-        return f"http://localhost:{self.port}"
+    def create(
+        self, tileset: LocalTileset, version: Optional[str] = None
+    ) -> TilesetResource:
+        """Serve `tileset`.
 
-    def create(self, tileset: LocalTileset) -> TilesetResource:
+        Cached tiles are keyed by `version`, by default the fingerprint of
+        the tileset's `source` files.
+        """
         resource = TilesetResource(tileset, provider=self)
+        previous = self._tilesets.get(tileset.uid)
         self._tilesets[tileset.uid] = tileset
+        if tileset.source is not None:
+            self.watcher.watch(tileset.uid, tileset.source, self.invalidate)
+        if self.cache is not None:
+            if version is None and tileset.source is None and previous is not tileset:
+                # tilesets without files are never invalidated by the watcher,
+                # so don't serve tiles cached for an earlier tileset
+                self.cache.invalidate(tileset.uid)
+            self.cache.set_version(
+                tileset.uid, self._file_version(tileset) if version is None else version
+            )
+        # describe the tileset in the background
+        self.index.add(tileset)
         self.start()
         return resource
@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger("hg.server")
+
+Fingerprint = Tuple[int, int, int]
+
+
+def fingerprint(path: str) -> Optional[Fingerprint]:
+    """(size, mtime, inode) of a file, or of the newest entry of a directory.
+
+    Returns None if the path doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+        if os.path.isdir(path):
+            entries = [entry.stat() for entry in os.scandir(path)]
+            stat = max(entries, key=lambda s: s.st_mtime_ns, default=stat)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def _fingerprints(paths: Sequence[str]) -> Tuple[Optional[Fingerprint], ...]:
+    return tuple(fingerprint(path) for path in paths)
+
+
+def etag(*parts: object) -> str:
+    return '"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+class FileWatcher:
+    """Polls files every `interval` seconds and calls back when they change.
+
+    A file has changed when its fingerprint differs from the previous poll,
+    including files being replaced (new inode) or removed. A key may watch
+    several files, e.g. the inputs of a derived tileset, and is called back
+    when any of them changes.
+    """
+
+    def __init__(self, interval: float = 2.0):
+        self.interval = interval
+        self._lock = threading.Lock()
+        # key -> (paths, last fingerprints, callback)
+        self._watched: Dict[
+            str,
+            Tuple[
+                Tuple[str, ...],
+                Tuple[Optional[Fingerprint], ...],
+                Callable[[str], None],
+            ],
+        ] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def fingerprint(self, key: str) -> Optional[Tuple[Fingerprint, ...]]:
+        """Fingerprints of the files of `key`, None if any doesn't exist."""
+        with self._lock:
+            entry = self._watched.get(key)
+        if entry is None or None in entry[1]:
+            return None
+        return entry[1]  # type: ignore
+
+    def watch(
+        self,
+        key: str,
+        paths: Union[str, Sequence[str]],
+        callback: Callable[[str], None],
+    ):
+        paths = (paths,) if isinstance(paths, str) else tuple(paths)
+        with self._lock:
+            self._watched[key] = (paths, _fingerprints(paths), callback)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="hg-watch", daemon=True
+                )
+                self._thread.start()
+
+    def unwatch(self, key: str):
+        with self._lock:
+            self._watched.pop(key, None)
+
+    def poll(self):
+        with self._lock:
+            watched = list(self._watched.items())
+        for key, (paths, previous, callback) in watched:
+            current = _fingerprints(paths)
+            if current == previous:
+                continue
+            with self._lock:
+                if key in self._watched:
+                    self._watched[key] = (paths, current, callback)
+            changed = [p for p, a, b in zip(paths, previous, current) if a != b]
+            logger.info("%s changed, invalidating tileset %s", changed, key)
+            try:
+                callback(key)
+            except Exception:
+                logger.exception("Failed to invalidate tileset %s", key)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def stop(self):
+        self._stop.set()
@@ -1,28 +1,109 @@
+import asyncio
+import concurrent.futures
 import functools
 import hashlib
+import inspect
+import json
 import pathlib
+import threading
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List, Optional, Sequence
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from typing_extensions import Literal
 
+import hg._memory as memory
+
+from ._httpfile import BlockCache, HttpFile, is_url
+from ._upstream import UpstreamClient
 from .api import track
 from .utils import TrackType
 
 TileId = str
 Tile = Dict[str, Any]
 TilesetInfo = Dict[str, Any]
+# (tile id, tile) pairs, as returned by the tile functions of clodius
+Tiles = List[Tuple[TileId, Tile]]
+
+DataType = Literal["vector", "multivec", "matrix", "scatter-point"]
+FloatType = Literal["float16", "float32"]
+
+T = TypeVar("T")
+MaybeAwaitable = Union[T, Awaitable[T]]
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
 
-DataType = Literal["vector", "multivec", "matrix"]
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """An event loop running in a daemon thread, shared by `run_sync` calls."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="hg-run-sync", daemon=True
+            ).start()
+        return _loop
+
+
+def run_sync(fn: Callable[..., MaybeAwaitable[T]], *args: Any) -> T:
+    """Call a sync or async tileset function from synchronous code.
+
+    Coroutines are run to completion on a background event loop, so this
+    also works from a thread with a running loop (e.g. in Jupyter), and
+    tilesets see the same loop across calls.
+    """
+    result = fn(*args)
+    if not inspect.isawaitable(result):
+        return result  # type: ignore
+    loop = _background_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("run_sync cannot wait for the loop it runs on")
+    return asyncio.run_coroutine_threadsafe(_await(result), loop).result()
+
+
+async def _await(awaitable: Awaitable[T]) -> T:
+    return await awaitable
 
 
 @dataclass
 class LocalTileset:
-    tiles: Callable[[Sequence[TileId]], List[Tile]]
-    info: Callable[[], TilesetInfo]
+    """A tileset served by `hg.server`.
+
+    `tiles`, `info` and `raw_tiles` may be coroutine functions, e.g. for
+    tilesets backed by remote or database reads. The server awaits these on
+    its event loop and runs synchronous ones on a thread pool.
+    """
+
+    tiles: Callable[[Sequence[TileId]], MaybeAwaitable[Tiles]]
+    info: Callable[[], MaybeAwaitable[TilesetInfo]]
     uid: str
     datatype: Optional[DataType] = None
     name: Optional[str] = None
+    # tiles with "dense" as arrays rather than base64, for binary responses
+    raw_tiles: Optional[Callable[[Sequence[TileId]], MaybeAwaitable[Tiles]]] = None
+    # local file(s) backing the tileset, watched for changes by the server
+    source: Union[None, str, List[str]] = None
+    # drop state derived from `source` (open handles, caches) after it changed
+    invalidate: Optional[Callable[[], None]] = None
+    # how to recreate the tileset in another process, see `hg.server.use_daemon`
+    recipe: Optional[Dict[str, Any]] = None
 
 
 @dataclass
@@ -31,7 +112,12 @@ class RemoteTileset:
     server: str
     name: Optional[str] = None
 
-    def track(self, type_: TrackType, **kwargs):
+    def track(self, type_: TrackType, proxy: bool = False, **kwargs):
+        if proxy:
+            from hg.server import server
+
+            return server.add(self.proxy()).track(type_, **kwargs)
+
         t = track(
             type_=type_,
             server=self.server,
@@ -42,23 +128,134 @@ class RemoteTileset:
             t.opts(name=self.name, inplace=True)
         return t
 
+    def proxy(self, **kwargs) -> LocalTileset:
+        """Serve this tileset through the local server, caching fetched tiles.
+
+        Keyword arguments are forwarded to `UpstreamClient`.
+        """
+        client = UpstreamClient(self.server, **kwargs)
+        return LocalTileset(
+            tiles=client.tiles,
+            info=functools.partial(client.info, self.uid),
+            uid=self.uid,
+            name=self.name,
+        )
+
 
 def remote(uid: str, server: str = "https://higlass.io/api/v1", **kwargs):
     return RemoteTileset(uid, server, **kwargs)
 
 
-def hash_absolute_filepath_as_default_uid(fn: Callable[[str, str], LocalTileset]):
-    def wrapper(filepath: str, uid: Optional[str] = None):
+FileLike = Union[str, HttpFile]
+
+_file_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_file_executor_lock = threading.Lock()
+
+
+def file_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Thread pool reading the files of tilesets backed by many files."""
+    global _file_executor
+    with _file_executor_lock:
+        if _file_executor is None:
+            _file_executor = concurrent.futures.ThreadPoolExecutor(
+                8, thread_name_prefix="hg-files"
+            )
+        return _file_executor
+
+
+def _filepath_key(filepath: FileLike) -> str:
+    if isinstance(filepath, HttpFile):
+        return filepath.url
+    if is_url(filepath):
+        return filepath
+    return str(pathlib.Path(filepath).absolute())
+
+
+# tileset functions which can be called from a recipe, by name
+FACTORIES: Dict[str, Callable[..., LocalTileset]] = {}
+
+
+def hash_absolute_filepath_as_default_uid(
+    fn: Optional[Callable[..., LocalTileset]] = None,
+    *,
+    uid_options: Sequence[str] = (),
+):
+    """Default the uid of a file backed tileset to a hash of its path.
+
+    `uid_options` are keyword arguments which change the tiles. If any is
+    set, it is hashed into the default uid as well, so that tilesets of the
+    same file with different options can be on the same server.
+    """
+    if fn is None:
+        return functools.partial(
+            hash_absolute_filepath_as_default_uid, uid_options=uid_options
+        )
+
+    def wrapper(filepath: FileLike, uid: Optional[str] = None, **kwargs):
+        key = _filepath_key(filepath)
         if uid is None:
-            abspath = pathlib.Path(filepath).absolute()
-            uid = hashlib.md5(str(abspath).encode()).hexdigest()
-        return fn(filepath, uid)
+            uid = hashlib.md5(key.encode()).hexdigest()
+            options = [kwargs.get(name) for name in uid_options]
+            if any(option is not None and option is not False for option in options):
+                encoded = json.dumps(options, default=repr)
+                uid = hashlib.md5(f"{uid}:{encoded}".encode()).hexdigest()
+        tileset = fn(filepath, uid, **kwargs)
+        if tileset.source is None and not is_url(key):
+            tileset.source = key
+        tileset.recipe = {
+            "factory": fn.__name__,
+            "filepath": key,
+            "uid": uid,
+            "kwargs": kwargs,
+        }
+        return tileset
 
+    FACTORIES[fn.__name__] = wrapper
     return wrapper
 
 
+def from_recipe(recipe: Dict[str, Any]) -> LocalTileset:
+    """Recreate a tileset from its `LocalTileset.recipe`."""
+    factory = FACTORIES.get(recipe["factory"])
+    if factory is None:
+        raise ValueError(f"Unknown tileset function: {recipe['factory']}")
+    return factory(recipe["filepath"], recipe["uid"], **recipe["kwargs"])
+
+
+def open_remote(
+    filepath: FileLike,
+    block_size: Optional[int] = None,
+    block_cache_dir: Optional[str] = None,
+) -> Union[str, HttpFile]:
+    """Open http(s) urls as a file-like object backed by range requests.
+
+    Parameters
+    ----------
+    block_size : int, optional
+        Size (bytes) of the blocks fetched with range requests.
+    block_cache_dir : str, optional
+        Directory in which fetched blocks are kept across sessions. By
+        default blocks are only cached in memory.
+    """
+    if not is_url(filepath):
+        return filepath
+    kwargs: Dict[str, Any] = {"cache": BlockCache(cache_dir=block_cache_dir)}
+    if block_size is not None:
+        kwargs["block_size"] = block_size
+    return HttpFile(filepath, **kwargs)  # type: ignore
+
+
+def ensure_local(filepath: FileLike) -> str:
+    if not isinstance(filepath, str) or is_url(filepath):
+        raise ValueError(
+            f"Remote files are not supported for this tileset: {filepath}. "
+            "Use `hg.fuse.path` to mount the file instead."
+        )
+    return filepath
+
+
 @hash_absolute_filepath_as_default_uid
-def bigwig(filepath: str, uid: str):
+def bigwig(filepath: FileLike, uid: str):
     try:
         from clodius.tiles.bigwig import tiles, tileset_info
     except ImportError:
@@ -66,6 +263,10 @@ def bigwig(filepath: str, uid: str):
             'You must have `clodius` installed to use "vector" data-server.'
         )
 
+    # pybbi reads remote files natively
+    if isinstance(filepath, HttpFile):
+        filepath = filepath.url
+
     return LocalTileset(
         datatype="vector",
         tiles=functools.partial(tiles, filepath),
@@ -74,8 +275,32 @@ def bigwig(filepath: str, uid: str):
     )
 
 
-@hash_absolute_filepath_as_default_uid
-def multivec(filepath: str, uid: str):
+@hash_absolute_filepath_as_default_uid(uid_options=("rows", "dtype", "quantize"))
+def multivec(
+    filepath: FileLike,
+    uid: str,
+    rows: Optional[Sequence[int]] = None,
+    dtype: Optional[FloatType] = None,
+    quantize: bool = False,
+    block_size: Optional[int] = None,
+    block_cache_dir: Optional[str] = None,
+):
+    """A multivec tileset.
+
+    Parameters
+    ----------
+    rows : sequence of int, optional
+        Rows to serve, in order. Other rows are dropped from the tiles
+        before they are sent to the client.
+    dtype : {"float16", "float32"}, optional
+        Encode tiles with this dtype. By default float16 is used if the
+        values of a tile fit.
+    quantize : bool
+        Encode tiles as uint8 scaled between the tile's min and max value.
+        Not supported by the HiGlass client.
+    block_size, block_cache_dir
+        Options of http(s) urls, see `open_remote`.
+    """
     try:
         from clodius.tiles.multivec import tiles, tileset_info
     except ImportError:
@@ -83,16 +308,325 @@ def multivec(filepath: str, uid: str):
             'You must have `clodius` installed to use "multivec" data-server.'
         )
 
+    filepath = open_remote(filepath, block_size, block_cache_dir)
+
+    if rows is None and dtype is None and not quantize:
+        return LocalTileset(
+            datatype="multivec",
+            tiles=functools.partial(tiles, filepath),
+            info=functools.partial(tileset_info, filepath),
+            uid=uid,
+        )
+
+    def info():
+        info = tileset_info(filepath)
+        if rows is not None:
+            info["shape"] = [info["shape"][0], len(rows)]
+            if "row_infos" in info:
+                info["row_infos"] = [info["row_infos"][i] for i in rows]
+        return info
+
+    def subset_tiles(tile_ids: Sequence[TileId]) -> Tiles:
+        from ._tiles import select_rows
+
+        return [
+            (tid, select_rows(tile, rows, dtype, quantize))
+            for tid, tile in tiles(filepath, tile_ids)
+        ]
+
     return LocalTileset(
         datatype="multivec",
-        tiles=functools.partial(tiles, filepath),
-        info=functools.partial(tileset_info, filepath),
+        tiles=subset_tiles,
+        info=info,
+        uid=uid,
+    )
+
+
+def bigwig_stack(
+    filepaths: Sequence[FileLike],
+    uid: Optional[str] = None,
+    names: Optional[Sequence[str]] = None,
+    name: Optional[str] = None,
+    executor: Optional[concurrent.futures.Executor] = None,
+):
+    """A multivec tileset with one row per bigwig file.
+
+    Tiles of all files are read in parallel on `executor` (by default a
+    thread pool shared by all tilesets) and stacked, so a single multivec
+    track replaces a track (and a tileset) per file.
+    """
+    try:
+        from clodius.tiles.bigwig import tiles, tileset_info
+    except ImportError:
+        raise ImportError(
+            'You must have `clodius` installed to use "multivec" data-server.'
+        )
+
+    if len(filepaths) == 0:
+        raise ValueError("bigwig_stack requires at least one file")
+    if names is not None and len(names) != len(filepaths):
+        raise ValueError("Must provide a name for each file")
+
+    keys = [_filepath_key(fp) for fp in filepaths]
+    if uid is None:
+        uid = hashlib.md5("\n".join(keys).encode()).hexdigest()
+    # pybbi reads remote files natively
+    paths = [fp.url if isinstance(fp, HttpFile) else fp for fp in filepaths]
+
+    pool = file_executor() if executor is None else executor
+    infos: List[TilesetInfo] = []
+
+    def read_infos():
+        new_infos = list(pool.map(tileset_info, paths))
+        for key in ("max_width", "max_zoom", "tile_size"):
+            values = {info.get(key) for info in new_infos}
+            if len(values) != 1:
+                raise ValueError(f"bigwig files differ in `{key}`: {values}")
+        infos[:] = new_infos
+
+    read_infos()
+
+    def info():
+        info = dict(infos[0])
+        info["shape"] = [info["tile_size"], len(paths)]
+        info["row_infos"] = list(names) if names is not None else keys
+        return info
+
+    def stacked_tiles(tile_ids: Sequence[TileId]) -> Tiles:
+        import numpy as np
+
+        from ._tiles import decode_dense_tile, format_dense_tile
+
+        # the position in the tileset is the same for every file
+        suffixes = [tid.split(".", 1)[1] for tid in tile_ids]
+        per_file = pool.map(
+            lambda path: [t for _, t in tiles(path, [f"x.{s}" for s in suffixes])],
+            paths,
+        )
+
+        tile_size = infos[0]["tile_size"]
+        data = np.full((len(tile_ids), len(paths), tile_size), np.nan, np.float32)
+        for row, file_tiles in enumerate(per_file):
+            for i, tile in enumerate(file_tiles):
+                if "dense" in tile:
+                    data[i, row] = decode_dense_tile(tile)[:tile_size]
+
+        result = []
+        for tid, dense in zip(tile_ids, data):
+            tile = format_dense_tile(dense)
+            tile["shape"] = list(dense.shape)
+            result.append((tid, tile))
+        return result
+
+    return LocalTileset(
+        datatype="multivec",
+        tiles=stacked_tiles,
+        info=info,
         uid=uid,
+        name=name,
+        source=[key for key in keys if not is_url(key)] or None,
+        invalidate=read_infos,
+    )
+
+
+def _array_uid(data, options: str, source: Any = None) -> str:
+    """A default uid for an array, without reading all of its values.
+
+    Dask arrays are identified by their graph name, others by the file
+    they were opened from or else by `id`. A sample of the values tells
+    apart arrays whose id was reused after garbage collection.
+    """
+    import numpy as np
+
+    md5 = hashlib.md5(f"{data.shape}:{data.dtype}:{options}".encode())
+    token = getattr(data, "name", None)
+    if type(data).__module__.startswith("dask.") and isinstance(token, str):
+        md5.update(token.encode())
+        return md5.hexdigest()
+
+    key = source if isinstance(source, str) else f"{id(data)}"
+    md5.update(key.encode())
+    sample = data
+    for axis, size in enumerate(data.shape):
+        positions = np.unique(np.linspace(0, size - 1, min(size, 64)).astype(int))
+        sample = sample[(slice(None),) * axis + (positions,)]
+    md5.update(np.ascontiguousarray(np.asarray(sample)).tobytes())
+    return md5.hexdigest()
+
+
+def xarray(
+    data,
+    uid: Optional[str] = None,
+    datatype: Optional[DataType] = None,
+    resolution: int = 1,
+    agg: Literal["mean", "sum"] = "mean",
+    scheduler: Optional[str] = None,
+    chromsizes: Optional[Sequence[Tuple[str, int]]] = None,
+    name: Optional[str] = None,
+):
+    """A tileset for a (lazy) xarray.DataArray, Dask or NumPy array.
+
+    1D arrays are served as "vector" data, 2D arrays as a "matrix" if square
+    or as "multivec" (rows, positions) otherwise. Each element covers
+    `resolution` bp. Coarser zoom levels aggregate blocks of 2**k elements
+    with `agg`. Dask arrays are never loaded fully: only the chunks a tile
+    touches are computed, using `scheduler` (see `dask.compute`).
+    """
+    from ._xarray import ArrayTiles
+
+    row_infos = None
+    source = None
+    if hasattr(data, "dims") and hasattr(data, "coords"):
+        # xarray.DataArray
+        if data.ndim == 2 and data.dims[0] in data.coords:
+            row_infos = [str(v) for v in data.coords[data.dims[0]].values]
+        name = name or data.name
+        # the file the array was opened from, if any
+        source = data.encoding.get("source")
+        if data.chunks is not None or getattr(data.variable, "_in_memory", False):
+            # the Dask or NumPy array, without loading or copying it
+            data = data.data
+        # otherwise keep the DataArray, tiles only read their slice of the file
+
+    if datatype is None:
+        if data.ndim == 1:
+            datatype = "vector"
+        elif data.ndim == 2:
+            datatype = "matrix" if data.shape[0] == data.shape[1] else "multivec"
+        else:
+            raise ValueError(f"Expected a 1D or 2D array, got {data.ndim} dims")
+
+    if uid is None:
+        uid = _array_uid(data, f"{datatype}:{resolution}:{agg}", source)
+
+    tiles = ArrayTiles(
+        data,
+        datatype=datatype,
+        resolution=resolution,
+        agg=agg,
+        scheduler=scheduler,
+        chromsizes=chromsizes,
+        row_infos=row_infos,
+    )
+    memory.budget.register(f"xarray {uid}", tiles)
+    return LocalTileset(
+        datatype=datatype,
+        tiles=tiles.tiles,
+        info=tiles.tileset_info,
+        uid=uid,
+        name=name,
+        source=source if isinstance(source, str) and not is_url(source) else None,
+    )
+
+
+def points(
+    x,
+    y,
+    data=None,
+    columns: Sequence[str] = (),
+    uid: Optional[str] = None,
+    max_points: int = 1000,
+    max_zoom: Optional[int] = None,
+    seed: int = 0,
+    name: Optional[str] = None,
+):
+    """A 2D point tileset, e.g. for cell embeddings or contact pairs.
+
+    `x` and `y` are NumPy (or Arrow, pandas) arrays, or column names of
+    `data` (a DataFrame, Arrow table or mapping of arrays), and `columns`
+    names further columns of `data` to include with each point. Tiles of the
+    quadtree hold at most `max_points` points, a random sample of the
+    points in dense tiles which is consistent across zoom levels.
+    """
+    import numpy as np
+
+    from ._points import PointTiles
+
+    if isinstance(x, str):
+        x = data[x]
+    if isinstance(y, str):
+        y = data[y]
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    values = {column: np.asarray(data[column]) for column in columns}
+
+    if uid is None:
+        md5 = hashlib.md5(f"{list(columns)}:{max_points}:{max_zoom}:{seed}".encode())
+        for array in (x, y, *values.values()):
+            if array.dtype == object:
+                # the bytes of object arrays are pointers
+                md5.update(repr(array.tolist()).encode())
+            else:
+                md5.update(f"{array.dtype}".encode())
+                md5.update(np.ascontiguousarray(array).tobytes())
+        uid = md5.hexdigest()
+
+    tiles = PointTiles(
+        x,
+        y,
+        columns=values,
+        max_points=max_points,
+        max_zoom=max_zoom,
+        seed=seed,
+    )
+    memory.budget.register(f"points {uid}", tiles)
+    return LocalTileset(
+        datatype="scatter-point",
+        tiles=tiles.tiles,
+        info=tiles.tileset_info,
+        uid=uid,
+        name=name,
     )
 
 
 @hash_absolute_filepath_as_default_uid
-def cooler(filepath: str, uid: str):
+def cooler(
+    filepath: FileLike,
+    uid: str,
+    coarsen: Optional[bool] = None,
+    cache_dir: Optional[str] = None,
+    block_size: Optional[int] = None,
+    block_cache_dir: Optional[str] = None,
+):
+    """A matrix tileset for a .mcool (or single-resolution .cool) file.
+
+    With `coarsen=True`, zoom levels of a single-resolution .cool file are
+    computed on demand rather than read from a zoomified .mcool. By default
+    this is detected from the file. These tilesets also serve ICE balanced
+    ("weight") and observed/expected ("oe") transforms, whose weights and
+    expected vectors are computed once and saved in `cache_dir`. Zoomified
+    .mcool files are served by clodius, balanced with the weights stored in
+    the file and without the "oe" transform.
+    `block_size` and `block_cache_dir` are options of http(s) urls, see
+    `open_remote`.
+    """
+    from ._coarsen import (
+        CoarsenedCooler,
+        check_mcool_transforms,
+        is_single_resolution,
+    )
+
+    filepath = open_remote(filepath, block_size, block_cache_dir)
+
+    if coarsen is None:
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('You must have `h5py` installed to use "matrix" data.')
+
+        with h5py.File(filepath, "r") as f:
+            coarsen = is_single_resolution(f)
+
+    if coarsen:
+        coarsened = CoarsenedCooler(filepath, cache_dir=cache_dir)
+        memory.budget.register(f"cooler {uid}", coarsened)
+        return LocalTileset(
+            datatype="matrix",
+            tiles=coarsened.tiles,
+            info=coarsened.tileset_info,
+            uid=uid,
+            invalidate=coarsened.reload,
+        )
+
     try:
         from clodius.tiles.cooler import tiles, tileset_info
     except ImportError:
@@ -100,16 +634,60 @@ def cooler(filepath: str, uid: str):
             'You must have `clodius` installed to use "matrix" data-server.'
         )
 
+    def mcool_tiles(tile_ids: Sequence[TileId]) -> Tiles:
+        check_mcool_transforms(filepath, tile_ids)
+        return tiles(filepath, tile_ids)
+
     return LocalTileset(
         datatype="matrix",
-        tiles=functools.partial(tiles, filepath),
+        tiles=mcool_tiles,
         info=functools.partial(tileset_info, filepath),
         uid=uid,
     )
 
 
 @hash_absolute_filepath_as_default_uid
-def hitile(filepath: str, uid: str):
+def pyramid(filepath: FileLike, uid: str):
+    """A tileset for a memory-mapped pyramid written by `to_pyramid`."""
+    from ._pyramid import Pyramid
+
+    data = Pyramid(ensure_local(filepath))
+    return LocalTileset(
+        datatype=data.datatype,  # type: ignore
+        tiles=data.tiles,
+        info=data.tileset_info,
+        uid=uid,
+        raw_tiles=data.raw_tiles,
+        invalidate=data.reload,
+    )
+
+
+def to_pyramid(
+    tileset: LocalTileset, path: Union[str, pathlib.Path], **kwargs
+) -> pathlib.Path:
+    """Precompute the dense tiles of a bigwig, cooler or multivec tileset
+    into a pyramid directory, which `pyramid` serves without clodius.
+
+    Keyword arguments are forwarded to `hg._pyramid.write_pyramid`.
+    """
+    from ._pyramid import write_pyramid
+
+    # accept `TilesetResource`s returned by `hg.cooler`, `hg.bigwig`, etc.
+    return write_pyramid(getattr(tileset, "tileset", tileset), path, **kwargs)
+
+
+@hash_absolute_filepath_as_default_uid
+def hitile(
+    filepath: FileLike,
+    uid: str,
+    block_size: Optional[int] = None,
+    block_cache_dir: Optional[str] = None,
+):
+    """A vector tileset for a .hitile file.
+
+    `block_size` and `block_cache_dir` are options of http(s) urls, see
+    `open_remote`.
+    """
     try:
         from clodius.tiles.hitile import tiles, tileset_info
     except ImportError:
@@ -117,6 +695,8 @@ def hitile(filepath: str, uid: str):
             'You must have `clodius` installed to use "vector" data-server.'
         )
 
+    filepath = open_remote(filepath, block_size, block_cache_dir)
+
     return LocalTileset(
         datatype="vector",
         tiles=functools.partial(tiles, filepath),
@@ -126,7 +706,7 @@ def hitile(filepath: str, uid: str):
 
 
 @hash_absolute_filepath_as_default_uid
-def bed2ddb(filepath: str, uid: str):
+def bed2ddb(filepath: FileLike, uid: str):
     try:
         from clodius.tiles.bed2ddb import tiles, tileset_info
     except ImportError:
@@ -134,9 +714,141 @@ def bed2ddb(filepath: str, uid: str):
             'You must have `clodius` installed to use "vector" data-server.'
         )
 
+    # sqlite needs a local file
+    filepath = ensure_local(filepath)
+
     return LocalTileset(
         datatype="2d-rectangle-domains",
         tiles=functools.partial(tiles, filepath),
         info=functools.partial(tileset_info, filepath),
         uid=uid,
     )
+
+
+ArithmeticOp = Literal["sum", "difference", "ratio", "log2ratio"]
+
+_ALIGNED_INFO_KEYS = (
+    "min_pos",
+    "max_pos",
+    "max_width",
+    "max_zoom",
+    "tile_size",
+    "resolutions",
+    "bins_per_dimension",
+    "shape",
+)
+
+
+def _combine_dense(op: ArithmeticOp, arrays: List[Any], pseudocount: float):
+    import numpy as np
+
+    arrays = [a.astype(np.float64) for a in arrays]
+    if op == "sum":
+        return np.sum(arrays, axis=0)
+    if op == "difference":
+        return arrays[0] - np.sum(arrays[1:], axis=0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = (arrays[0] + pseudocount) / (np.prod(arrays[1:], axis=0) + pseudocount)
+        if op == "log2ratio":
+            ratio = np.log2(ratio)
+        # division by zero and log2 of zero are missing values, not inf
+        ratio[~np.isfinite(ratio)] = np.nan
+        return ratio
+
+
+def arithmetic(
+    *tilesets: LocalTileset,
+    op: ArithmeticOp = "ratio",
+    pseudocount: float = 0,
+    uid: Optional[str] = None,
+    name: Optional[str] = None,
+):
+    """Combine dense tiles of two or more aligned tilesets on the server.
+
+    Unlike `hg.divide`, which makes the browser fetch and divide both
+    tilesets, only the combined tiles are sent to the client. For ratio
+    and log2ratio, the first tileset is divided by (the product of) the
+    others.
+    """
+    # accept `TilesetResource`s returned by `hg.cooler`, `hg.bigwig`, etc.
+    tilesets = tuple(getattr(ts, "tileset", ts) for ts in tilesets)
+    if len(tilesets) < 2:
+        raise ValueError("arithmetic requires at least two tilesets")
+    if op not in ("sum", "difference", "ratio", "log2ratio"):
+        raise ValueError(f"Unknown arithmetic operation: {op}")
+
+    datatypes = {ts.datatype for ts in tilesets}
+    if len(datatypes) != 1:
+        raise ValueError(f"Cannot combine tilesets of different datatypes {datatypes}")
+
+    infos: List[TilesetInfo] = []
+
+    def read_infos():
+        new_infos = [run_sync(ts.info) for ts in tilesets]
+        for key in _ALIGNED_INFO_KEYS:
+            values = [info.get(key) for info in new_infos]
+            if any(v != values[0] for v in values[1:]):
+                raise ValueError(f"Tilesets are not aligned, `{key}` differs: {values}")
+        infos[:] = new_infos
+
+    def invalidate():
+        for ts in tilesets:
+            if ts.invalidate is not None:
+                ts.invalidate()
+        read_infos()
+
+    read_infos()
+
+    if uid is None:
+        key = f"{op}:{pseudocount}:" + ",".join(ts.uid for ts in tilesets)
+        uid = hashlib.md5(key.encode()).hexdigest()
+
+    def info():
+        return infos[0]
+
+    def tiles(tile_ids: Sequence[TileId]) -> Tiles:
+        import numpy as np
+
+        from ._tiles import decode_dense_tile, format_dense_tile
+
+        suffixes = [tid.split(".", 1)[1] for tid in tile_ids]
+        children: List[Dict[TileId, Tile]] = [
+            dict(run_sync(ts.tiles, [f"{ts.uid}.{suffix}" for suffix in suffixes]))
+            for ts in tilesets
+        ]
+
+        result: Tiles = []
+        for tid, suffix in zip(tile_ids, suffixes):
+            parts = [
+                child[f"{ts.uid}.{suffix}"] for ts, child in zip(tilesets, children)
+            ]
+            if any("dense" not in part for part in parts):
+                result.append((tid, {"error": "Only dense tiles can be combined"}))
+                continue
+            arrays = [decode_dense_tile(part) for part in parts]
+            if len({a.size for a in arrays}) != 1:
+                result.append((tid, {"error": "Tiles have different shapes"}))
+                continue
+            tile = format_dense_tile(
+                np.asarray(_combine_dense(op, arrays, pseudocount))
+            )
+            if "shape" in parts[0]:
+                tile["shape"] = parts[0]["shape"]
+            result.append((tid, tile))
+        return result
+
+    sources = [
+        path
+        for ts in tilesets
+        for path in ([ts.source] if isinstance(ts.source, str) else ts.source or [])
+    ]
+    return LocalTileset(
+        tiles=tiles,
+        info=info,
+        uid=uid,
+        datatype=tilesets[0].datatype,
+        name=name,
+        source=list(dict.fromkeys(sources)) or None,
+        invalidate=invalidate,
+    )
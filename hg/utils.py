@@ -1,8 +1,15 @@
-from typing import Dict, List, Optional, TypeVar, Union
+from typing import Any, Dict, List, Optional, Type, TypeVar, Union
 import uuid
 
 import higlass_schema as hgs
-from pydantic import BaseModel
+from pydantic import BaseModel, Extra
+from pydantic.fields import (
+    SHAPE_DICT,
+    SHAPE_LIST,
+    SHAPE_MAPPING,
+    SHAPE_SINGLETON,
+    ModelField,
+)
 from typing_extensions import Literal
 
 
@@ -46,6 +53,8 @@ _datatype_default_track = {
     "matrix": "heatmap",
     "vector": "horizontal-bar",
     "multivec": "horizontal-multivec",
+    # `hg.points`, not a track type of higlass-schema
+    "scatter-point": "scatter-point",
 }
 
 
@@ -69,3 +78,74 @@ def copy_unique(model: ModelT) -> ModelT:
     if hasattr(copy, "uid"):
         setattr(copy, "uid", uid())
     return copy
+
+
+def _is_model(type_: Any) -> bool:
+    return isinstance(type_, type) and issubclass(type_, BaseModel)
+
+
+def _matches(model_cls: Type[BaseModel], data: Dict[str, Any]) -> bool:
+    """Cheap union discrimination using only `type` and `None`-typed fields."""
+    for name, field in model_cls.__fields__.items():
+        if field.alias not in data:
+            continue
+        if name == "type" or field.type_ is type(None):
+            _, errors = field.validate(data[field.alias], {}, loc=name)
+            if errors:
+                return False
+    return True
+
+
+def _construct_value(field: ModelField, value: Any) -> Any:
+    if value is None:
+        return value
+
+    if field.shape == SHAPE_SINGLETON:
+        if _is_model(field.type_) and isinstance(value, dict):
+            return construct(field.type_, value)
+        if field.sub_fields and isinstance(value, dict):
+            # Union of models, pick the first plausible member like pydantic
+            for sub_field in field.sub_fields:
+                if _is_model(sub_field.type_) and _matches(sub_field.type_, value):
+                    return construct(sub_field.type_, value)
+        return value
+
+    if field.shape == SHAPE_LIST and field.sub_fields and isinstance(value, list):
+        return [_construct_value(field.sub_fields[0], v) for v in value]
+
+    if field.shape in (SHAPE_DICT, SHAPE_MAPPING) and isinstance(value, dict):
+        assert field.sub_fields is not None
+        return {k: _construct_value(field.sub_fields[0], v) for k, v in value.items()}
+
+    return value
+
+
+def construct(model_cls: Type[ModelT], data: Dict[str, Any]) -> ModelT:
+    """Recursively creates a pydantic BaseModel from trusted data without validation.
+
+    Nested models are constructed rather than left as dicts, so the result
+    can be traversed and serialized like a validated model. Nothing is
+    validated on access, use `validate` to check the (sub)tree on demand.
+    """
+    values: Dict[str, Any] = {}
+    for name, field in model_cls.__fields__.items():
+        if field.alias in data:
+            values[name] = _construct_value(field, data[field.alias])
+
+    # keep unknown keys unless the model would drop them during validation
+    if model_cls.__config__.extra != Extra.ignore:
+        aliases = {field.alias for field in model_cls.__fields__.values()}
+        values.update({k: v for k, v in data.items() if k not in aliases})
+
+    return model_cls.construct(**values)
+
+
+def validate(model: ModelT) -> ModelT:
+    """Validates a (possibly unvalidated) model tree in place.
+
+    Raises a `pydantic.ValidationError` if the model is invalid.
+    """
+    validated = model.__class__.parse_obj(model.dict())
+    object.__setattr__(model, "__dict__", validated.__dict__)
+    object.__setattr__(model, "__fields_set__", validated.__fields_set__)
+    return model
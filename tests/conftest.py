@@ -0,0 +1,62 @@
+import http.server
+import pathlib
+import re
+import threading
+from typing import Any
+
+import pytest
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves files with support for single byte ranges, recording requests.
+
+    Paths in `server.errors` are answered with their status code and no body.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        self.server.requests.append((self.command, self.path, self.headers["Range"]))
+        if self.path in self.server.errors:
+            self.send_response(self.server.errors[self.path])
+            self.send_header("Connection", "close")
+            self.end_headers()
+            return None
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        path = pathlib.Path(self.translate_path(self.path))
+        if match is None or not path.is_file():
+            return super().send_head()
+        data = path.read_bytes()
+        start = int(match[1])
+        end = min(int(match[2] or len(data) - 1), len(data) - 1)
+        if start >= len(data):
+            self.send_error(416)
+            return None
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(data[start : end + 1])
+        return None
+
+
+@pytest.fixture
+def range_server(tmp_path):
+    """An HTTP server of `server.directory` at `server.url`."""
+    directory = tmp_path / "www"
+    directory.mkdir()
+
+    def handler(*args, **kwargs):
+        return RangeRequestHandler(*args, directory=str(directory), **kwargs)
+
+    server: Any = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    server.directory = directory
+    server.requests = []
+    server.errors = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,62 @@
+import json
+
+import pydantic
+import pytest
+
+import hg
+from hg import utils
+
+
+def viewconf_dict():
+    return json.loads(
+        hg.view(
+            hg.track("top-axis"),
+            hg.track("heatmap", server="http://localhost", tilesetUid="t"),
+            uid="a",
+        )
+        .viewconf()
+        .json()
+    )
+
+
+def test_unvalidated_parse_matches_parse_obj():
+    data = viewconf_dict()
+    expected = hg.Viewconf.parse_obj(data)
+
+    conf = hg.Viewconf.parse_obj(data, validate=False)
+    # values are kept as given, validation would coerce e.g. ints to floats
+    assert json.loads(conf.json()) == data
+    # nested models are constructed, not left as dicts
+    assert isinstance(conf.views[0].layout, pydantic.BaseModel)
+
+    assert conf.validated() is conf
+    assert conf == expected
+    assert hg.Viewconf.parse_raw(json.dumps(data), validate=False).validated() == (
+        expected
+    )
+
+
+def test_construct_then_validate_subtree():
+    data = viewconf_dict()["views"][0]
+    view = utils.construct(hg.api.View, data)
+    assert utils.validate(view) == hg.api.View.parse_obj(data)
+
+
+@pytest.mark.parametrize(
+    "update",
+    [
+        lambda d: d["views"][0]["layout"].update(w="wide"),
+        lambda d: d["views"][0]["tracks"]["top"][0].pop("type"),
+        lambda d: d.update(views="nope"),
+    ],
+)
+def test_invalid_viewconf_raises_on_validated(update):
+    data = viewconf_dict()
+    update(data)
+    with pytest.raises(pydantic.ValidationError):
+        hg.Viewconf.parse_obj(data)
+
+    # invalid subtrees are only detected once validated
+    conf = hg.Viewconf.parse_obj(data, validate=False)
+    with pytest.raises(pydantic.ValidationError):
+        conf.validated()
@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip("h5py")
+
+from hg._coarsen import (  # noqa: E402
+    TILE_SIZE,
+    CoarsenedCooler,
+    check_mcool_transforms,
+)
+
+RESOLUTION = 1000
+LENGTHS = np.array([700_000, 523_500])
+
+
+@pytest.fixture
+def cool(tmp_path):
+    """A random single-resolution .cool file, with its pixels and weights."""
+    rng = np.random.default_rng(0)
+    n_bins = [int(np.ceil(length / RESOLUTION)) for length in LENGTHS]
+    chrom = np.repeat(np.arange(len(LENGTHS)), n_bins)
+    start = np.concatenate([np.arange(n) * RESOLUTION for n in n_bins])
+    n = len(chrom)
+    bin1, bin2 = rng.integers(0, n, (2, 100_000))
+    pixels = np.unique(
+        np.stack([np.minimum(bin1, bin2), np.maximum(bin1, bin2)]), axis=1
+    )
+    count = rng.integers(1, 10, pixels.shape[1])
+    weight = rng.random(n)
+    weight[5] = np.nan
+
+    path = tmp_path / "test.cool"
+    with h5py.File(path, "w") as f:
+        f.attrs["bin-size"] = RESOLUTION
+        f["chroms/name"] = np.array([b"chr1", b"chr2"])
+        f["chroms/length"] = LENGTHS
+        f["bins/chrom"] = chrom
+        f["bins/start"] = start
+        f["bins/end"] = start + RESOLUTION
+        f["bins/weight"] = weight
+        f["pixels/bin1_id"] = pixels[0]
+        f["pixels/bin2_id"] = pixels[1]
+        f["pixels/count"] = count
+        f["indexes/bin1_offset"] = np.searchsorted(pixels[0], np.arange(n + 1))
+
+    offsets = np.r_[0, np.cumsum(LENGTHS)[:-1]]
+    return path, offsets[chrom] + start, pixels, count, weight
+
+
+def reference_tile(cool, coarsened, zoom, x, y, balanced):
+    _, starts, (bin1, bin2), count, weight = cool
+    resolution = RESOLUTION * 2 ** (coarsened.max_zoom - zoom)
+    width = TILE_SIZE * resolution
+    values = count * (np.nan_to_num(weight[bin1] * weight[bin2]) if balanced else 1)
+    out = np.zeros((TILE_SIZE, TILE_SIZE))
+    # both triangles, without counting the diagonal twice
+    lower = bin1 != bin2
+    for a, b, v in ((bin1, bin2, values), (bin2[lower], bin1[lower], values[lower])):
+        i, j = starts[a] - x * width, starts[b] - y * width
+        inside = (i >= 0) & (i < width) & (j >= 0) & (j < width)
+        np.add.at(out, (j[inside] // resolution, i[inside] // resolution), v[inside])
+    return out
+
+
+@pytest.mark.parametrize(
+    "zoom,x,y,balanced",
+    [
+        (3, 2, 3, False),
+        (3, 3, 2, True),
+        (3, 4, 4, True),
+        (2, 1, 1, False),
+        (0, 0, 0, True),
+    ],
+)
+def test_dense_tiles(cool, tmp_path, zoom, x, y, balanced):
+    coarsened = CoarsenedCooler(str(cool[0]), cache_dir=tmp_path)
+    assert coarsened.max_zoom == 3
+    expected = reference_tile(cool, coarsened, zoom, x, y, balanced)
+    np.testing.assert_allclose(coarsened.dense_tile(zoom, x, y, balanced), expected)
+
+
+def test_diagonal_tiles_read_pixels_once(cool, tmp_path, monkeypatch):
+    coarsened = CoarsenedCooler(str(cool[0]), cache_dir=tmp_path)
+    reads = []
+    read_pixels = coarsened._read_pixels
+
+    def counting_read_pixels(start, stop):
+        reads.append((start, stop))
+        return read_pixels(start, stop)
+
+    monkeypatch.setattr(coarsened, "_read_pixels", counting_read_pixels)
+    coarsened.dense_tile(3, 1, 1, False)
+    assert len(reads) == len(set(reads)) == 1
+
+
+def test_tiles_from_children(cool, tmp_path):
+    coarsened = CoarsenedCooler(str(cool[0]), cache_dir=tmp_path)
+    for dx in (0, 1):
+        for dy in (0, 1):
+            coarsened.dense_tile(3, 2 + dx, 2 + dy, True)
+    expected = reference_tile(cool, coarsened, 2, 1, 1, True)
+    np.testing.assert_allclose(coarsened.dense_tile(2, 1, 1, True), expected)
+
+
+def test_cache_is_bounded_in_bytes(cool, tmp_path):
+    tile_bytes = TILE_SIZE**2 * 8
+    coarsened = CoarsenedCooler(
+        str(cool[0]), cache_dir=tmp_path, cache_bytes=3 * tile_bytes
+    )
+    for x in range(5):
+        coarsened.dense_tile(3, x, 0, False)
+    assert len(coarsened._cache) == 3
+    assert coarsened._cache_nbytes == 3 * tile_bytes
+    assert coarsened.evict(tile_bytes) == tile_bytes
+    assert coarsened._cache_nbytes == 2 * tile_bytes
+
+
+def test_expected_per_chromosome(cool, tmp_path):
+    _, starts, (bin1, bin2), count, weight = cool
+    coarsened = CoarsenedCooler(str(cool[0]), cache_dir=tmp_path)
+    cis, _ = coarsened.expected(coarsened.max_zoom, True)
+    assert cis.shape[0] == len(LENGTHS)
+
+    values = np.nan_to_num(count * weight[bin1] * weight[bin2])
+    valid = np.isfinite(weight)
+    for chrom, (lo, hi) in enumerate(
+        zip(coarsened.chrom_bins, coarsened.chrom_bins[1:])
+    ):
+        inside = (bin1 >= lo) & (bin2 < hi)
+        distance = bin2[inside] - bin1[inside]
+        sums = np.bincount(distance, values[inside], minlength=hi - lo)
+        chrom_valid = valid[lo:hi]
+        pairs = [
+            (chrom_valid[: len(chrom_valid) - d] & chrom_valid[d:]).sum()
+            for d in range(hi - lo)
+        ]
+        np.testing.assert_allclose(cis[chrom, : hi - lo], sums / pairs)
+        assert np.isnan(cis[chrom, hi - lo :]).all()
+
+
+def test_mcool_transforms(tmp_path):
+    path = tmp_path / "test.mcool"
+    with h5py.File(path, "w") as f:
+        f["resolutions/1000/bins/weight"] = np.ones(10)
+        f["resolutions/2000/bins/start"] = np.arange(5)
+
+    # zoom 0 is the coarsest resolution, which has no weights
+    check_mcool_transforms(path, ["u.0.0.0", "u.0.0.0.none", "u.1.0.0.weight"])
+    with pytest.raises(ValueError, match="resolution 2000"):
+        check_mcool_transforms(path, ["u.1.0.0.weight", "u.0.0.0.weight"])
+    with pytest.raises(ValueError, match='"oe" transform'):
+        check_mcool_transforms(path, ["u.1.0.0.oe"])
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import urllib.request
+
+import pytest
+
+if sys.platform == "win32":
+    pytest.skip("the daemon needs Unix sockets", allow_module_level=True)
+
+np = pytest.importorskip("numpy")
+
+from hg.server import HgServer  # noqa: E402
+from hg.server._daemon import (  # noqa: E402
+    Daemon,
+    DaemonClient,
+    default_directory,
+    ensure_private_directory,
+)
+from hg.server._provider import cached_tiles  # noqa: E402
+from hg.tilesets import pyramid, to_pyramid, xarray  # noqa: E402
+
+
+def test_default_directory(monkeypatch, tmp_path):
+    monkeypatch.setenv("HG_DAEMON_DIR", str(tmp_path / "hg"))
+    assert default_directory() == tmp_path / "hg"
+    monkeypatch.delenv("HG_DAEMON_DIR")
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert default_directory() == tmp_path / "hg-daemon"
+
+
+def test_private_directory(tmp_path):
+    directory = tmp_path / "daemon"
+    ensure_private_directory(directory)
+    assert directory.stat().st_mode & 0o777 == 0o700
+    # existing private directories are fine
+    ensure_private_directory(directory)
+
+    directory.chmod(0o755)
+    with pytest.raises(PermissionError):
+        ensure_private_directory(directory)
+
+    link = tmp_path / "link"
+    link.symlink_to(directory)
+    directory.chmod(0o700)
+    with pytest.raises(PermissionError):
+        ensure_private_directory(link)
+
+
+@pytest.fixture
+def daemon_dir(tmp_path):
+    directory = tmp_path / "daemon"
+    yield directory
+    # stop the daemon
+    state = directory / "daemon.json"
+    if state.exists():
+        os.kill(json.loads(state.read_text())["pid"], 15)
+
+
+def test_shared_tilesets(tmp_path, daemon_dir):
+    path = to_pyramid(xarray(np.arange(5000.0)), tmp_path / "data.pyramid")
+    first = DaemonClient(daemon_dir, idle_timeout=5)
+    second = DaemonClient(daemon_dir, idle_timeout=5)
+    assert first.pid == second.pid
+
+    tileset = pyramid(str(path))
+    a = first.create(tileset)
+    b = second.create(pyramid(str(path)))
+    c = second.create(pyramid(str(path), uid="other"))
+    assert a.tileset.uid == b.tileset.uid == tileset.uid
+    assert c.tileset.uid == "other"
+    assert first.stats()["handles"] == 1
+
+    url = f"{a.server}tiles/?d={tileset.uid}.0.0&d=other.0.0"
+    with urllib.request.urlopen(url) as response:
+        tiles = json.load(response)
+    assert tiles[f"{tileset.uid}.0.0"] == tiles["other.0.0"]
+    assert "dense" in tiles["other.0.0"]
+
+    first.close()
+    second.close()
+
+
+def test_server_tilesets_include_shared_ones(tmp_path, daemon_dir):
+    path = to_pyramid(xarray(np.arange(5000.0)), tmp_path / "data.pyramid")
+    server = HgServer()
+    server.use_daemon(str(daemon_dir), idle_timeout=5)
+    shared = server.add(pyramid(str(path)))
+    local = server.add(xarray(np.arange(10.0)))
+    assert shared.provider is not local.provider
+    assert server.tilesets == {
+        shared.tileset.uid: shared.tileset,
+        local.tileset.uid: local.tileset,
+    }
+    server.reset()
+
+
+def test_restarted_daemon_serves_rewritten_files(tmp_path):
+    path = tmp_path / "data.pyramid"
+    directory = tmp_path / "daemon"
+    directory.mkdir(mode=0o700)
+
+    def read_tile(recipe):
+        # a new daemon with the cache directory of the previous one
+        daemon = Daemon(directory)
+        uid = daemon.register(recipe)
+        tileset = daemon.provider._tilesets[uid]
+        tile = cached_tiles(tileset, [f"{uid}.0.0"], daemon.provider.cache)
+        daemon.provider.stop()
+        value = json.loads(tile[f"{uid}.0.0"])["max_value"]
+        return value, daemon.provider.cache.disk_hits > 0
+
+    to_pyramid(xarray(np.arange(100.0)), path)
+    recipe = pyramid(str(path)).recipe
+    assert read_tile(recipe) == (99, False)
+    assert read_tile(recipe) == (99, True)
+
+    # rewritten while no daemon was running
+    to_pyramid(xarray(np.arange(200.0)), path)
+    assert read_tile(recipe) == (199, False)
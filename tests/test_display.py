@@ -0,0 +1,29 @@
+import json
+import re
+
+import hg
+from hg.display import export_html, spec_to_html
+
+
+def inlined_spec(html):
+    match = re.search(r"JSON\.parse\((.*)\),\n", html)
+    assert match is not None
+    return json.loads(json.loads(match[1]))
+
+
+def test_export_html(tmp_path):
+    confs = [
+        hg.view(hg.track("top-axis"), uid=f"view-{i}").viewconf() for i in range(3)
+    ]
+    paths = [tmp_path / f"{i}.html" for i in range(3)]
+
+    report = export_html(zip(confs, paths), processes=2, max_pending=1)
+
+    assert report.files == 3
+    htmls = [path.read_text(encoding="utf-8") for path in paths]
+    assert report.chars == sum(len(html) for html in htmls)
+    assert report.seconds > 0
+    for conf, html in zip(confs, htmls):
+        assert inlined_spec(html) == json.loads(conf.json())
+        # the same page as rendering the spec directly
+        assert html == spec_to_html(conf.json())
@@ -0,0 +1,130 @@
+import concurrent.futures
+import errno
+import os
+
+import pytest
+
+try:
+    from fuse import FuseOSError
+
+    from hg.fuse._httpfs import STATS_FIELDS, AttrCache, MultiHttpFs
+except (ImportError, OSError) as e:  # fusepy raises OSError without libfuse
+    pytest.skip(f"FUSE is not available: {e}", allow_module_level=True)
+
+BLOCK_SIZE = 1024
+
+
+@pytest.fixture
+def remote(range_server):
+    url, directory, requests = (
+        range_server.url,
+        range_server.directory,
+        range_server.requests,
+    )
+    data = os.urandom(16 * BLOCK_SIZE + 100)
+    (directory / "data.bin").write_bytes(data)
+    path = "/http/" + url[len("http://") :] + "/data.bin.."
+    return path, data, requests
+
+
+def make_fs(tmp_path, **kwargs):
+    stats = [0] * len(STATS_FIELDS)
+    fs = MultiHttpFs(
+        ["http"],
+        disk_cache_dir=str(tmp_path / "cache"),
+        block_size=BLOCK_SIZE,
+        attr_cache=AttrCache(),
+        stats=stats,
+        **kwargs,
+    )
+    return fs, dict(zip(STATS_FIELDS, stats))
+
+
+def get_stats(fs):
+    fs._sync_stats()
+    return dict(zip(STATS_FIELDS, fs.stats))
+
+
+def read_all(fs, path, size):
+    # like the kernel, which doesn't read past `st_size`
+    return b"".join(
+        fs.read(path, min(BLOCK_SIZE, size - offset), offset, None)
+        for offset in range(0, size, BLOCK_SIZE)
+    )
+
+
+def range_requests(requests):
+    return [r for r in requests if r[0] == "GET" and r[2] is not None]
+
+
+def test_sequential_reads_prefetch_blocks(tmp_path, remote):
+    path, data, requests = remote
+    fs, _ = make_fs(tmp_path, readahead=4)
+    assert fs.getattr(path)["st_size"] == len(data)
+
+    assert read_all(fs, path, len(data)) == data
+    fs._executor.shutdown(wait=True)
+
+    n_blocks = -(-len(data) // BLOCK_SIZE)
+    stats = get_stats(fs)
+    assert stats["reads"] == n_blocks
+    assert stats["bytes_read"] == len(data)
+    assert stats["readahead_blocks"] > 0
+    assert stats["readahead_bytes"] > 0
+    # every block is fetched once, by a read or by readahead
+    assert len(range_requests(requests)) == n_blocks
+
+
+def test_random_reads_do_not_prefetch(tmp_path, remote):
+    path, data, requests = remote
+    fs, _ = make_fs(tmp_path, readahead=4)
+    for offset in (10 * BLOCK_SIZE, 2 * BLOCK_SIZE, 14 * BLOCK_SIZE):
+        assert fs.read(path, 10, offset, None) == data[offset : offset + 10]
+    fs._executor.shutdown(wait=True)
+    assert get_stats(fs)["readahead_blocks"] == 0
+    assert len(range_requests(requests)) == 3
+
+
+def test_readahead_disabled(tmp_path, remote):
+    path, data, _ = remote
+    fs, _ = make_fs(tmp_path, readahead=0)
+    assert fs._executor is None
+    for offset in range(0, 4 * BLOCK_SIZE, BLOCK_SIZE):
+        assert fs.read(path, BLOCK_SIZE, offset, None) == data[offset:][:BLOCK_SIZE]
+    assert get_stats(fs)["readahead_blocks"] == 0
+
+
+def test_concurrent_reads_with_readahead(tmp_path, remote):
+    path, data, _ = remote
+    fs, _ = make_fs(tmp_path, readahead=4, readahead_workers=4)
+
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: read_all(fs, path, len(data)), range(8)))
+    assert all(result == data for result in results)
+
+
+def test_missing_files_are_cached(tmp_path, range_server):
+    range_server.errors["/missing.bin"] = 404
+    fs, _ = make_fs(tmp_path)
+    path = "/http/" + range_server.url[len("http://") :] + "/missing.bin.."
+    for _ in range(3):
+        with pytest.raises(FuseOSError) as e:
+            fs.getattr(path)
+        assert e.value.errno == errno.ENOENT
+    stats = get_stats(fs)
+    assert stats["attr_misses"] == 1
+    assert stats["attr_hits"] == 2
+
+
+def test_errors_are_not_cached(tmp_path, range_server):
+    range_server.errors["/flaky.bin"] = 503
+    fs, _ = make_fs(tmp_path)
+    path = "/http/" + range_server.url[len("http://") :] + "/flaky.bin.."
+    with pytest.raises(FuseOSError) as e:
+        fs.getattr(path)
+    assert e.value.errno == errno.EIO
+    assert fs.attr_cache.get(path) == (False, None)
+
+    del range_server.errors["/flaky.bin"]
+    (range_server.directory / "flaky.bin").write_bytes(b"0123456789")
+    assert fs.getattr(path)["st_size"] == 10
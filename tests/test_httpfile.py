@@ -0,0 +1,98 @@
+import concurrent.futures
+import io
+import os
+
+import pytest
+
+from hg._httpfile import BlockCache, ConnectionPool, HttpFile
+from hg.tilesets import open_remote
+
+
+@pytest.fixture
+def remote(range_server):
+    url, directory, requests = (
+        range_server.url,
+        range_server.directory,
+        range_server.requests,
+    )
+    data = os.urandom(10_000)
+    (directory / "data.bin").write_bytes(data)
+    return f"{url}/data.bin", data, requests
+
+
+def test_read_and_seek(remote):
+    url, data, _ = remote
+    f = HttpFile(url, block_size=1024, connection_pool=ConnectionPool())
+    assert f.size == len(data)
+    assert f.read(100) == data[:100]
+    assert f.tell() == 100
+    f.seek(-50, io.SEEK_END)
+    assert f.read() == data[-50:]
+    f.seek(5000)
+    assert f.read(3000) == data[5000:8000]
+    assert f.pread(10, 9995) == data[9995:]
+    assert f.pread(10, len(data)) == b""
+
+
+def test_blocks_are_cached_and_coalesced(remote):
+    url, data, requests = remote
+    f = HttpFile(url, block_size=1024)
+    assert f.pread(4096, 0) == data[:4096]
+    # four adjacent blocks in one request
+    assert f.requests == 1
+    assert f.pread(100, 2048) == data[2048:2148]
+    assert f.requests == 1
+    assert f.cache.hits == 1
+    # block 3 is cached, blocks 4 to 6 are fetched in one request
+    assert f.pread(4096, 3072) == data[3072:7168]
+    assert f.requests == 2
+    assert f.pread(1024, 8192) == data[8192:9216]
+    assert f.requests == 3
+    # blocks 7 and 9 are fetched in separate requests around cached block 8
+    assert f.pread(3072, 7168) == data[7168:10240]
+    assert f.requests == 5
+
+
+def test_disk_cache(remote, tmp_path):
+    url, data, requests = remote
+    f = HttpFile(url, block_size=1024, cache=BlockCache(cache_dir=tmp_path / "blocks"))
+    assert f.pread(2048, 0) == data[:2048]
+
+    g = HttpFile(url, block_size=1024, cache=BlockCache(cache_dir=tmp_path / "blocks"))
+    assert g.pread(2048, 0) == data[:2048]
+    assert g.requests == 0
+    assert g.cache.disk_hits == 2
+
+
+def test_concurrent_readers_keep_their_position(remote):
+    url, data, _ = remote
+    f = HttpFile(url, block_size=512)
+
+    def read(offset):
+        chunks = []
+        f.seek(offset)
+        for _ in range(10):
+            chunks.append(f.read(37))
+        return offset, b"".join(chunks), f.tell()
+
+    offsets = range(0, 9000, 300)
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        for offset, chunk, end in pool.map(read, offsets):
+            assert chunk == data[offset : offset + 370]
+            assert end == offset + 370
+
+
+def test_open_remote_options(remote, tmp_path):
+    url, data, _ = remote
+    f = open_remote(url, block_size=2048, block_cache_dir=str(tmp_path))
+    assert isinstance(f, HttpFile)
+    assert f.block_size == 2048
+    assert f.cache.cache_dir == tmp_path
+    assert f.read(10) == data[:10]
+    assert any(tmp_path.iterdir())
+    assert open_remote("local.mcool") == "local.mcool"
+
+
+def test_missing_file(range_server):
+    with pytest.raises(FileNotFoundError):
+        HttpFile(f"{range_server.url}/missing.bin").size
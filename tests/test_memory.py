@@ -0,0 +1,143 @@
+import collections
+import threading
+
+import pytest
+
+import hg._memory as memory
+from hg._memory import MemoryBudget
+
+
+class FakeCache:
+    """An LRU cache of `size` byte entries."""
+
+    def __init__(self, budget, sizes):
+        self.budget = budget
+        self.entries = collections.OrderedDict()
+        for key, size in sizes.items():
+            self.set(key, size)
+
+    @property
+    def nbytes(self):
+        return sum(self.entries.values())
+
+    def set(self, key, size):
+        self.entries[key] = size
+        self.budget.check()
+
+    def get(self, key):
+        self.entries.move_to_end(key)
+
+    def evict(self, nbytes):
+        freed = 0
+        while freed < nbytes and self.entries:
+            _, size = self.entries.popitem(last=False)
+            freed += size
+        return freed
+
+
+class Pinned:
+    """An in-memory tileset, which can't free its data."""
+
+    nbytes = 50
+
+    def evict(self, nbytes):
+        return 0
+
+
+def test_report():
+    budget = MemoryBudget()
+    a = FakeCache(budget, {"a1": 10, "a2": 20})
+    b = FakeCache(budget, {"b1": 5})
+    other_b = FakeCache(budget, {"b2": 1})
+    pinned = Pinned()
+    budget.register("a", a)
+    budget.register("b", b)
+    budget.register("b", other_b)
+    budget.register("pinned", pinned)
+    assert budget.report() == {"pinned": 50, "a": 30, "b": 6}
+    assert list(budget.report()) == ["pinned", "a", "b"]
+    assert budget.nbytes == 86
+
+    # consumers are dropped once garbage collected
+    del b
+    assert budget.report() == {"pinned": 50, "a": 30, "b": 1}
+
+
+def test_check_evicts_least_recently_used():
+    budget = MemoryBudget(max_bytes=100, low_water=0.8)
+    cache = FakeCache(budget, {})
+    budget.register("cache", cache)
+    for i in range(10):
+        cache.set(i, 10)
+    assert budget.evicted_bytes == 0
+
+    cache.get(0)
+    cache.set(10, 10)
+    # evicted down to 80 bytes, least recently used first
+    assert list(cache.entries) == [4, 5, 6, 7, 8, 9, 0, 10]
+    assert budget.nbytes == 80
+    assert budget.evicted_bytes == 30
+
+
+def test_concurrent_checks_evict_once():
+    budget = MemoryBudget(max_bytes=100, low_water=0.8)
+    evicting, release = threading.Event(), threading.Event()
+
+    class SlowCache(FakeCache):
+        def evict(self, nbytes):
+            evicting.set()
+            release.wait(5)
+            return super().evict(nbytes)
+
+    cache = SlowCache(budget, {})
+    cache.entries.update((i, 10) for i in range(12))
+    budget.register("cache", cache)
+
+    thread = threading.Thread(target=budget.check)
+    thread.start()
+    assert evicting.wait(5)
+    # skipped while the other thread evicts
+    budget.check()
+    release.set()
+    thread.join()
+    assert budget.nbytes == 80
+    assert budget.evicted_bytes == 40
+
+
+def test_check_evicts_largest_first():
+    budget = MemoryBudget()
+    small = FakeCache(budget, {"s1": 10, "s2": 10})
+    large = FakeCache(budget, {"l1": 40, "l2": 40})
+    pinned = Pinned()
+    for name, consumer in [("small", small), ("large", large), ("pinned", pinned)]:
+        budget.register(name, consumer)
+
+    # nothing is evicted at the limit
+    budget.max_bytes = 150
+    budget.check()
+    assert budget.nbytes == 150
+
+    # the pinned tileset can't shrink, the caches make room for it
+    budget.max_bytes = 100
+    budget.check()
+    assert list(large.entries) == []
+    assert list(small.entries) == ["s1", "s2"]
+    assert budget.nbytes <= 90
+
+    budget.max_bytes = 60
+    budget.check()
+    assert list(small.entries) == []
+    assert budget.report() == {"pinned": 50, "small": 0, "large": 0}
+
+
+def test_in_memory_tilesets_are_counted():
+    np = pytest.importorskip("numpy")
+    from hg.tilesets import points, xarray
+
+    data = np.zeros((1000, 1000))
+    array = xarray(data)
+    assert memory.budget.report()[f"xarray {array.uid}"] == data.nbytes
+
+    cloud = points(np.arange(100.0), np.arange(100.0))
+    # coordinates, priorities and the Morton index
+    assert memory.budget.report()[f"points {cloud.uid}"] >= 5 * 100 * 8
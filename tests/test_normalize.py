@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from hg._normalize import cis_expected, ice, observed_over_expected
+
+
+@pytest.fixture
+def pixels():
+    """Upper triangle pixels of a random symmetric 50x50 matrix."""
+    rng = np.random.default_rng(0)
+    n = 50
+    bin1, bin2 = np.triu_indices(n)
+    values = rng.integers(1, 10, len(bin1)).astype(np.float64)
+    return bin1, bin2, values, n
+
+
+def test_ice_balances_rows(pixels):
+    bin1, bin2, values, n = pixels
+    # a bin without contacts is masked
+    keep = (bin1 != 7) & (bin2 != 7)
+    bin1, bin2, values = bin1[keep], bin2[keep], values[keep]
+    weights = ice(bin1, bin2, values, n, tol=1e-10, max_iter=1000)
+    assert np.isnan(weights[7])
+    assert np.isfinite(np.delete(weights, 7)).all()
+
+    far = bin2 - bin1 >= 2
+    balanced = values[far] * weights[bin1[far]] * weights[bin2[far]]
+    marginals = np.bincount(bin1[far], balanced, n) + np.bincount(
+        bin2[far], balanced, n
+    )
+    np.testing.assert_allclose(np.delete(marginals, 7), 1, rtol=1e-4)
+
+
+def test_cis_expected(pixels):
+    bin1, bin2, values, n = pixels
+    resolution = 100
+    # the chromosome starts mid-way through a coarse bin of 2 bins
+    starts = 1050 + 50 * np.arange(n)
+    valid = np.ones(n, dtype=bool)
+    valid[3] = False
+    (sums, counts, n_valid), (coarse_sums, coarse_counts, coarse_valid) = cis_expected(
+        bin1, bin2, values, starts, valid, [50, resolution]
+    )
+
+    dense = np.zeros((n, n))
+    dense[bin1, bin2] = values
+    dense[bin2, bin1] = values
+    np.testing.assert_allclose(sums, [np.trace(dense, d) for d in range(n)])
+    assert n_valid == n - 1
+    assert counts[0] == n - 1 and counts[1] == n - 3
+
+    coarse = starts // resolution - starts[0] // resolution
+    m = coarse[-1] + 1
+    coarse_dense = np.zeros((m, m))
+    np.add.at(coarse_dense, (coarse[:, None], coarse[None, :]), dense)
+    np.testing.assert_allclose(
+        coarse_sums, [np.trace(coarse_dense, d) for d in range(m)]
+    )
+    # bin 3 shares its coarse bin with valid bin 4
+    assert coarse_valid == m
+    assert coarse_counts[0] == m and coarse_counts[2] == m - 2
+
+
+def test_observed_over_expected():
+    resolution = 10
+    chrom_offsets = np.array([0, 30])
+    total_length = 55
+    cis = np.array([[1.0, 2.0, 4.0], [10.0, 20.0, np.nan]])
+    tile = np.ones((8, 8))
+    out = observed_over_expected(
+        tile, (0, 0), resolution, chrom_offsets, total_length, cis, 0.5
+    )
+
+    # each chromosome uses its own expected values
+    assert out[0, 0] == 1 and out[2, 0] == 1 / 4
+    assert out[3, 3] == 1 / 10 and out[4, 3] == 1 / 20
+    # between chromosomes
+    assert out[3, 0] == out[0, 3] == 2
+    # distances without an expected value, and bins past the genome end
+    assert np.isnan(out[5, 3])
+    assert np.isnan(out[6]).all() and np.isnan(out[:, 6]).all()
+    assert np.isnan(out[:6, :6]).sum() == 2
+
+    # tiles away from the origin
+    shifted = observed_over_expected(
+        tile[:4, :4], (30, 40), resolution, chrom_offsets, total_length, cis, 0.5
+    )
+    assert shifted[0, 0] == 1 / 20 and shifted[0, 1] == 1 / 10
+    assert np.isnan(shifted[:, 3]).all()
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from hg._pyramid import write_pyramid
+from hg._tiles import decode_dense_tile, format_dense_tile
+from hg.tilesets import LocalTileset, pyramid, run_sync, to_pyramid, xarray
+
+
+def assert_same_tiles(source, served, tids):
+    expected = dict(run_sync(source.tiles, [f"{source.uid}.{t}" for t in tids]))
+    for t, (tid, tile) in zip(tids, served.tiles([f"{served.uid}.{t}" for t in tids])):
+        assert tid == f"{served.uid}.{t}"
+        want = expected[f"{source.uid}.{t}"]
+        np.testing.assert_allclose(
+            decode_dense_tile(tile), decode_dense_tile(want), rtol=1e-3
+        )
+        assert tile["min_value"] == pytest.approx(want["min_value"], rel=1e-3)
+        assert tile["max_value"] == pytest.approx(want["max_value"], rel=1e-3)
+        assert tile.get("shape") == want.get("shape")
+
+
+def test_vector_round_trip(tmp_path):
+    data = np.arange(5000.0)
+    data[3000:4100] = np.nan
+    source = xarray(data)
+    served = pyramid(str(to_pyramid(source, tmp_path / "v", batch_size=2)))
+
+    assert served.datatype == "vector"
+    assert served.info() == source.info()
+    # the fully missing tile is not stored, but is served as NaN
+    assert_same_tiles(source, served, ["0.0", "1.0", "1.1", "3.0", "3.3", "3.4"])
+    [(_, raw)] = served.raw_tiles([f"{served.uid}.3.0"])
+    assert isinstance(raw["dense"], np.memmap)
+
+
+def test_matrix_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.random((600, 600))
+    data = data + data.T
+    source = xarray(data)
+    served = pyramid(str(to_pyramid(source, tmp_path / "m")))
+
+    assert served.datatype == "matrix"
+    assert served.info() == source.info()
+    # tiles below the diagonal are read transposed
+    assert_same_tiles(source, served, ["0.0.0", "1.0.1", "1.1.0", "2.2.1", "2.0.2"])
+
+
+def test_multivec_round_trip_up_to_max_zoom(tmp_path):
+    data = np.arange(3 * 1000.0).reshape(3, 1000)
+    source = xarray(data)
+    served = pyramid(str(to_pyramid(source, tmp_path / "mv", max_zoom=1)))
+
+    info = served.info()
+    assert info["shape"] == [256, 3]
+    assert info["resolutions"] == source.info()["resolutions"][-2:]
+    assert_same_tiles(source, served, ["0.0", "0.1"])
+
+
+def vector_tileset(tiles):
+    info = {"min_pos": [0], "max_pos": [1024], "max_width": 1024, "max_zoom": 2}
+    return LocalTileset(tiles=tiles, info=lambda: info, uid="v", datatype="vector")
+
+
+def test_tileset_without_dense_tiles_writes_nothing(tmp_path):
+    tileset = vector_tileset(lambda tids: [(tid, {}) for tid in tids])
+    with pytest.raises(ValueError, match="no dense tiles"):
+        write_pyramid(tileset, tmp_path / "p")
+    assert list((tmp_path / "p").iterdir()) == []
+
+
+def test_failed_conversion_removes_partial_files(tmp_path):
+    def tiles(tids):
+        if any(tid.startswith("x.2.") for tid in tids):
+            raise RuntimeError("unreadable")
+        return [(tid, format_dense_tile(np.ones(256))) for tid in tids]
+
+    with pytest.raises(RuntimeError, match="unreadable"):
+        write_pyramid(vector_tileset(tiles), tmp_path / "p", batch_size=1)
+    assert list((tmp_path / "p").iterdir()) == []
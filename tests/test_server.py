@@ -0,0 +1,355 @@
+import json
+import pstats
+import time
+
+import numpy as np
+import pytest
+from starlette.testclient import TestClient
+
+import hg
+from hg._tiles import decode_dense_tile, format_dense_tile, unpack_tiles
+from hg.server import HgServer
+from hg.server._cache import TileCache
+from hg.server._provider import TilesetProvider, cached_tiles
+from hg.server._watch import FileWatcher
+from hg.tilesets import LocalTileset
+
+
+def dense_tiles(tids):
+    return [(tid, format_dense_tile(np.arange(4.0) + len(tid))) for tid in tids]
+
+
+@pytest.fixture
+def provider():
+    provider = TilesetProvider()
+    yield provider
+    provider.stop()
+
+
+@pytest.fixture
+def client(provider):
+    with TestClient(provider.app) as client:
+        yield client
+
+
+@pytest.fixture
+def tileset(provider):
+    tileset = LocalTileset(
+        tiles=dense_tiles,
+        info=lambda: {"min_pos": [0], "max_pos": [4], "max_width": 4, "max_zoom": 0},
+        uid="a",
+        datatype="vector",
+    )
+    provider.create(tileset)
+    return tileset
+
+
+def test_tiles_bin(client, provider):
+    computed = []
+    tileset = vector_tileset("a", computed)
+    provider.create(tileset)
+
+    # the first request computes the tiles, the others read them from the cache
+    for _ in range(3):
+        response = client.post("/api/v1/tiles_bin/", json=["a.0.0", "a.1.0"])
+        assert response.status_code == 200
+        tiles = unpack_tiles(response.content)
+        assert set(tiles) == {"a.0.0", "a.1.0"}
+        np.testing.assert_array_equal(tiles["a.0.0"]["dense"], np.arange(4.0) + 5)
+    assert sorted(computed) == ["a.0.0", "a.1.0"]
+    assert "a.0.0" in provider.cache
+
+
+def test_tiles_bin_caches_raw_tiles_as_json(client, provider):
+    def raw_tiles(tids):
+        return [(tid, {"dense": np.arange(4.0), "dtype": "float32"}) for tid in tids]
+
+    tileset = LocalTileset(
+        tiles=dense_tiles, info=lambda: {}, uid="a", raw_tiles=raw_tiles
+    )
+    provider.create(tileset)
+
+    response = client.post("/api/v1/tiles_bin/", json=["a.0.0"])
+    np.testing.assert_array_equal(
+        unpack_tiles(response.content)["a.0.0"]["dense"], np.arange(4.0)
+    )
+    # served from the cache by the JSON endpoint too
+    tile = client.get("/api/v1/tiles/", params={"d": "a.0.0"}).json()["a.0.0"]
+    assert tile["dtype"] == "float32"
+    np.testing.assert_array_equal(decode_dense_tile(tile), np.arange(4.0))
+
+
+@pytest.mark.parametrize(
+    "body", [b"not json", b"1", b'{"a.0.0": 1}', b"[1, 2]", b'["a.0.0", null]', b"[]"]
+)
+def test_tiles_bin_rejects_invalid_bodies(client, tileset, body):
+    response = client.post("/api/v1/tiles_bin/", content=body)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_tiles_bin_unknown_tileset(client, tileset):
+    response = client.post("/api/v1/tiles_bin/", json=["b.0.0"])
+    assert response.status_code == 400
+
+
+def test_tiles_ws(client, tileset):
+    with client.websocket_connect("/api/v1/tiles_ws/") as ws:
+        ws.send_json({"subscribe": ["a.0.0", "a.1.0"]})
+        messages = [ws.receive_json() for _ in range(2)]
+        assert {m["id"] for m in messages} == {"a.0.0", "a.1.0"}
+        assert all("dense" in m["tile"] for m in messages)
+
+
+@pytest.mark.parametrize(
+    "message", ["not json", "[]", '{"subscribe": "a.0.0"}', '{"cancel": [1]}']
+)
+def test_tiles_ws_invalid_messages(client, tileset, message):
+    with client.websocket_connect("/api/v1/tiles_ws/") as ws:
+        ws.send_text(message)
+        assert "error" in ws.receive_json()
+        # the channel is still open
+        ws.send_json({"subscribe": ["a.0.0"]})
+        assert ws.receive_json()["id"] == "a.0.0"
+
+
+@pytest.mark.parametrize("query", ["", "?id=b"])
+def test_chromsizes_of_missing_tileset(client, tileset, query):
+    response = client.get(f"/api/v1/chrom-sizes/{query}")
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_watcher_with_several_files(tmp_path):
+    paths = [tmp_path / "a", tmp_path / "b"]
+    for path in paths:
+        path.write_text("0")
+    changed = []
+    watcher = FileWatcher(interval=3600)
+    watcher.watch("ab", [str(p) for p in paths], changed.append)
+    watcher.poll()
+    assert changed == []
+    assert watcher.fingerprint("ab") is not None
+
+    paths[1].write_text("changed")
+    watcher.poll()
+    assert changed == ["ab"]
+
+    paths[0].unlink()
+    watcher.poll()
+    assert changed == ["ab", "ab"]
+    assert watcher.fingerprint("ab") is None
+    watcher.stop()
+
+
+def test_derived_tilesets_are_invalidated(provider, client, tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_text("0")
+    tileset = LocalTileset(
+        tiles=dense_tiles,
+        info=lambda: {"min_pos": [0], "max_pos": [4], "max_zoom": 0},
+        uid="d",
+        datatype="vector",
+        source=[str(path)],
+    )
+    provider.create(tileset)
+    assert client.get("/api/v1/tiles/?d=d.0.0").status_code == 200
+    assert "d.0.0" in provider.cache
+
+    path.write_text("changed")
+    provider.watcher.poll()
+    assert "d.0.0" not in provider.cache
+
+
+def test_disk_cache_is_keyed_by_file_version(tmp_path):
+    path = tmp_path / "data.txt"
+    computed = []
+
+    def compute(tids):
+        computed.extend(tids)
+        return [(tid, {"v": path.read_text()}) for tid in tids]
+
+    def read_tile():
+        # e.g. a server restarted with the same cache directory
+        provider = TilesetProvider(cache=TileCache(cache_dir=tmp_path / "tiles"))
+        tileset = LocalTileset(tiles=compute, info=dict, uid="f", source=str(path))
+        provider.create(tileset)
+        tile = cached_tiles(tileset, ["f.0.0"], provider.cache)["f.0.0"]
+        provider.stop()
+        return tile
+
+    path.write_text("v1")
+    assert read_tile() == b'{"v":"v1"}'
+    assert read_tile() == b'{"v":"v1"}'
+    assert computed == ["f.0.0"]
+    path.write_text("v2 rewritten")
+    assert read_tile() == b'{"v":"v2 rewritten"}'
+    assert computed == ["f.0.0", "f.0.0"]
+
+
+def test_async_tileset_infos_and_tiles_share_the_loop(provider, client):
+    from test_tilesets import LoopBoundTileset
+
+    # added before the server loop is known
+    early = LoopBoundTileset().tileset("early")
+    provider.create(early)
+    assert client.get("/api/v1/tileset_info/?d=early").json()["early"]["max_zoom"] == 2
+    assert client.get("/api/v1/tiles/?d=early.0.0").json() == {
+        "early.0.0": {"tid": "early.0.0"}
+    }
+
+    # added after
+    late = LoopBoundTileset().tileset("late")
+    provider.create(late)
+    assert client.get("/api/v1/tiles/?d=late.0.0").status_code == 200
+    assert client.get("/api/v1/tileset_info/?d=late").json()["late"]["max_zoom"] == 2
+
+
+@pytest.mark.parametrize("limit", [0, -3])
+def test_tilesets_limit_is_at_least_one(provider, client, tileset, limit):
+    other = LocalTileset(tiles=dense_tiles, info=tileset.info, uid="b")
+    provider.create(other)
+    listing = client.get(f"/api/v1/tilesets/?limit={limit}").json()
+    assert listing["count"] == 2
+    assert [result["uuid"] for result in listing["results"]] == ["a"]
+    assert "offset=1" in listing["next"]
+
+
+def test_failed_infos_keep_newer_entries():
+    import concurrent.futures
+    import threading
+
+    from hg.server._index import TilesetIndex
+
+    started, fail = threading.Event(), threading.Event()
+    old = LocalTileset(tiles=dense_tiles, info=dict, uid="a")
+    new = LocalTileset(tiles=dense_tiles, info=dict, uid="a")
+
+    def encode_info(tileset):
+        if tileset is old:
+            started.set()
+            fail.wait()
+            raise ValueError("no info")
+        return b'{"max_zoom": 0}'
+
+    index = TilesetIndex(encode_info, concurrent.futures.ThreadPoolExecutor())
+    failed = index.add(old)
+    started.wait()
+    # e.g. the tileset was replaced while its info was computed
+    future = index.add(new)
+    fail.set()
+    assert b"error" in failed.result().info
+    assert future.result().info == b'{"max_zoom": 0}'
+    assert index.add(new) is future
+
+
+@pytest.fixture
+def hg_server():
+    server = HgServer()
+    yield server
+    server.reset()
+
+
+def vector_tileset(uid, computed):
+    def tiles(tids):
+        computed.extend(tids)
+        return dense_tiles(tids)
+
+    return LocalTileset(
+        tiles=tiles,
+        info=lambda: {
+            "min_pos": [0],
+            "max_pos": [1024],
+            "max_width": 1024,
+            "max_zoom": 3,
+        },
+        uid=uid,
+        datatype="vector",
+    )
+
+
+def test_tilesets(hg_server):
+    from hg._snapshot import collect_tiles
+
+    first = hg_server.add(vector_tileset("a", []))
+    second = hg_server.add(vector_tileset("b", []))
+    assert hg_server.tilesets == {"a": first.tileset, "b": second.tileset}
+
+    # what snapshots inline by default
+    spec = json.loads(hg.view(second.track("line")).viewconf().json())
+    infos, tiles = collect_tiles(spec, hg_server.tilesets)
+    assert list(infos) == ["b"]
+    assert tiles and all(tid.startswith("b.") for tid in tiles)
+
+
+def test_warm(hg_server):
+    computed = []
+    resource = hg_server.add(vector_tileset("w", computed))
+    assert hg_server.warm(resource, zooms=2).result(timeout=10) == 3
+
+    cache = resource.provider.cache
+    assert sorted(computed) == ["w.0.0", "w.1.0", "w.1.1"]
+    assert all(tid in cache for tid in computed)
+    assert "w.tileset_info" in cache
+    assert "w.2.0" not in cache
+
+    # only tiles missing from the cache are computed
+    assert hg_server.warm(resource, zooms=3).result(timeout=10) == 4
+    assert len(computed) == 7
+
+
+def test_warm_on_add_and_register(hg_server):
+    computed = []
+    resource = hg_server.add(vector_tileset("a", computed), warm=1)
+    register = hg_server.register(lambda uid: vector_tileset(uid, computed), warm=2)
+    register("b")
+    # warm-ups run one after another in the background
+    resource.provider._warm_executor.submit(lambda: None).result(timeout=10)
+    assert sorted(computed) == ["a.0.0", "b.0.0", "b.1.0", "b.1.1"]
+
+
+def slow_tiles(tids):
+    time.sleep(0.02)
+    return dense_tiles(tids)
+
+
+def test_profile_tile_requests(provider, client, tmp_path):
+    tileset = LocalTileset(tiles=slow_tiles, info=dict, uid="p")
+    provider.create(tileset)
+    profiler = provider.profiler
+    profiler.configure(enabled=True, sample_rate=1.0, slow_threshold=0.0)
+
+    assert client.get("/api/v1/tiles/?d=p.0.0&d=p.1.0").status_code == 200
+    # cached, nothing to compute
+    assert client.get("/api/v1/tiles/?d=p.0.0").status_code == 200
+
+    computed, cached = profiler.traces
+    assert computed.name == cached.name == "tiles"
+    assert computed.args == {"tids": ["p.0.0", "p.1.0"]}
+    spans = {name: duration for name, _, duration in computed.spans}
+    assert set(spans) == {"lookup", "compute", "serialize", "send"}
+    assert spans["compute"] >= 0.02
+    assert computed.duration >= sum(spans.values())
+    assert "compute" not in {name for name, *_ in cached.spans}
+    assert computed.profile is not None and cached.profile is None
+
+    path = tmp_path / "tiles.pstats"
+    profiler.dump_pstats(path)
+    functions = {func for _, _, func in pstats.Stats(str(path)).stats}
+    assert "slow_tiles" in functions
+
+    events = profiler.chrome_trace()["traceEvents"]
+    assert [e["name"] for e in events if e["name"] == "tiles"] == ["tiles", "tiles"]
+
+
+def test_profile_keeps_slow_requests(provider, client):
+    tileset = LocalTileset(tiles=slow_tiles, info=dict, uid="p")
+    provider.create(tileset)
+    provider.profiler.configure(enabled=True, slow_threshold=0.01, capacity=1)
+    for tid in ["p.0.0", "p.1.0", "p.0.0"]:
+        client.get(f"/api/v1/tiles/?d={tid}")
+    # the cached request was fast, only the last slow one is kept
+    [trace] = provider.profiler.traces
+    assert trace.args == {"tids": ["p.1.0"]}
+    with pytest.raises(ValueError):
+        provider.profiler.dump_pstats("unused.pstats")
@@ -0,0 +1,88 @@
+import base64
+import gzip
+import json
+
+from hg._grid import tile_ids
+from hg._snapshot import collect_tiles, pack
+from hg.tilesets import LocalTileset
+
+VECTOR_INFO = {"min_pos": [0], "max_pos": [1024], "max_width": 1024, "max_zoom": 4}
+
+
+def unpack(data):
+    return json.loads(gzip.decompress(base64.b64decode(data)))
+
+
+def test_tile_ids_of_vector():
+    assert tile_ids("u", VECTOR_INFO, None, pixel_width=256) == {
+        "u.0.0",
+        "u.1.0",
+        "u.1.1",
+    }
+    assert tile_ids("u", VECTOR_INFO, (0, 100), pixel_width=256) == {
+        "u.2.0",
+        "u.3.0",
+        "u.4.0",
+        "u.4.1",
+    }
+
+
+def test_tile_ids_of_matrix_resolutions():
+    info = {
+        "min_pos": [0, 0],
+        "max_pos": [1000, 1000],
+        "resolutions": [1, 10],
+        "bins_per_dimension": 10,
+    }
+    tids = tile_ids("u", info, (0, 1000), (0, 50), pixel_width=100, zoom_padding=0)
+    assert tids == {f"u.0.{x}.0" for x in range(10)}
+
+
+def test_collect_tiles():
+    requested = []
+
+    def tiles(tids):
+        requested.append(list(tids))
+        return [(tid, {"tid": tid}) for tid in tids]
+
+    tilesets = {"u": LocalTileset(tiles=tiles, info=lambda: VECTOR_INFO, uid="u")}
+    spec = {
+        "views": [
+            {
+                "initialXDomain": [0, 100],
+                "tracks": {
+                    "top": [
+                        {"type": "top-axis"},
+                        {"type": "horizontal-line", "tilesetUid": "other"},
+                        {"type": "horizontal-line", "tilesetUid": "u"},
+                    ]
+                },
+            }
+        ]
+    }
+
+    infos, collected = collect_tiles(spec, tilesets, pixel_width=256)
+
+    assert infos == {"u": VECTOR_INFO}
+    expected = tile_ids("u", VECTOR_INFO, (0, 100), pixel_width=256)
+    assert requested == [sorted(expected)]
+    assert collected == {tid: {"tid": tid} for tid in expected}
+
+
+def test_pack_deduplicates_tiles():
+    tiles = {"u.0.0": {"dense": "AAAA"}, "u.1.0": {"dense": "AAAA"}, "u.1.1": {}}
+    data = unpack(pack({"u": VECTOR_INFO}, tiles))
+    assert data["info"] == {"u": VECTOR_INFO}
+    assert data["tiles"] == {"u.0.0": 0, "u.1.0": 0, "u.1.1": 1}
+    assert data["values"] == [{"dense": "AAAA"}, {}]
+
+
+def test_pack_writes_nan_as_null():
+    data = pack({"u": {"min_value": float("nan")}}, {"u.0.0": {"max": float("inf")}})
+    raw = gzip.decompress(base64.b64decode(data)).decode()
+    assert "NaN" not in raw and "Infinity" not in raw
+    assert json.loads(raw) == {
+        "info": {"u": {"min_value": None}},
+        "tiles": {"u.0.0": 0},
+        "values": [{"max": None}],
+    }
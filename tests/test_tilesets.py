@@ -0,0 +1,343 @@
+import asyncio
+import hashlib
+import math
+import sys
+import types
+
+import pytest
+
+import hg
+from hg.tilesets import (
+    LocalTileset,
+    arithmetic,
+    bigwig_stack,
+    from_recipe,
+    hash_absolute_filepath_as_default_uid,
+    points,
+    run_sync,
+    xarray,
+)
+
+
+@hash_absolute_filepath_as_default_uid(uid_options=("rows", "scale"))
+def options_tileset(filepath, uid, rows=None, scale=False, block_size=None):
+    return LocalTileset(tiles=lambda tids: [], info=lambda: {}, uid=uid)
+
+
+def test_default_uid_hashes_path(tmp_path):
+    path = str(tmp_path / "data.mv5")
+    tileset = options_tileset(path)
+    assert tileset.uid == hashlib.md5(path.encode()).hexdigest()
+    assert tileset.source == path
+    # options which don't change the tiles don't change the uid
+    assert options_tileset(path, block_size=1024).uid == tileset.uid
+
+
+def test_default_uid_hashes_options(tmp_path):
+    path = str(tmp_path / "data.mv5")
+    uids = {
+        options_tileset(path).uid,
+        options_tileset(path, rows=[0, 1]).uid,
+        options_tileset(path, rows=[1, 0]).uid,
+        options_tileset(path, scale=True).uid,
+    }
+    assert len(uids) == 4
+    assert (
+        options_tileset(path, rows=(0, 1)).uid == options_tileset(path, rows=[0, 1]).uid
+    )
+
+
+def test_explicit_uid_is_kept(tmp_path):
+    tileset = options_tileset(str(tmp_path / "data.mv5"), "foo", rows=[2])
+    assert tileset.uid == "foo"
+
+
+def test_from_recipe_keeps_uid(tmp_path):
+    tileset = options_tileset(str(tmp_path / "data.mv5"), rows=[2], scale=True)
+    assert tileset.recipe is not None
+    assert from_recipe(tileset.recipe).uid == tileset.uid
+
+
+def test_xarray_uid_of_numpy_arrays():
+    np = pytest.importorskip("numpy")
+    data = np.arange(1000.0)
+    uid = xarray(data).uid
+    assert xarray(data).uid == uid
+    assert xarray(data, resolution=10).uid != uid
+    # other arrays, even with the same values
+    assert xarray(data.copy()).uid != uid
+    assert xarray(data.astype(np.float32)).uid != uid
+    assert xarray(data, uid="foo").uid == "foo"
+
+
+def test_xarray_of_lazy_dataarray(tmp_path):
+    xr = pytest.importorskip("xarray")
+    pytest.importorskip("scipy")
+    np = pytest.importorskip("numpy")
+    from hg._tiles import decode_dense_tile
+
+    path = tmp_path / "data.nc"
+    xr.DataArray(np.arange(2048.0), dims=["x"], name="v").to_netcdf(
+        path, engine="scipy"
+    )
+    with xr.open_dataarray(path, engine="scipy") as data:
+        tileset = xarray(data)
+        assert xarray(data).uid == tileset.uid
+        [(_, tile)] = tileset.tiles([f"{tileset.uid}.1.1"])
+        np.testing.assert_array_equal(decode_dense_tile(tile), np.arange(1024.0) + 1024)
+        # neither the uid nor the tiles loaded the whole array
+        assert not data.variable._in_memory
+
+
+def test_xarray_uid_of_dask_arrays():
+    da = pytest.importorskip("dask.array")
+    data = da.arange(1000.0, chunks=100)
+    assert xarray(data).uid == xarray(da.arange(1000.0, chunks=100)).uid
+    assert xarray(data).uid != xarray(data + 1).uid
+
+
+def test_arithmetic_propagates_sources():
+    np = pytest.importorskip("numpy")
+    from hg._tiles import decode_dense_tile, format_dense_tile
+
+    invalidated = []
+
+    def constant(uid, source, value):
+        return LocalTileset(
+            tiles=lambda tids: [
+                (tid, format_dense_tile(np.full(4, value))) for tid in tids
+            ],
+            info=lambda: {"min_pos": [0], "max_pos": [4], "max_zoom": 0},
+            uid=uid,
+            datatype="vector",
+            source=source,
+            invalidate=lambda: invalidated.append(uid),
+        )
+
+    a = constant("a", "/data/a.hitile", 6.0)
+    b = constant("b", ["/data/a.hitile", "/data/b.hitile"], 2.0)
+    ratio = arithmetic(a, b, op="ratio")
+    assert ratio.source == ["/data/a.hitile", "/data/b.hitile"]
+    [(_, tile)] = ratio.tiles(["r.0.0"])
+    np.testing.assert_array_equal(decode_dense_tile(tile), 3.0)
+
+    ratio.invalidate()
+    assert invalidated == ["a", "b"]
+
+
+def dense_tileset(uid, values):
+    np = pytest.importorskip("numpy")
+    from hg._tiles import format_dense_tile
+
+    return LocalTileset(
+        tiles=lambda tids: [
+            (tid, format_dense_tile(np.asarray(values, dtype=float))) for tid in tids
+        ],
+        info=lambda: {"min_pos": [0], "max_pos": [4], "max_zoom": 0},
+        uid=uid,
+        datatype="vector",
+    )
+
+
+nan = float("nan")
+
+
+@pytest.mark.parametrize(
+    "op, pseudocount, expected",
+    [
+        ("sum", 0, [1.0, 2.0, 5.0, 4.0, 0.0]),
+        ("difference", 0, [1.0, 2.0, 1.0, -4.0, 0.0]),
+        # division by zero, and log2 of zero, are NaN rather than inf
+        ("ratio", 0, [nan, nan, 1.5, 0.0, nan]),
+        ("ratio", 1, [2.0, 3.0, 4 / 3, 1 / 5, 1.0]),
+        ("log2ratio", 0, [nan, nan, math.log2(1.5), nan, nan]),
+    ],
+)
+def test_arithmetic_of_dense_tiles(op, pseudocount, expected):
+    np = pytest.importorskip("numpy")
+    from hg._tiles import decode_dense_tile
+
+    a = dense_tileset("a", [1.0, 2.0, 3.0, 0.0, 0.0])
+    b = dense_tileset("b", [0.0, 0.0, 2.0, 4.0, 0.0])
+    combined = arithmetic(a, b, op=op, pseudocount=pseudocount)
+    assert combined.info() == a.info()
+
+    [(tid, tile)] = combined.tiles(["c.0.0"])
+    assert tid == "c.0.0"
+    np.testing.assert_allclose(decode_dense_tile(tile), expected, rtol=1e-3)
+
+
+def test_arithmetic_errors():
+    a = dense_tileset("a", [1.0, 2.0])
+    with pytest.raises(ValueError, match="at least two"):
+        arithmetic(a)
+    with pytest.raises(ValueError, match="Unknown"):
+        arithmetic(a, a, op="product")
+
+    shorter = arithmetic(a, dense_tileset("b", [1.0]), op="sum")
+    [(_, tile)] = shorter.tiles(["c.0.0"])
+    assert tile == {"error": "Tiles have different shapes"}
+
+    sparse = LocalTileset(
+        tiles=lambda tids: [(tid, {"points": []}) for tid in tids],
+        info=a.info,
+        uid="s",
+        datatype="vector",
+    )
+    [(_, tile)] = arithmetic(a, sparse).tiles(["c.0.0"])
+    assert tile == {"error": "Only dense tiles can be combined"}
+
+
+@pytest.fixture
+def fake_bigwig(monkeypatch):
+    """Stands in for `clodius.tiles.bigwig`, files are named by their value.
+
+    Requested tile ids are recorded in `requested`.
+    """
+    np = pytest.importorskip("numpy")
+    from hg._tiles import format_dense_tile
+
+    module = types.ModuleType("clodius.tiles.bigwig")
+    module.requested = []  # type: ignore
+
+    def tileset_info(path):
+        tile_size = 8 if path.endswith("8.bw") else 4
+        return {
+            "min_pos": [0],
+            "max_pos": [16],
+            "max_width": 16,
+            "max_zoom": 2,
+            "tile_size": tile_size,
+        }
+
+    def tiles(path, tids):
+        module.requested.extend(tids)  # type: ignore
+        value = float(path.rsplit("/", 1)[-1].split(".")[0])
+        # clodius may pad the last tile
+        return [(tid, format_dense_tile(np.full(5, value))) for tid in tids]
+
+    module.tileset_info = tileset_info  # type: ignore
+    module.tiles = tiles  # type: ignore
+    monkeypatch.setitem(sys.modules, "clodius", types.ModuleType("clodius"))
+    monkeypatch.setitem(sys.modules, "clodius.tiles", types.ModuleType("clodius.tiles"))
+    monkeypatch.setitem(sys.modules, "clodius.tiles.bigwig", module)
+    return module
+
+
+def test_bigwig_stack(fake_bigwig):
+    np = pytest.importorskip("numpy")
+    from hg._tiles import decode_dense_tile
+
+    stack = bigwig_stack(
+        ["/data/2.bw", "/data/1.bw", "/data/3.bw"], names=["b", "a", "c"]
+    )
+    assert stack.datatype == "multivec"
+    assert stack.source == ["/data/2.bw", "/data/1.bw", "/data/3.bw"]
+    info = stack.info()
+    assert info["shape"] == [4, 3]
+    assert info["row_infos"] == ["b", "a", "c"]
+    assert info["max_zoom"] == 2
+
+    tiles = stack.tiles([f"{stack.uid}.1.0", f"{stack.uid}.1.1"])
+    assert [tid for tid, _ in tiles] == [f"{stack.uid}.1.0", f"{stack.uid}.1.1"]
+    assert sorted(set(fake_bigwig.requested)) == ["x.1.0", "x.1.1"]
+    for _, tile in tiles:
+        assert tile["shape"] == [3, 4]
+        # one row per file, in the order of the files
+        rows = decode_dense_tile(tile).reshape(tile["shape"])
+        np.testing.assert_array_equal(rows, [[2.0] * 4, [1.0] * 4, [3.0] * 4])
+
+
+def test_bigwig_stack_errors(fake_bigwig):
+    with pytest.raises(ValueError, match="at least one"):
+        bigwig_stack([])
+    with pytest.raises(ValueError, match="name for each"):
+        bigwig_stack(["/data/1.bw"], names=["a", "b"])
+    with pytest.raises(ValueError, match="tile_size"):
+        bigwig_stack(["/data/1.bw", "/data/8.bw"])
+
+
+class LoopBoundTileset:
+    """An async tileset whose lock belongs to the loop it was first used on."""
+
+    def __init__(self):
+        self.lock = None
+        self.loop = None
+
+    async def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is None:
+            self.lock, self.loop = asyncio.Lock(), loop
+        assert self.loop is loop, "used from another loop"
+        async with self.lock:
+            await asyncio.sleep(0)
+
+    async def info(self):
+        await self._check_loop()
+        return {"min_pos": [0], "max_pos": [1024], "max_width": 1024, "max_zoom": 2}
+
+    async def tiles(self, tids):
+        await self._check_loop()
+        return [(tid, {"tid": tid}) for tid in tids]
+
+    def tileset(self, uid="a"):
+        return LocalTileset(tiles=self.tiles, info=self.info, uid=uid)
+
+
+def test_run_sync():
+    assert run_sync(lambda x: x + 1, 1) == 2
+    tileset = LoopBoundTileset()
+    assert run_sync(tileset.info)["max_zoom"] == 2
+    assert run_sync(tileset.tiles, ["a.0.0"]) == [("a.0.0", {"tid": "a.0.0"})]
+
+
+def test_run_sync_in_running_loop():
+    tileset = LoopBoundTileset()
+
+    async def main():
+        # e.g. a notebook cell
+        return run_sync(tileset.info), run_sync(tileset.tiles, ["a.0.0"])
+
+    info, tiles = asyncio.run(main())
+    assert info["max_zoom"] == 2
+    assert tiles == [("a.0.0", {"tid": "a.0.0"})]
+
+
+def test_snapshot_of_async_tileset():
+    from hg._snapshot import collect_tiles
+
+    tileset = LoopBoundTileset().tileset()
+    spec = {
+        "views": [
+            {
+                "initialXDomain": [0, 1024],
+                "tracks": {"top": [{"type": "line", "tilesetUid": "a"}]},
+            }
+        ]
+    }
+    infos, tiles = collect_tiles(spec, {"a": tileset})
+    assert infos["a"]["max_zoom"] == 2
+    assert tiles and all(tile == {"tid": tid} for tid, tile in tiles.items())
+
+
+def test_points_uid_hashes_columns():
+    np = pytest.importorskip("numpy")
+    x, y = np.arange(10.0), np.arange(10.0)[::-1]
+    data = {"x": x, "y": y, "a": np.zeros(10), "b": np.ones(10), "c": ["u"] * 10}
+    uid = points("x", "y", data, columns=["a"]).uid
+    assert points(x, y, data, columns=["a"]).uid == uid
+    assert points(x, y, dict(data, a=np.ones(10)), columns=["a"]).uid != uid
+    assert points(x, y, data, columns=["b"]).uid != uid
+    assert (
+        points(x, y, data, columns=["c"]).uid
+        != points(x, y, dict(data, c=["v"] * 10), columns=["c"]).uid
+    )
+
+
+def test_points_default_track():
+    pytest.importorskip("numpy")
+    resource = hg.points([0.0, 1.0], [1.0, 0.0])
+    try:
+        assert resource.track().type == "scatter-point"
+    finally:
+        hg.server.reset()
@@ -0,0 +1,101 @@
+import http.server
+import json
+import threading
+import urllib.request
+from typing import Any
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from hg._httpfile import ConnectionPool
+from hg._upstream import UpstreamClient
+from hg.server import HgServer
+from hg.tilesets import remote
+
+INFO = {"min_pos": [0], "max_pos": [1024], "max_zoom": 2, "tile_size": 256}
+
+
+class UpstreamHandler(http.server.BaseHTTPRequestHandler):
+    """A stand-in HiGlass server whose tiles echo their id."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        ids = parse_qs(url.query).get("d", [])
+        self.server.requests.append((url.path, ids))
+        if url.path == "/api/v1/tileset_info/":
+            body = {uid: dict(INFO) for uid in ids}
+        elif url.path == "/api/v1/tiles/":
+            body = {tid: {"tid": tid} for tid in ids}
+        else:
+            self.send_error(404)
+            return
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def upstream():
+    server: Any = http.server.ThreadingHTTPServer(("127.0.0.1", 0), UpstreamHandler)
+    server.url = f"http://127.0.0.1:{server.server_port}/api/v1"
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(url: str) -> Any:
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def test_info_is_fetched_once(upstream):
+    client = UpstreamClient(upstream.url, connection_pool=ConnectionPool())
+    assert client.info("a") == INFO
+    assert client.info("a") == INFO
+    assert client.requests == 1
+
+
+def test_tiles_are_batched(upstream):
+    client = UpstreamClient(upstream.url, batch_size=8)
+    tids = [f"a.5.{i}" for i in range(20)]
+    tiles = client.tiles(tids + tids[:5])
+    assert tiles == [(tid, {"tid": tid}) for tid in tids]
+    assert client.requests == 3
+    assert sorted(len(ids) for _, ids in upstream.requests) == [4, 8, 8]
+
+
+def test_clients_share_an_executor(upstream):
+    first = UpstreamClient(upstream.url)
+    second = UpstreamClient(upstream.url)
+    assert first._executor is second._executor
+
+
+def test_proxy_caches_tiles(upstream):
+    server = HgServer()
+    try:
+        resource = server.add(remote("a", server=upstream.url).proxy())
+        base = resource.server
+        assert fetch(f"{base}tileset_info/?d=a") == {"a": INFO}
+        for _ in range(2):
+            tiles = fetch(f"{base}tiles/?d=a.0.0&d=a.1.1")
+            assert tiles == {"a.0.0": {"tid": "a.0.0"}, "a.1.1": {"tid": "a.1.1"}}
+        assert [path for path, _ in upstream.requests].count("/api/v1/tiles/") == 1
+
+        # a new tileset under the same uid doesn't get the cached tiles
+        server.reset()
+        resource = server.add(remote("a", server=upstream.url).proxy())
+        fetch(f"{resource.server}tiles/?d=a.0.0")
+        assert [path for path, _ in upstream.requests].count("/api/v1/tiles/") == 2
+    finally:
+        server.reset()